@@ -1,12 +1,30 @@
-from fastapi import FastAPI, HTTPException
+import asyncio
+from datetime import datetime, timezone
+from fastapi import FastAPI, HTTPException, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from database import create_table, add_card_to_database, get_all_cards, delete_card, delete_all_cards, get_collection_stats
-from database import add_card_to_wishlist, get_all_wishlist_cards, delete_wishlist_card, delete_all_wishlist_cards
-import requests
-import json
+from fastapi.responses import StreamingResponse
+from database import create_table, check_collection_stats, rebuild_collection_stats, archive_price_history
+from async_database import add_card_to_database, get_all_cards, delete_card, delete_all_cards, get_collection_stats
+from async_database import add_card_to_wishlist, get_all_wishlist_cards, delete_wishlist_card, delete_all_wishlist_cards
+from async_database import apply_card_batch, apply_wishlist_batch, get_cards_page, get_price_rollups, iter_price_history
+from async_database import open_pool, close_pool, get_cards_by_id, get_table_versions, list_cache_stats, shards
+from async_database import write_queue_stats
+from export import export_response
+from common import catalog, config, metrics
+from common.etag import RenderedCache
+from common.events import Broadcaster
+from common.image_cache import ImageCache, ImageError, image_response
+from common.http_client import UpstreamError, close_clients, get_client
+from common.pagination import DEFAULT_PAGE_SIZE, PageRequestError
+from common.search_cache import SearchCache, search_key
+from common.shards import ShardMiddleware
+from typing import List, Optional
 
 app = FastAPI()
 
+# Route each request to its user's database (see common/shards.py)
+app.add_middleware(ShardMiddleware, router=shards, query_paths=["/api/events"])
+
 # Configure CORS
 app.add_middleware(
     CORSMiddleware,
@@ -15,60 +33,274 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(metrics.MetricsMiddleware)
 
 # Initialize database
 create_table()
 
+search_cache = SearchCache()
+rendered_cache = RenderedCache()
+image_cache = ImageCache()
+broadcaster = Broadcaster()
+metrics.register_cache("search", search_cache)
+metrics.register_cache("rendered", rendered_cache)
+metrics.register_cache("images", image_cache)
+
+# Event list names and the tables behind them
+LIST_TABLES = {'collection': 'pokemon_cards', 'wishlist': 'wishlist'}
+
+@app.on_event("startup")
+async def startup():
+    await open_pool()
+
+@app.on_event("shutdown")
+async def shutdown():
+    broadcaster.close()
+    await close_pool()
+    await close_clients()
+    image_cache.close()
+
+def user_key(key):
+    """A rendered-cache key that is only shared by requests of the same user."""
+    user = shards.current_user()
+    return f"{user}:{key}" if user else key
+
+async def listing(request, table, limit, sort, order, cursor, set_name, rarity, fetch_all):
+    """A collection or wishlist listing, answered 304 or from cache while the table is unchanged."""
+    async def render():
+        # Without paging parameters keep returning the whole list; the
+        # rows are plain database values, so they are encoded as they are
+        if limit is None and cursor is None:
+            return await fetch_all(set_name, rarity)
+        try:
+            return await get_cards_page(table, sort, order, limit or DEFAULT_PAGE_SIZE, cursor,
+                                        set_name, rarity)
+        except PageRequestError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    return await rendered_cache.respond_async(
+        request.headers.get('if-none-match'), user_key(f"{request.url.path}?{request.url.query}"),
+        await get_table_versions(table), render
+    )
+
+async def publish_changes(list_name, result, card_ids=None):
+    """Publish the current rows of the changed cards, unless the write failed.
+
+    ``card_ids`` of None means the whole list was cleared. Collection
+    changes are followed by the updated stats.
+    """
+    if not isinstance(result, dict) or "error" in result:
+        return result
+    channel = shards.current_user()
+    if card_ids is None:
+        broadcaster.publish("cards_changed", {"list": list_name, "cards": [], "removed": [], "cleared": True},
+                            channel)
+    else:
+        card_ids = list(dict.fromkeys(card_ids))
+        cards = await get_cards_by_id(LIST_TABLES[list_name], card_ids)
+        found = {card['id'] for card in cards}
+        broadcaster.publish("cards_changed", {
+            "list": list_name,
+            "cards": cards,
+            "removed": [card_id for card_id in card_ids if card_id not in found],
+        }, channel)
+    if list_name == 'collection':
+        broadcaster.publish("stats_changed", await get_collection_stats(), channel)
+    return result
+
+def batch_ids(result):
+    return [item["id"] for item in result.get("results", []) if "error" not in item]
+
 # Card collection endpoints
 @app.get("/api/cards/")
-async def get_cards():
-    return get_all_cards()
+async def get_cards(request: Request, limit: Optional[int] = None, sort: str = "name",
+                    order: str = "asc", cursor: Optional[str] = None,
+                    set_name: Optional[str] = Query(None, alias="set"), rarity: Optional[str] = None):
+    return await listing(request, 'pokemon_cards', limit, sort, order, cursor, set_name, rarity, get_all_cards)
 
 @app.post("/api/cards/")
 async def add_card(card: dict):
-    return add_card_to_database(card)
+    return await publish_changes('collection', await add_card_to_database(card), [card.get('id')])
+
+@app.post("/api/cards/batch")
+async def batch_update_cards(operations: List[dict]):
+    result = await apply_card_batch(operations)
+    return await publish_changes('collection', result, batch_ids(result))
 
 @app.delete("/api/cards/{card_id}")
 async def remove_card(card_id: str):
-    return delete_card(card_id)
+    return await publish_changes('collection', await delete_card(card_id), [card_id])
 
 @app.delete("/api/cards/")
 async def remove_all_cards():
-    return delete_all_cards()
+    return await publish_changes('collection', await delete_all_cards())
 
 # Wishlist endpoints
 @app.get("/api/wishlist/")
-async def get_wishlist():
-    return get_all_wishlist_cards()
+async def get_wishlist(request: Request, limit: Optional[int] = None, sort: str = "name",
+                       order: str = "asc", cursor: Optional[str] = None,
+                       set_name: Optional[str] = Query(None, alias="set"), rarity: Optional[str] = None):
+    return await listing(request, 'wishlist', limit, sort, order, cursor, set_name, rarity,
+                         get_all_wishlist_cards)
 
 @app.post("/api/wishlist/")
 async def add_to_wishlist(card: dict):
-    return add_card_to_wishlist(card)
+    return await publish_changes('wishlist', await add_card_to_wishlist(card), [card.get('id')])
+
+@app.post("/api/wishlist/batch")
+async def batch_update_wishlist(operations: List[dict]):
+    result = await apply_wishlist_batch(operations)
+    return await publish_changes('wishlist', result, batch_ids(result))
 
 @app.delete("/api/wishlist/{card_id}")
 async def remove_from_wishlist(card_id: str):
-    return delete_wishlist_card(card_id)
+    return await publish_changes('wishlist', await delete_wishlist_card(card_id), [card_id])
 
 @app.delete("/api/wishlist/")
 async def clear_wishlist():
-    return delete_all_wishlist_cards()
+    return await publish_changes('wishlist', await delete_all_wishlist_cards())
+
+# Change events
+@app.get("/api/events")
+async def stream_events(request: Request):
+    """Server-sent change events: cards_changed, stats_changed and resync."""
+    return StreamingResponse(
+        broadcaster.subscribe(request.headers.get('last-event-id'), shards.current_user()),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.get("/api/events/stats")
+async def event_stats():
+    return broadcaster.stats()
+
+# Metrics endpoints
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Request, data-layer, SQL and upstream latencies and cache hit ratios."""
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+@app.get("/metrics/slow-queries")
+async def slow_queries():
+    return metrics.slow_queries()
+
+# Export endpoints
+@app.get("/api/export/cards")
+async def export_cards(format: str = "ndjson", columns: Optional[str] = None):
+    return export_response('pokemon_cards', format, columns, filename='collection')
+
+@app.get("/api/export/wishlist")
+async def export_wishlist(format: str = "ndjson", columns: Optional[str] = None):
+    return export_response('wishlist', format, columns)
+
+@app.get("/api/export/price_history")
+async def export_price_history(format: str = "ndjson",
+                               columns: Optional[str] = None,
+                               card_id: Optional[str] = None,
+                               date_from: Optional[str] = Query(None, alias="from"),
+                               date_to: Optional[str] = Query(None, alias="to")):
+    # Includes archived history
+    return export_response(
+        'price_history', format, columns,
+        row_source=lambda selected: iter_price_history(selected, card_id, date_from, date_to)
+    )
 
 # Search endpoint
+SEARCH_PAGE_SIZE = 20
+
+def search_local_catalog(query: str):
+    """Search the local catalog mirror, or return None if it is stale."""
+    conn = catalog.get_connection()
+    if not catalog.is_fresh(conn):
+        return None
+    return catalog.search(conn, query, limit=SEARCH_PAGE_SIZE)
+
+def store_in_local_catalog(cards):
+    conn = catalog.get_connection()
+    with conn:
+        catalog.upsert_cards(conn, cards)
+
 @app.get("/api/search/")
 async def search_cards(query: str):
-    try:
+    cards = await asyncio.to_thread(search_local_catalog, query)
+    if cards:
+        return {"data": cards, "page": 1, "pageSize": SEARCH_PAGE_SIZE,
+                "count": len(cards), "totalCount": len(cards)}
+
+    async def fetch():
         # Make request to Pokemon TCG API
-        response = requests.get(
-            f"https://api.pokemontcg.io/v2/cards",
-            params={"q": f"name:{query}*", "orderBy": "name", "pageSize": 20},
-            headers={"X-Api-Key": ""}
+        result = await get_client(config.POKEMONTCG_API_URL).get_json(
+            "/cards",
+            params={"q": f"name:{query}*", "orderBy": "name", "pageSize": SEARCH_PAGE_SIZE},
+            headers={"X-Api-Key": config.POKEMONTCG_API_KEY}
         )
-        response.raise_for_status()
-        return response.json()
-    except requests.RequestException as e:
+        # Keep what we learned so the next search for these cards stays local
+        await asyncio.to_thread(store_in_local_catalog, result.get("data", []))
+        return result
+
+    try:
+        return await search_cache.get_or_load_async(search_key(query), fetch)
+    except UpstreamError as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/search/stats")
+async def search_cache_stats():
+    return search_cache.stats()
+
+@app.get("/api/lists/stats")
+async def list_stats():
+    return await list_cache_stats()
+
+@app.get("/api/writes/stats")
+async def write_stats():
+    return await write_queue_stats()
+
+@app.get("/api/shards/stats")
+async def shard_stats():
+    return shards.stats()
+
+# Card image endpoints
+@app.get("/api/images")
+async def get_image(request: Request, url: str, w: Optional[int] = None):
+    """A card image from the local image cache; ``w`` asks for a thumbnail that wide."""
+    try:
+        image = await asyncio.to_thread(image_cache.get, url, w)
+    except ImageError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    return image_response(image, request.headers.get('if-none-match'))
+
+@app.get("/api/images/stats")
+async def image_cache_stats():
+    return image_cache.stats()
+
 # Stats endpoint
 @app.get("/api/stats/")
-async def get_stats():
-    return get_collection_stats()
\ No newline at end of file
+async def get_stats(request: Request):
+    # The value history covers the last days up to today (UTC, as SQLite's date('now')),
+    # so the day is part of the key
+    return await rendered_cache.respond_async(
+        request.headers.get('if-none-match'), user_key(f"/api/stats/?day={datetime.now(timezone.utc).date()}"),
+        await get_table_versions('pokemon_cards', 'price_history'), get_collection_stats
+    )
+
+@app.get("/api/stats/history")
+async def get_value_history(date_from: Optional[str] = Query(None, alias="from"),
+                            date_to: Optional[str] = Query(None, alias="to"),
+                            resolution: str = "auto",
+                            card_id: Optional[str] = None):
+    try:
+        return await get_price_rollups(date_from, date_to, resolution, card_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/api/stats/check")
+async def check_stats():
+    return await asyncio.to_thread(check_collection_stats, (await shards.current()).db_path)
+
+@app.post("/api/stats/rebuild")
+async def rebuild_stats():
+    return await asyncio.to_thread(rebuild_collection_stats, (await shards.current()).db_path)
+
+@app.post("/api/price_history/archive")
+async def archive_history(days: Optional[int] = None):
+    return await asyncio.to_thread(archive_price_history, days, (await shards.current()).db_path)
\ No newline at end of file
@@ -0,0 +1,622 @@
+import asyncio
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+
+import aiosqlite
+
+from database import SORT_KEYS, CardRecord
+import rollups
+import stats
+from write_queue import WriteQueue
+from common import config, price_archive, table_versions
+from common.list_cache import ListCache
+from common.metrics import InstrumentedConnection, timed
+from common.shards import ShardRouter
+from common.sqlite_pool import close_pool as close_sync_pool, connection_pragmas
+
+
+class AsyncConnectionPool:
+    """A fixed-size pool of aiosqlite connections.
+
+    Each aiosqlite connection runs its queries on its own worker thread, so
+    handing out several of them lets concurrent requests overlap instead of
+    queueing behind a single connection, and the event loop never blocks on
+    SQLite.
+    """
+
+    def __init__(self, db_path: str, size: int):
+        self.db_path = db_path
+        self.size = size
+        self._idle: "asyncio.Queue[aiosqlite.Connection]" = asyncio.Queue()
+        self._connections = []
+        self._open_lock = asyncio.Lock()
+
+    async def _connect(self) -> aiosqlite.Connection:
+        conn = await aiosqlite.connect(
+            self.db_path,
+            timeout=config.SQLITE_BUSY_TIMEOUT_MS / 1000,
+            cached_statements=config.SQLITE_STATEMENT_CACHE,
+            factory=InstrumentedConnection,
+        )
+        for name, value in connection_pragmas():
+            await conn.execute(f"PRAGMA {name} = {value}")
+        return conn
+
+    async def open(self):
+        """Open all connections up front (called on application startup)."""
+        async with self._open_lock:
+            while len(self._connections) < self.size:
+                conn = await self._connect()
+                self._connections.append(conn)
+                self._idle.put_nowait(conn)
+
+    @asynccontextmanager
+    async def acquire(self):
+        """Borrow a connection for the duration of the block."""
+        if not self._connections:
+            await self.open()
+        conn = await self._idle.get()
+        try:
+            yield conn
+        finally:
+            self._idle.put_nowait(conn)
+
+    @asynccontextmanager
+    async def dedicated(self):
+        """A connection of its own, outside the pool, for the duration of the block.
+
+        For reads that last as long as a client takes to download them
+        (exports), which would otherwise keep a pooled connection from
+        every other request meanwhile.
+        """
+        conn = await self._connect()
+        try:
+            yield conn
+        finally:
+            await conn.close()
+
+    async def close(self):
+        """Close every connection in the pool."""
+        async with self._open_lock:
+            connections, self._connections = self._connections, []
+            self._idle = asyncio.Queue()
+        for conn in connections:
+            await conn.close()
+
+
+class Shard:
+    """One database (a user's, when storage is sharded) with its pool and in-memory lists."""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self.pool = AsyncConnectionPool(db_path, config.SQLITE_ASYNC_POOL_SIZE)
+        # In-memory copies of the lists (see common.list_cache), filterable by set and rarity
+        self.lists = {
+            table: ListCache(CardRecord, SORT_KEYS, {'set': 'set_name', 'rarity': 'rarity'})
+            for table in ('pokemon_cards', 'wishlist')
+        }
+        self.reload_locks = {table: asyncio.Lock() for table in self.lists}
+        # Every write to the lists goes through this database's single writer
+        self.writes = WriteQueue(self.pool)
+
+    async def close(self):
+        await self.writes.close()
+        await self.pool.close()
+        # The connection the migrations ran on
+        close_sync_pool(self.db_path)
+
+
+def _open_shard(db_path):
+    from migrations import run_migrations
+    run_migrations(db_path)
+    return Shard(db_path)
+
+
+# Every function below works on the database of the request being served
+# (see common.shards.ShardMiddleware)
+shards = ShardRouter(_open_shard, Shard.close)
+
+
+async def open_pool():
+    """Open the connections up front when there is a single database."""
+    if not shards.enabled:
+        async with shards.use_async(None) as shard:
+            await shard.pool.open()
+
+
+async def close_pool():
+    await shards.aclose_all()
+
+
+async def _version(conn, table):
+    async with conn.execute('SELECT version FROM table_versions WHERE name = ?', (table,)) as cursor:
+        row = await cursor.fetchone()
+    return row[0] if row else 0
+
+
+async def _current_list(table):
+    """The table's ListCache, reloaded first if the table has changed since it was filled."""
+    shard = await shards.current()
+    cache = shard.lists[table]
+    async with shard.pool.acquire() as conn:
+        if cache.version == await _version(conn, table):
+            return cache
+    async with shard.reload_locks[table]:
+        async with shard.pool.acquire() as conn:
+            # One read transaction, so the rows and the version match
+            await conn.execute('BEGIN')
+            try:
+                version = await _version(conn, table)
+                if cache.version != version:
+                    async with conn.execute(f"SELECT {', '.join(cache.columns)} FROM {table}") as cursor:
+                        cache.load(await cursor.fetchall(), version)
+            finally:
+                await conn.commit()
+    return cache
+
+
+async def _read_back(conn, table, card_ids):
+    """The table version and the rows of ``card_ids`` as this transaction has left them."""
+    columns = ', '.join(CardRecord.__slots__)
+    rows = []
+    for start in range(0, len(card_ids), 500):
+        chunk = card_ids[start:start + 500]
+        placeholders = ', '.join('?' * len(chunk))
+        async with conn.execute(f'SELECT {columns} FROM {table} WHERE id IN ({placeholders})', chunk) as cursor:
+            rows.extend(await cursor.fetchall())
+    return await _version(conn, table), rows
+
+
+async def _fetch_dicts(conn, query, params=()):
+    async with conn.execute(query, params) as cursor:
+        columns = [description[0] for description in cursor.description]
+        return [dict(zip(columns, row)) for row in await cursor.fetchall()]
+
+
+@timed
+async def get_table_versions(*tables):
+    """Current change counters of ``tables``; bumped by every write to them."""
+    shard = await shards.current()
+    async with shard.pool.acquire() as conn:
+        async with conn.execute(table_versions.versions_query(tables), tables) as cursor:
+            found = dict(await cursor.fetchall())
+    return {table: found.get(table, 0) for table in tables}
+
+
+@timed
+async def get_all_cards(set_name=None, rarity=None):
+    return (await _current_list('pokemon_cards')).cards(set=set_name, rarity=rarity)
+
+
+@timed
+async def get_cards_by_id(table, card_ids):
+    """The rows of ``card_ids`` that are in ``table``."""
+    return (await _current_list(table)).get_many(card_ids)
+
+
+@timed
+async def get_cards_page(table, sort, order, limit, cursor=None, set_name=None, rarity=None):
+    """One keyset-paginated page of the collection or wishlist."""
+    return (await _current_list(table)).page(sort, order, limit, cursor, set=set_name, rarity=rarity)
+
+
+async def list_cache_stats():
+    shard = await shards.current()
+    return {table: cache.stats() for table, cache in shard.lists.items()}
+
+
+async def write_queue_stats():
+    shard = await shards.current()
+    return shard.writes.stats()
+
+
+async def _add_card(conn, shard, card_data):
+    before = await _version(conn, 'pokemon_cards')
+    # One statement, so concurrent adds of the same card never lose an increment
+    await conn.execute('''
+        INSERT INTO pokemon_cards (id, name, set_name, rarity, image_url, price, card_number)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (id) DO UPDATE SET quantity = quantity + 1
+    ''', (
+        card_data['id'],
+        card_data['name'],
+        card_data['set_name'],
+        card_data['rarity'],
+        card_data['image_url'],
+        card_data['price'],
+        card_data['card_number']
+    ))
+
+    # Add price history entry
+    await conn.execute('''
+        INSERT INTO price_history (card_id, price)
+        VALUES (?, ?)
+    ''', (card_data['id'], card_data['price']))
+
+    after, rows = await _read_back(conn, 'pokemon_cards', [card_data['id']])
+    return ({"message": "Card added successfully"},
+            lambda: shard.lists['pokemon_cards'].apply(before, after, [card_data['id']], rows))
+
+
+@timed
+async def add_card_to_database(card_data):
+    shard = await shards.current()
+    try:
+        return await shard.writes.submit(_add_card, shard, card_data)
+
+    except Exception as e:
+        print(f"Error adding card: {e}")
+        return {"error": str(e)}
+
+
+async def _delete_card(conn, shard, card_id):
+    before = await _version(conn, 'pokemon_cards')
+    # Decrease quantity by 1, or delete the card if quantity would become 0,
+    # without reading the quantity first
+    async with conn.execute('UPDATE pokemon_cards SET quantity = quantity - 1 WHERE id = ? AND quantity > 1',
+                            (card_id,)) as cursor:
+        changed = cursor.rowcount
+    if not changed:
+        async with conn.execute('DELETE FROM pokemon_cards WHERE id = ?', (card_id,)) as cursor:
+            changed = cursor.rowcount
+    if not changed:
+        return {"error": "Card not found"}, None
+
+    after, rows = await _read_back(conn, 'pokemon_cards', [card_id])
+    return ({"message": "Card deleted successfully"},
+            lambda: shard.lists['pokemon_cards'].apply(before, after, [card_id], rows))
+
+
+@timed
+async def delete_card(card_id):
+    shard = await shards.current()
+    try:
+        return await shard.writes.submit(_delete_card, shard, card_id)
+
+    except Exception as e:
+        print(f"Error deleting card: {e}")
+        return {"error": str(e)}
+
+
+async def _delete_all_cards(conn, shard):
+    before = await _version(conn, 'pokemon_cards')
+    await conn.execute('DELETE FROM pokemon_cards')
+    await conn.execute('DELETE FROM price_history')
+    await conn.execute('DELETE FROM price_archive')
+    for resolution in rollups.STORED_RESOLUTIONS:
+        await conn.execute(f'DELETE FROM price_rollup_{resolution}')
+        await conn.execute(f'DELETE FROM value_rollup_{resolution}')
+    after = await _version(conn, 'pokemon_cards')
+    return ({"message": "All cards deleted successfully"},
+            lambda: shard.lists['pokemon_cards'].clear(before, after))
+
+
+@timed
+async def delete_all_cards():
+    shard = await shards.current()
+    try:
+        return await shard.writes.submit(_delete_all_cards, shard)
+
+    except Exception as e:
+        print(f"Error deleting all cards: {e}")
+        return {"error": str(e)}
+
+
+@timed
+async def get_collection_stats():
+    shard = await shards.current()
+    async with shard.pool.acquire() as conn:
+        try:
+            # Every figure comes from the trigger-maintained stats tables
+            async with conn.execute(stats.TOTALS_QUERY) as cursor:
+                totals = await cursor.fetchone()
+            rarity_distribution = await _fetch_dicts(conn, stats.RARITY_QUERY)
+            set_distribution = await _fetch_dicts(conn, stats.SET_QUERY)
+            value_history = await _fetch_dicts(conn, stats.VALUE_HISTORY_QUERY)
+            return stats.format_stats(totals, rarity_distribution, set_distribution, value_history)
+
+        except Exception as e:
+            print(f"Error getting collection stats: {e}")
+            return {"error": str(e)}
+
+
+@timed
+async def get_price_rollups(date_from=None, date_to=None, resolution='auto', card_id=None):
+    """Portfolio value (or one card's OHLC) series from the rollup tables.
+
+    Raises ValueError for an invalid date or resolution.
+    """
+    # Buckets are keyed in UTC (SQLite's datetime('now')), and so is the default end
+    end = rollups.parse_moment(date_to, datetime.now(timezone.utc).replace(tzinfo=None))
+    start = rollups.parse_moment(date_from, None)
+    shard = await shards.current()
+    async with shard.pool.acquire() as conn:
+        if start is None:
+            # Default to the whole history, read cheaply off the weekly table
+            async with conn.execute('SELECT MIN(bucket) FROM value_rollup_week') as cursor:
+                earliest = (await cursor.fetchone())[0]
+            start = datetime.fromisoformat(earliest) if earliest else end
+        resolution = rollups.choose_resolution(start, end, resolution)
+        sql, params = rollups.history_query(start, end, resolution, card_id)
+        points = await _fetch_dicts(conn, sql, params)
+    return {
+        "resolution": resolution,
+        "from": start.isoformat(sep=' '),
+        "to": end.isoformat(sep=' '),
+        "card_id": card_id,
+        "points": points
+    }
+
+
+@timed
+async def get_all_wishlist_cards(set_name=None, rarity=None):
+    return (await _current_list('wishlist')).cards(set=set_name, rarity=rarity)
+
+
+async def _add_to_wishlist(conn, shard, card_data):
+    before = await _version(conn, 'wishlist')
+    await conn.execute('''
+        INSERT INTO wishlist (id, name, set_name, rarity, image_url, price, card_number)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (id) DO UPDATE SET quantity = quantity + 1
+    ''', (
+        card_data['id'],
+        card_data['name'],
+        card_data['set_name'],
+        card_data['rarity'],
+        card_data['image_url'],
+        card_data['price'],
+        card_data['card_number']
+    ))
+
+    after, rows = await _read_back(conn, 'wishlist', [card_data['id']])
+    return ({"message": "Card added to wishlist successfully"},
+            lambda: shard.lists['wishlist'].apply(before, after, [card_data['id']], rows))
+
+
+@timed
+async def add_card_to_wishlist(card_data):
+    shard = await shards.current()
+    try:
+        return await shard.writes.submit(_add_to_wishlist, shard, card_data)
+
+    except Exception as e:
+        print(f"Error adding card to wishlist: {e}")
+        return {"error": str(e)}
+
+
+async def _delete_from_wishlist(conn, shard, card_id):
+    before = await _version(conn, 'wishlist')
+    await conn.execute('DELETE FROM wishlist WHERE id = ?', (card_id,))
+    after = await _version(conn, 'wishlist')
+    return ({"message": "Card removed from wishlist successfully"},
+            lambda: shard.lists['wishlist'].apply(before, after, [card_id], []))
+
+
+@timed
+async def delete_wishlist_card(card_id):
+    shard = await shards.current()
+    try:
+        return await shard.writes.submit(_delete_from_wishlist, shard, card_id)
+
+    except Exception as e:
+        print(f"Error removing card from wishlist: {e}")
+        return {"error": str(e)}
+
+
+async def _clear_wishlist(conn, shard):
+    before = await _version(conn, 'wishlist')
+    await conn.execute('DELETE FROM wishlist')
+    after = await _version(conn, 'wishlist')
+    return ({"message": "Wishlist cleared successfully"},
+            lambda: shard.lists['wishlist'].clear(before, after))
+
+
+@timed
+async def delete_all_wishlist_cards():
+    shard = await shards.current()
+    try:
+        return await shard.writes.submit(_clear_wishlist, shard)
+
+    except Exception as e:
+        print(f"Error clearing wishlist: {e}")
+        return {"error": str(e)}
+
+
+@timed
+async def get_wishlist_card_details(card_id):
+    try:
+        cards = (await _current_list('wishlist')).get_many([card_id])
+        return cards[0] if cards else None
+
+    except Exception as e:
+        print(f"Error getting wishlist card details: {e}")
+        return None
+
+
+CARD_FIELDS = ('id', 'name', 'set_name', 'rarity', 'image_url', 'price', 'card_number')
+BATCH_OPS = ('add', 'remove', 'set_quantity')
+
+
+def _plan_batch(operations, current):
+    """Replay a batch of operations against the current quantities.
+
+    Returns the per-item results, the final quantity of every touched card,
+    the card data for cards that must be inserted, and the (id, price)
+    pairs to record in price history. Invalid items get an error result and
+    are otherwise ignored; they never abort the rest of the batch.
+    """
+    quantities = dict(current)
+    new_cards = {}
+    prices = []
+    results = []
+
+    for index, operation in enumerate(operations):
+        op = operation.get('op')
+        card = operation.get('card') or {}
+        card_id = operation.get('id') or card.get('id')
+        if op not in BATCH_OPS:
+            results.append({"index": index, "id": card_id, "error": f"Unknown op {op!r}"})
+            continue
+        if not card_id:
+            results.append({"index": index, "id": None, "error": "Missing card id"})
+            continue
+
+        quantity = operation.get('quantity', 1)
+        if not isinstance(quantity, int) or quantity < (0 if op == 'set_quantity' else 1):
+            results.append({"index": index, "id": card_id, "error": "Invalid quantity"})
+            continue
+
+        if op == 'add':
+            if card_id not in current and card_id not in new_cards:
+                missing = [field for field in CARD_FIELDS if field not in card]
+                if missing:
+                    results.append({"index": index, "id": card_id,
+                                    "error": f"Missing fields: {', '.join(missing)}"})
+                    continue
+                new_cards[card_id] = card
+            quantities[card_id] = quantities.get(card_id, 0) + quantity
+            if 'price' in card:
+                prices.append((card_id, card['price']))
+        elif quantities.get(card_id, 0) == 0:
+            results.append({"index": index, "id": card_id, "error": "Card not found"})
+            continue
+        elif op == 'remove':
+            quantities[card_id] = max(quantities[card_id] - quantity, 0)
+        else:
+            quantities[card_id] = quantity
+
+        results.append({"index": index, "id": card_id, "quantity": quantities[card_id]})
+
+    return results, quantities, new_cards, prices
+
+
+async def _write_batch(conn, shard, table, operations, record_prices):
+    card_ids = list({op.get('id') or (op.get('card') or {}).get('id') for op in operations} - {None})
+    before = await _version(conn, table)
+
+    # The writer holds the write lock, so these quantities cannot change
+    # before the batch is written
+    current = {}
+    for start in range(0, len(card_ids), 500):
+        chunk = card_ids[start:start + 500]
+        placeholders = ', '.join('?' * len(chunk))
+        async with conn.execute(f'SELECT id, quantity FROM {table} WHERE id IN ({placeholders})',
+                                chunk) as cursor:
+            current.update(await cursor.fetchall())
+
+    results, quantities, new_cards, prices = _plan_batch(operations, current)
+
+    inserts = [
+        (*(new_cards[card_id][field] for field in CARD_FIELDS), quantities[card_id])
+        for card_id in new_cards if quantities[card_id] > 0
+    ]
+    updates = [
+        (quantity, card_id) for card_id, quantity in quantities.items()
+        if card_id not in new_cards and quantity > 0 and quantity != current.get(card_id)
+    ]
+    deletes = [
+        (card_id,) for card_id, quantity in quantities.items()
+        if quantity == 0 and card_id in current
+    ]
+
+    await conn.executemany(f'''
+        INSERT INTO {table} (id, name, set_name, rarity, image_url, price, card_number, quantity)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (id) DO UPDATE SET quantity = excluded.quantity
+    ''', inserts)
+    await conn.executemany(f'UPDATE {table} SET quantity = ? WHERE id = ?', updates)
+    await conn.executemany(f'DELETE FROM {table} WHERE id = ?', deletes)
+    if record_prices:
+        await conn.executemany('INSERT INTO price_history (card_id, price) VALUES (?, ?)', prices)
+
+    after, rows = await _read_back(conn, table, list(quantities))
+    return ({
+        "message": "Batch applied successfully",
+        "applied": sum(1 for result in results if "error" not in result),
+        "failed": sum(1 for result in results if "error" in result),
+        "results": results
+    }, lambda: shard.lists[table].apply(before, after, quantities, rows))
+
+
+async def _apply_batch(table, operations, record_prices):
+    shard = await shards.current()
+    try:
+        return await shard.writes.submit(_write_batch, shard, table, operations, record_prices)
+
+    except Exception as e:
+        print(f"Error applying batch to {table}: {e}")
+        return {"error": str(e)}
+
+
+@timed
+async def apply_card_batch(operations):
+    """Apply add/remove/set_quantity operations to the collection in one transaction."""
+    return await _apply_batch('pokemon_cards', operations, record_prices=True)
+
+
+@timed
+async def apply_wishlist_batch(operations):
+    """Apply add/remove/set_quantity operations to the wishlist in one transaction."""
+    return await _apply_batch('wishlist', operations, record_prices=False)
+
+
+EXPORT_COLUMNS = {
+    'pokemon_cards': ('id', 'name', 'set_name', 'rarity', 'image_url', 'condition',
+                      'quantity', 'price', 'card_number', 'added_date'),
+    'wishlist': ('id', 'name', 'set_name', 'rarity', 'image_url', 'condition',
+                 'quantity', 'price', 'card_number', 'added_date'),
+    'price_history': ('id', 'card_id', 'price', 'date'),
+}
+
+
+async def iter_rows(table, columns, filters=(), order_by='rowid', batch_size=500):
+    """Stream rows of a table as tuples without materialising the result.
+
+    ``columns`` must be a subset of EXPORT_COLUMNS[table]; ``filters`` is a
+    sequence of (sql condition, value) pairs ANDed into the WHERE clause.
+    """
+    where = ' AND '.join(condition for condition, _ in filters) or '1'
+    params = [value for _, value in filters]
+    query = f'SELECT {", ".join(columns)} FROM {table} WHERE {where} ORDER BY {order_by}'
+
+    shard = await shards.current()
+    async with shard.pool.dedicated() as conn:
+        async with conn.execute(query, params) as cursor:
+            cursor.arraysize = batch_size
+            while True:
+                rows = await cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield row
+
+
+async def iter_price_history(columns, card_id=None, date_from=None, date_to=None, batch_size=500):
+    """Stream price history rows, archived months first, then the live table.
+
+    Archived points have no row id, so ``id`` is None for them.
+    """
+    sql, params = price_archive.archive_query(card_id, date_from, date_to)
+    shard = await shards.current()
+    async with shard.pool.dedicated() as conn:
+        async with conn.execute(sql, params) as cursor:
+            cursor.arraysize = batch_size
+            while True:
+                blobs = await cursor.fetchmany(batch_size)
+                if not blobs:
+                    break
+                for blob_card_id, data in blobs:
+                    for date, price in price_archive.blob_points(data, date_from, date_to):
+                        point = {'id': None, 'card_id': blob_card_id, 'price': price, 'date': date}
+                        yield tuple(point[column] for column in columns)
+
+    filters = []
+    if card_id:
+        filters.append(('card_id = ?', card_id))
+    if date_from:
+        filters.append(('date >= ?', date_from))
+    if date_to:
+        filters.append(('date < ?', date_to))
+    async for row in iter_rows('price_history', columns, filters, batch_size=batch_size):
+        yield row
@@ -0,0 +1,68 @@
+import csv
+import io
+import json
+
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+
+from async_database import EXPORT_COLUMNS, iter_rows
+
+MEDIA_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+
+def select_columns(table, columns):
+    """Validate a comma-separated column list against the export whitelist."""
+    allowed = EXPORT_COLUMNS[table]
+    if not columns:
+        return allowed
+    selected = tuple(column.strip() for column in columns.split(',') if column.strip())
+    unknown = [column for column in selected if column not in allowed]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown columns: {', '.join(unknown)}")
+    return selected
+
+
+async def _ndjson_chunks(columns, rows, rows_per_chunk):
+    lines = []
+    async for row in rows:
+        lines.append(json.dumps(dict(zip(columns, row))))
+        if len(lines) >= rows_per_chunk:
+            yield '\n'.join(lines) + '\n'
+            lines = []
+    if lines:
+        yield '\n'.join(lines) + '\n'
+
+
+async def _csv_chunks(columns, rows, rows_per_chunk):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    count = 0
+    async for row in rows:
+        writer.writerow(row)
+        count += 1
+        if count >= rows_per_chunk:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            count = 0
+    yield buffer.getvalue()
+
+
+def export_response(table, fmt, columns=None, filters=(), filename=None, rows_per_chunk=500,
+                    row_source=None):
+    """Build a chunked NDJSON or CSV response streaming rows straight off the cursor.
+
+    ``row_source``, if given, is called with the selected columns and used
+    instead of a plain scan of ``table``.
+    """
+    if fmt not in MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail=f"Unsupported format {fmt!r}")
+    columns = select_columns(table, columns)
+    rows = row_source(columns) if row_source else iter_rows(table, columns, filters)
+    chunks = (_ndjson_chunks if fmt == 'ndjson' else _csv_chunks)(columns, rows, rows_per_chunk)
+    headers = {'Content-Disposition': f'attachment; filename="{filename or table}.{fmt}"'}
+    return StreamingResponse(chunks, media_type=MEDIA_TYPES[fmt], headers=headers)
@@ -0,0 +1,578 @@
+"""Schema migrations for the api_server database.
+
+Append new migrations to the end of MIGRATIONS; never edit one that has
+shipped. Statements and data fixes are written out here rather than built
+from constants or functions elsewhere, so a shipped migration cannot change
+under later edits. Apply them to a database file by hand with::
+
+    python migrations.py path/to/pokemon_cards.db
+"""
+import sys
+
+import database  # noqa: F401  (puts the shared ``common`` package on sys.path)
+from common.migrations import Migration, migrate
+from common.sqlite_pool import get_pool
+
+CARD_TABLE_COLUMNS = '''
+    id TEXT PRIMARY KEY,
+    name TEXT,
+    set_name TEXT,
+    rarity TEXT,
+    image_url TEXT,
+    condition TEXT DEFAULT 'Near Mint',
+    quantity INTEGER DEFAULT 1,
+    price REAL,
+    card_number TEXT,
+    added_date TEXT DEFAULT (datetime('now'))
+'''
+
+CONDITIONS = ['Near Mint', 'Lightly Played', 'Moderately Played', 'Heavily Played', 'Damaged']
+
+
+def _insert_default_conditions(conn):
+    conn.executemany('INSERT OR IGNORE INTO card_conditions (name) VALUES (?)',
+                     [(condition,) for condition in CONDITIONS])
+
+
+def _pagination_indexes():
+    expressions = {
+        'name': "IFNULL(name, '')",
+        'price': 'IFNULL(price, 0)',
+        'added_date': "IFNULL(added_date, '')",
+        'set': "IFNULL(set_name, '')",
+    }
+    return [
+        f'CREATE INDEX IF NOT EXISTS idx_{table}_{sort} ON {table} ({expression}, id)'
+        for table in ('pokemon_cards', 'wishlist')
+        for sort, expression in expressions.items()
+    ]
+
+
+def _fill_stats(conn):
+    # Migration 4 as it shipped: the aggregates recomputed from pokemon_cards
+    conn.execute('DELETE FROM stats_rarity')
+    conn.execute('DELETE FROM stats_sets')
+    conn.execute('''
+        UPDATE stats_totals SET
+            unique_cards = (SELECT COUNT(*) FROM pokemon_cards),
+            total_cards = (SELECT IFNULL(SUM(quantity), 0) FROM pokemon_cards),
+            total_value = (SELECT IFNULL(SUM(price * quantity), 0) FROM pokemon_cards)
+        WHERE id = 1
+    ''')
+    conn.execute('''
+        INSERT INTO stats_rarity (rarity, count)
+        SELECT rarity, COUNT(*) FROM pokemon_cards GROUP BY rarity
+    ''')
+    conn.execute('''
+        INSERT INTO stats_sets (set_name, count, total_quantity, total_value)
+        SELECT set_name, COUNT(*), IFNULL(SUM(quantity), 0), IFNULL(SUM(price * quantity), 0)
+        FROM pokemon_cards GROUP BY set_name
+    ''')
+
+
+def _fill_stats_value_history(conn):
+    # Migration 4 as it shipped also rebuilt the value history (dropped again by migration 5)
+    conn.execute('''
+        INSERT OR REPLACE INTO stats_value_history (date, value, points)
+        SELECT date, IFNULL(SUM(price), 0), COUNT(*) FROM price_history GROUP BY date
+    ''')
+
+
+def _fill_price_rollups(conn):
+    # Migration 5 as it shipped: every bucket recomputed from price_history
+    # (value_rollup_* follow through the triggers on the price rollups)
+    buckets = {
+        'hour': "strftime('%Y-%m-%d %H:00:00', date)",
+        'day': 'date(date)',
+        'week': "date(date, 'weekday 0', '-6 days')",
+    }
+    for resolution, bucket in buckets.items():
+        conn.execute(f'''
+            INSERT INTO price_rollup_{resolution}
+                (card_id, bucket, open, high, low, close, open_date, close_date, points)
+            SELECT card_id, bucket,
+                   MAX(CASE WHEN is_first = 1 THEN price END), MAX(price), MIN(price),
+                   MAX(CASE WHEN is_last = 1 THEN price END), MIN(date), MAX(date), COUNT(*)
+            FROM (
+                SELECT card_id, price, date, {bucket} AS bucket,
+                       ROW_NUMBER() OVER (PARTITION BY card_id, {bucket} ORDER BY date, id) AS is_first,
+                       ROW_NUMBER() OVER (PARTITION BY card_id, {bucket} ORDER BY date DESC, id DESC) AS is_last
+                FROM price_history
+                WHERE price IS NOT NULL
+            )
+            GROUP BY card_id, bucket
+        ''')
+
+
+MIGRATIONS = [
+    # Files created before versioning already have these tables, hence IF NOT EXISTS
+    Migration(1, "Base schema", [
+        f'CREATE TABLE IF NOT EXISTS pokemon_cards ({CARD_TABLE_COLUMNS})',
+        '''
+        CREATE TABLE IF NOT EXISTS price_history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            card_id TEXT,
+            price REAL,
+            date TEXT DEFAULT (datetime('now')),
+            FOREIGN KEY (card_id) REFERENCES pokemon_cards (id)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS card_conditions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT UNIQUE
+        )
+        ''',
+        _insert_default_conditions,
+        f'CREATE TABLE IF NOT EXISTS wishlist ({CARD_TABLE_COLUMNS})',
+    ]),
+    Migration(2, "Keyset pagination indexes", _pagination_indexes()),
+    Migration(3, "Hot-path indexes for price history and stats", [
+        # Price history per card, in date order, answered from the index alone
+        'CREATE INDEX IF NOT EXISTS idx_price_history_card_date ON price_history (card_id, date, price)',
+        # Value history grouped by date
+        'CREATE INDEX IF NOT EXISTS idx_price_history_date ON price_history (date, price)',
+        # Rarity and set distributions
+        'CREATE INDEX IF NOT EXISTS idx_pokemon_cards_rarity ON pokemon_cards (rarity)',
+        'CREATE INDEX IF NOT EXISTS idx_pokemon_cards_set_stats ON pokemon_cards (set_name, quantity, price)',
+        'CREATE INDEX IF NOT EXISTS idx_wishlist_rarity ON wishlist (rarity)',
+    ]),
+    Migration(4, "Trigger-maintained collection statistics", [
+        '''
+        CREATE TABLE IF NOT EXISTS stats_totals (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            unique_cards INTEGER NOT NULL DEFAULT 0,
+            total_cards INTEGER NOT NULL DEFAULT 0,
+            total_value REAL NOT NULL DEFAULT 0
+        )
+        ''',
+        'INSERT OR IGNORE INTO stats_totals (id) VALUES (1)',
+        'CREATE TABLE IF NOT EXISTS stats_rarity (rarity TEXT, count INTEGER NOT NULL)',
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_stats_rarity ON stats_rarity (rarity)',
+        '''
+        CREATE TABLE IF NOT EXISTS stats_sets (
+            set_name TEXT,
+            count INTEGER NOT NULL,
+            total_quantity INTEGER NOT NULL,
+            total_value REAL NOT NULL
+        )
+        ''',
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_stats_sets ON stats_sets (set_name)',
+        '''
+        CREATE TABLE IF NOT EXISTS stats_value_history (
+            date TEXT PRIMARY KEY,
+            value REAL NOT NULL,
+            points INTEGER NOT NULL
+        )
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS stats_cards_insert AFTER INSERT ON pokemon_cards BEGIN
+            UPDATE stats_totals SET
+                unique_cards = unique_cards + 1,
+                total_cards = total_cards + IFNULL(NEW.quantity, 0),
+                total_value = total_value + IFNULL(NEW.price * NEW.quantity, 0)
+            WHERE id = 1;
+
+            INSERT INTO stats_rarity (rarity, count)
+            SELECT NEW.rarity, 0
+            WHERE NOT EXISTS (SELECT 1 FROM stats_rarity WHERE rarity IS NEW.rarity);
+            UPDATE stats_rarity SET count = count + 1 WHERE rarity IS NEW.rarity;
+            DELETE FROM stats_rarity WHERE rarity IS NEW.rarity AND count <= 0;
+
+            INSERT INTO stats_sets (set_name, count, total_quantity, total_value)
+            SELECT NEW.set_name, 0, 0, 0
+            WHERE NOT EXISTS (SELECT 1 FROM stats_sets WHERE set_name IS NEW.set_name);
+            UPDATE stats_sets SET
+                count = count + 1,
+                total_quantity = total_quantity + IFNULL(NEW.quantity, 0),
+                total_value = total_value + IFNULL(NEW.price * NEW.quantity, 0)
+            WHERE set_name IS NEW.set_name;
+            DELETE FROM stats_sets WHERE set_name IS NEW.set_name AND count <= 0;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS stats_cards_delete AFTER DELETE ON pokemon_cards BEGIN
+            UPDATE stats_totals SET
+                unique_cards = unique_cards - 1,
+                total_cards = total_cards - IFNULL(OLD.quantity, 0),
+                total_value = total_value - IFNULL(OLD.price * OLD.quantity, 0)
+            WHERE id = 1;
+
+            INSERT INTO stats_rarity (rarity, count)
+            SELECT OLD.rarity, 0
+            WHERE NOT EXISTS (SELECT 1 FROM stats_rarity WHERE rarity IS OLD.rarity);
+            UPDATE stats_rarity SET count = count - 1 WHERE rarity IS OLD.rarity;
+            DELETE FROM stats_rarity WHERE rarity IS OLD.rarity AND count <= 0;
+
+            INSERT INTO stats_sets (set_name, count, total_quantity, total_value)
+            SELECT OLD.set_name, 0, 0, 0
+            WHERE NOT EXISTS (SELECT 1 FROM stats_sets WHERE set_name IS OLD.set_name);
+            UPDATE stats_sets SET
+                count = count - 1,
+                total_quantity = total_quantity - IFNULL(OLD.quantity, 0),
+                total_value = total_value - IFNULL(OLD.price * OLD.quantity, 0)
+            WHERE set_name IS OLD.set_name;
+            DELETE FROM stats_sets WHERE set_name IS OLD.set_name AND count <= 0;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS stats_cards_update
+        AFTER UPDATE OF quantity, price, rarity, set_name ON pokemon_cards BEGIN
+            UPDATE stats_totals SET
+                unique_cards = unique_cards - 1,
+                total_cards = total_cards - IFNULL(OLD.quantity, 0),
+                total_value = total_value - IFNULL(OLD.price * OLD.quantity, 0)
+            WHERE id = 1;
+
+            INSERT INTO stats_rarity (rarity, count)
+            SELECT OLD.rarity, 0
+            WHERE NOT EXISTS (SELECT 1 FROM stats_rarity WHERE rarity IS OLD.rarity);
+            UPDATE stats_rarity SET count = count - 1 WHERE rarity IS OLD.rarity;
+            DELETE FROM stats_rarity WHERE rarity IS OLD.rarity AND count <= 0;
+
+            INSERT INTO stats_sets (set_name, count, total_quantity, total_value)
+            SELECT OLD.set_name, 0, 0, 0
+            WHERE NOT EXISTS (SELECT 1 FROM stats_sets WHERE set_name IS OLD.set_name);
+            UPDATE stats_sets SET
+                count = count - 1,
+                total_quantity = total_quantity - IFNULL(OLD.quantity, 0),
+                total_value = total_value - IFNULL(OLD.price * OLD.quantity, 0)
+            WHERE set_name IS OLD.set_name;
+            DELETE FROM stats_sets WHERE set_name IS OLD.set_name AND count <= 0;
+
+            UPDATE stats_totals SET
+                unique_cards = unique_cards + 1,
+                total_cards = total_cards + IFNULL(NEW.quantity, 0),
+                total_value = total_value + IFNULL(NEW.price * NEW.quantity, 0)
+            WHERE id = 1;
+
+            INSERT INTO stats_rarity (rarity, count)
+            SELECT NEW.rarity, 0
+            WHERE NOT EXISTS (SELECT 1 FROM stats_rarity WHERE rarity IS NEW.rarity);
+            UPDATE stats_rarity SET count = count + 1 WHERE rarity IS NEW.rarity;
+            DELETE FROM stats_rarity WHERE rarity IS NEW.rarity AND count <= 0;
+
+            INSERT INTO stats_sets (set_name, count, total_quantity, total_value)
+            SELECT NEW.set_name, 0, 0, 0
+            WHERE NOT EXISTS (SELECT 1 FROM stats_sets WHERE set_name IS NEW.set_name);
+            UPDATE stats_sets SET
+                count = count + 1,
+                total_quantity = total_quantity + IFNULL(NEW.quantity, 0),
+                total_value = total_value + IFNULL(NEW.price * NEW.quantity, 0)
+            WHERE set_name IS NEW.set_name;
+            DELETE FROM stats_sets WHERE set_name IS NEW.set_name AND count <= 0;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS stats_price_history_insert AFTER INSERT ON price_history BEGIN
+            INSERT INTO stats_value_history (date, value, points)
+            VALUES (NEW.date, IFNULL(NEW.price, 0), 1)
+            ON CONFLICT (date) DO UPDATE SET
+                value = value + excluded.value,
+                points = points + 1;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS stats_price_history_delete AFTER DELETE ON price_history BEGIN
+            UPDATE stats_value_history SET
+                value = value - IFNULL(OLD.price, 0),
+                points = points - 1
+            WHERE date = OLD.date;
+            DELETE FROM stats_value_history WHERE date = OLD.date AND points <= 0;
+        END
+        ''',
+        _fill_stats,
+        _fill_stats_value_history,
+    ]),
+    Migration(5, "Hourly/daily/weekly price and value rollups", [
+        # Superseded by the rollups
+        'DROP TRIGGER IF EXISTS stats_price_history_insert',
+        'DROP TRIGGER IF EXISTS stats_price_history_delete',
+        'DROP TABLE IF EXISTS stats_value_history',
+        # Hourly buckets
+        '''
+        CREATE TABLE IF NOT EXISTS price_rollup_hour (
+            card_id TEXT NOT NULL,
+            bucket TEXT NOT NULL,
+            open REAL NOT NULL,
+            high REAL NOT NULL,
+            low REAL NOT NULL,
+            close REAL NOT NULL,
+            open_date TEXT NOT NULL,
+            close_date TEXT NOT NULL,
+            points INTEGER NOT NULL,
+            PRIMARY KEY (card_id, bucket)
+        ) WITHOUT ROWID
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_price_rollup_hour_bucket ON price_rollup_hour (bucket)',
+        '''
+        CREATE TABLE IF NOT EXISTS value_rollup_hour (
+            bucket TEXT PRIMARY KEY,
+            value REAL NOT NULL
+        ) WITHOUT ROWID
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS rollup_hour_price_history_insert
+        AFTER INSERT ON price_history WHEN NEW.price IS NOT NULL BEGIN
+            INSERT INTO price_rollup_hour
+                (card_id, bucket, open, high, low, close, open_date, close_date, points)
+            VALUES (NEW.card_id, strftime('%Y-%m-%d %H:00:00', NEW.date),
+                    NEW.price, NEW.price, NEW.price, NEW.price, NEW.date, NEW.date, 1)
+            ON CONFLICT (card_id, bucket) DO UPDATE SET
+                open = CASE WHEN excluded.open_date < open_date THEN excluded.open ELSE open END,
+                open_date = MIN(open_date, excluded.open_date),
+                high = MAX(high, excluded.high),
+                low = MIN(low, excluded.low),
+                close = CASE WHEN excluded.close_date >= close_date THEN excluded.close ELSE close END,
+                close_date = MAX(close_date, excluded.close_date),
+                points = points + 1;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS rollup_hour_value_insert
+        AFTER INSERT ON price_rollup_hour BEGIN
+            INSERT INTO value_rollup_hour (bucket, value) VALUES (NEW.bucket, NEW.close)
+            ON CONFLICT (bucket) DO UPDATE SET value = value + excluded.value;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS rollup_hour_value_update
+        AFTER UPDATE OF close ON price_rollup_hour BEGIN
+            UPDATE value_rollup_hour SET value = value + NEW.close - OLD.close
+            WHERE bucket = NEW.bucket;
+        END
+        ''',
+        # Dayly buckets
+        '''
+        CREATE TABLE IF NOT EXISTS price_rollup_day (
+            card_id TEXT NOT NULL,
+            bucket TEXT NOT NULL,
+            open REAL NOT NULL,
+            high REAL NOT NULL,
+            low REAL NOT NULL,
+            close REAL NOT NULL,
+            open_date TEXT NOT NULL,
+            close_date TEXT NOT NULL,
+            points INTEGER NOT NULL,
+            PRIMARY KEY (card_id, bucket)
+        ) WITHOUT ROWID
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_price_rollup_day_bucket ON price_rollup_day (bucket)',
+        '''
+        CREATE TABLE IF NOT EXISTS value_rollup_day (
+            bucket TEXT PRIMARY KEY,
+            value REAL NOT NULL
+        ) WITHOUT ROWID
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS rollup_day_price_history_insert
+        AFTER INSERT ON price_history WHEN NEW.price IS NOT NULL BEGIN
+            INSERT INTO price_rollup_day
+                (card_id, bucket, open, high, low, close, open_date, close_date, points)
+            VALUES (NEW.card_id, date(NEW.date),
+                    NEW.price, NEW.price, NEW.price, NEW.price, NEW.date, NEW.date, 1)
+            ON CONFLICT (card_id, bucket) DO UPDATE SET
+                open = CASE WHEN excluded.open_date < open_date THEN excluded.open ELSE open END,
+                open_date = MIN(open_date, excluded.open_date),
+                high = MAX(high, excluded.high),
+                low = MIN(low, excluded.low),
+                close = CASE WHEN excluded.close_date >= close_date THEN excluded.close ELSE close END,
+                close_date = MAX(close_date, excluded.close_date),
+                points = points + 1;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS rollup_day_value_insert
+        AFTER INSERT ON price_rollup_day BEGIN
+            INSERT INTO value_rollup_day (bucket, value) VALUES (NEW.bucket, NEW.close)
+            ON CONFLICT (bucket) DO UPDATE SET value = value + excluded.value;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS rollup_day_value_update
+        AFTER UPDATE OF close ON price_rollup_day BEGIN
+            UPDATE value_rollup_day SET value = value + NEW.close - OLD.close
+            WHERE bucket = NEW.bucket;
+        END
+        ''',
+        # Weekly buckets
+        '''
+        CREATE TABLE IF NOT EXISTS price_rollup_week (
+            card_id TEXT NOT NULL,
+            bucket TEXT NOT NULL,
+            open REAL NOT NULL,
+            high REAL NOT NULL,
+            low REAL NOT NULL,
+            close REAL NOT NULL,
+            open_date TEXT NOT NULL,
+            close_date TEXT NOT NULL,
+            points INTEGER NOT NULL,
+            PRIMARY KEY (card_id, bucket)
+        ) WITHOUT ROWID
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_price_rollup_week_bucket ON price_rollup_week (bucket)',
+        '''
+        CREATE TABLE IF NOT EXISTS value_rollup_week (
+            bucket TEXT PRIMARY KEY,
+            value REAL NOT NULL
+        ) WITHOUT ROWID
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS rollup_week_price_history_insert
+        AFTER INSERT ON price_history WHEN NEW.price IS NOT NULL BEGIN
+            INSERT INTO price_rollup_week
+                (card_id, bucket, open, high, low, close, open_date, close_date, points)
+            VALUES (NEW.card_id, date(NEW.date, 'weekday 0', '-6 days'),
+                    NEW.price, NEW.price, NEW.price, NEW.price, NEW.date, NEW.date, 1)
+            ON CONFLICT (card_id, bucket) DO UPDATE SET
+                open = CASE WHEN excluded.open_date < open_date THEN excluded.open ELSE open END,
+                open_date = MIN(open_date, excluded.open_date),
+                high = MAX(high, excluded.high),
+                low = MIN(low, excluded.low),
+                close = CASE WHEN excluded.close_date >= close_date THEN excluded.close ELSE close END,
+                close_date = MAX(close_date, excluded.close_date),
+                points = points + 1;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS rollup_week_value_insert
+        AFTER INSERT ON price_rollup_week BEGIN
+            INSERT INTO value_rollup_week (bucket, value) VALUES (NEW.bucket, NEW.close)
+            ON CONFLICT (bucket) DO UPDATE SET value = value + excluded.value;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS rollup_week_value_update
+        AFTER UPDATE OF close ON price_rollup_week BEGIN
+            UPDATE value_rollup_week SET value = value + NEW.close - OLD.close
+            WHERE bucket = NEW.bucket;
+        END
+        ''',
+        _fill_price_rollups,
+    ]),
+    Migration(6, "Compact archive for old price history", [
+        '''
+        CREATE TABLE IF NOT EXISTS price_archive (
+            card_id TEXT NOT NULL,
+            month TEXT NOT NULL,
+            points INTEGER NOT NULL,
+            first_date TEXT NOT NULL,
+            last_date TEXT NOT NULL,
+            data BLOB NOT NULL,
+            PRIMARY KEY (card_id, month)
+        ) WITHOUT ROWID
+        ''',
+    ]),
+    Migration(7, "Change counters for conditional GETs", [
+        '''
+        CREATE TABLE IF NOT EXISTS table_versions (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL
+        ) WITHOUT ROWID
+        ''',
+        # Counters start from the current time in milliseconds (see common/table_versions.py)
+        '''
+        INSERT OR IGNORE INTO table_versions (name, version)
+        VALUES ('pokemon_cards', CAST((julianday('now') - 2440587.5) * 86400000 AS INTEGER))
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS pokemon_cards_version_insert AFTER INSERT ON pokemon_cards BEGIN
+            UPDATE table_versions SET version = version + 1 WHERE name = 'pokemon_cards';
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS pokemon_cards_version_update AFTER UPDATE ON pokemon_cards BEGIN
+            UPDATE table_versions SET version = version + 1 WHERE name = 'pokemon_cards';
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS pokemon_cards_version_delete AFTER DELETE ON pokemon_cards BEGIN
+            UPDATE table_versions SET version = version + 1 WHERE name = 'pokemon_cards';
+        END
+        ''',
+        '''
+        INSERT OR IGNORE INTO table_versions (name, version)
+        VALUES ('wishlist', CAST((julianday('now') - 2440587.5) * 86400000 AS INTEGER))
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS wishlist_version_insert AFTER INSERT ON wishlist BEGIN
+            UPDATE table_versions SET version = version + 1 WHERE name = 'wishlist';
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS wishlist_version_update AFTER UPDATE ON wishlist BEGIN
+            UPDATE table_versions SET version = version + 1 WHERE name = 'wishlist';
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS wishlist_version_delete AFTER DELETE ON wishlist BEGIN
+            UPDATE table_versions SET version = version + 1 WHERE name = 'wishlist';
+        END
+        ''',
+        '''
+        INSERT OR IGNORE INTO table_versions (name, version)
+        VALUES ('price_history', CAST((julianday('now') - 2440587.5) * 86400000 AS INTEGER))
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS price_history_version_insert AFTER INSERT ON price_history BEGIN
+            UPDATE table_versions SET version = version + 1 WHERE name = 'price_history';
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS price_history_version_update AFTER UPDATE ON price_history BEGIN
+            UPDATE table_versions SET version = version + 1 WHERE name = 'price_history';
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS price_history_version_delete AFTER DELETE ON price_history BEGIN
+            UPDATE table_versions SET version = version + 1 WHERE name = 'price_history';
+        END
+        ''',
+    ]),
+    Migration(8, "Portfolio value rollups from the collection's value", [
+        # value_rollup_* summed the latest price of every card with a price
+        # point in the bucket, whether or not (and however many times) it
+        # was held; they now record the collection's total value instead
+        'DROP TRIGGER IF EXISTS rollup_hour_value_insert',
+        'DROP TRIGGER IF EXISTS rollup_hour_value_update',
+        'DELETE FROM value_rollup_hour',
+        'DROP TRIGGER IF EXISTS rollup_day_value_insert',
+        'DROP TRIGGER IF EXISTS rollup_day_value_update',
+        'DELETE FROM value_rollup_day',
+        'DROP TRIGGER IF EXISTS rollup_week_value_insert',
+        'DROP TRIGGER IF EXISTS rollup_week_value_update',
+        'DELETE FROM value_rollup_week',
+        '''
+        CREATE TRIGGER IF NOT EXISTS value_rollup_stats_totals_update
+        AFTER UPDATE OF total_value ON stats_totals WHEN NEW.total_value IS NOT OLD.total_value BEGIN
+            INSERT INTO value_rollup_hour (bucket, value) VALUES (strftime('%Y-%m-%d %H:00:00', 'now'), NEW.total_value)
+            ON CONFLICT (bucket) DO UPDATE SET value = excluded.value;
+            INSERT INTO value_rollup_day (bucket, value) VALUES (date('now'), NEW.total_value)
+            ON CONFLICT (bucket) DO UPDATE SET value = excluded.value;
+            INSERT INTO value_rollup_week (bucket, value) VALUES (date('now', 'weekday 0', '-6 days'), NEW.total_value)
+            ON CONFLICT (bucket) DO UPDATE SET value = excluded.value;
+        END
+        ''',
+        '''
+        INSERT INTO value_rollup_hour (bucket, value)
+        SELECT strftime('%Y-%m-%d %H:00:00', 'now'), total_value FROM stats_totals WHERE id = 1 AND unique_cards > 0
+        ''',
+        '''
+        INSERT INTO value_rollup_day (bucket, value)
+        SELECT date('now'), total_value FROM stats_totals WHERE id = 1 AND unique_cards > 0
+        ''',
+        '''
+        INSERT INTO value_rollup_week (bucket, value)
+        SELECT date('now', 'weekday 0', '-6 days'), total_value FROM stats_totals WHERE id = 1 AND unique_cards > 0
+        ''',
+    ]),
+]
+
+
+def run_migrations(db_path=None):
+    """Migrate a database file (the configured one by default) to the latest version."""
+    return migrate(get_pool(db_path).connection(), MIGRATIONS)
+
+
+if __name__ == '__main__':
+    print(f"Database is at version {run_migrations(sys.argv[1] if len(sys.argv) > 1 else None)}")
@@ -0,0 +1,186 @@
+"""Time-bucketed rollups of price history and of the collection's value.
+
+Every price_history insert is folded by trigger (see migration 5) into
+hourly, daily and weekly open/high/low/close rows per card
+(``price_rollup_<resolution>``). ``value_rollup_<resolution>`` holds the
+portfolio value - the sum of quantity x price over the cards held, the
+same figure as ``stats_totals.total_value`` - as it stood at the end of
+each bucket in which it changed; a trigger on ``stats_totals`` (see
+migration 8) records it on every change to the collection. Range queries
+read the coarsest table that can answer them, so a chart costs a bounded
+number of rows however much history there is.
+
+Rollups are only ever added to. Deleting price_history rows (for example
+when archiving old history) leaves them alone; clearing the collection
+clears them explicitly. A rebuild recomputes the price rollups from
+price_history and the archive; past values cannot be recomputed (which
+cards were held when is not recorded), so it only refreshes the current
+value buckets.
+"""
+from datetime import datetime, timedelta
+
+import database  # noqa: F401  (puts the shared ``common`` package on sys.path)
+from common import price_archive
+
+# Resolutions stored as tables, finest first, with the SQL that computes
+# a timestamp's bucket and the bucket width in seconds
+STORED_RESOLUTIONS = {
+    'hour': ("strftime('%Y-%m-%d %H:00:00', {date})", 3600),
+    'day': ("date({date})", 86400),
+    'week': ("date({date}, 'weekday 0', '-6 days')", 7 * 86400),
+}
+
+# Resolutions computed by regrouping the daily table
+DERIVED_RESOLUTIONS = {
+    'month': ("strftime('%Y-%m-01', {date})", 30 * 86400),
+    'year': ("strftime('%Y-01-01', {date})", 365 * 86400),
+}
+
+RESOLUTIONS = ('hour', 'day', 'week', 'month', 'year')
+
+# How many points 'auto' aims to stay under
+MAX_POINTS = 400
+
+# Days of daily portfolio value included in /api/stats/
+STATS_HISTORY_DAYS = 365
+
+STATS_VALUE_HISTORY_QUERY = f'''
+    SELECT bucket as date, value
+    FROM value_rollup_day
+    WHERE bucket >= date('now', '-{STATS_HISTORY_DAYS} days')
+    ORDER BY bucket
+'''
+
+
+def record_value(conn):
+    """Write the collection's current value into the current buckets."""
+    for resolution, (bucket_sql, _) in STORED_RESOLUTIONS.items():
+        conn.execute(f'''
+            INSERT INTO value_rollup_{resolution} (bucket, value)
+            SELECT {bucket_sql.format(date="'now'")}, total_value FROM stats_totals WHERE id = 1
+            ON CONFLICT (bucket) DO UPDATE SET value = excluded.value
+        ''')
+
+
+def rebuild_rollups(conn):
+    """Recompute the price rollups from price_history and the archive (inside the caller's transaction)."""
+    for resolution in STORED_RESOLUTIONS:
+        conn.execute(f'DELETE FROM price_rollup_{resolution}')
+    archived = price_archive.load_temp_table(conn)
+    for resolution, (bucket_sql, _) in STORED_RESOLUTIONS.items():
+        bucket = bucket_sql.format(date='date')
+        conn.execute(f'''
+            INSERT INTO price_rollup_{resolution}
+                (card_id, bucket, open, high, low, close, open_date, close_date, points)
+            SELECT card_id, bucket,
+                   MAX(CASE WHEN is_first = 1 THEN price END), MAX(price), MIN(price),
+                   MAX(CASE WHEN is_last = 1 THEN price END), MIN(date), MAX(date), COUNT(*)
+            FROM (
+                SELECT card_id, price, date, {bucket} AS bucket,
+                       ROW_NUMBER() OVER (PARTITION BY card_id, {bucket} ORDER BY date, id) AS is_first,
+                       ROW_NUMBER() OVER (PARTITION BY card_id, {bucket} ORDER BY date DESC, id DESC) AS is_last
+                FROM (
+                    SELECT id, card_id, price, date FROM price_history
+                    UNION ALL
+                    -- Negative ids keep archived points in their original
+                    -- order, ahead of any live point with the same date
+                    SELECT rowid - (SELECT MAX(rowid) FROM {archived}) - 1, card_id, price, date
+                    FROM {archived}
+                )
+                WHERE price IS NOT NULL
+            )
+            GROUP BY card_id, bucket
+        ''')
+    conn.execute(f'DROP TABLE {archived}')
+    record_value(conn)
+
+
+def bucket_start(moment, resolution):
+    """The bucket key a datetime falls into, matching the SQL bucket expressions."""
+    if resolution == 'hour':
+        return moment.strftime('%Y-%m-%d %H:00:00')
+    if resolution == 'day':
+        return moment.strftime('%Y-%m-%d')
+    if resolution == 'week':
+        return (moment - timedelta(days=moment.weekday())).strftime('%Y-%m-%d')
+    if resolution == 'month':
+        return moment.strftime('%Y-%m-01')
+    return moment.strftime('%Y-01-01')
+
+
+def choose_resolution(start, end, requested='auto'):
+    """Pick the requested resolution, or for 'auto' the finest within MAX_POINTS."""
+    if requested != 'auto':
+        if requested not in RESOLUTIONS:
+            raise ValueError(f"resolution must be one of auto, {', '.join(RESOLUTIONS)}")
+        return requested
+    span = (end - start).total_seconds()
+    widths = {**STORED_RESOLUTIONS, **DERIVED_RESOLUTIONS}
+    for resolution in RESOLUTIONS:
+        if span / widths[resolution][1] <= MAX_POINTS:
+            return resolution
+    return 'year'
+
+
+def parse_moment(value, default):
+    if not value:
+        return default
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f"Invalid date {value!r}; use ISO 8601")
+
+
+def history_query(start, end, resolution, card_id=None):
+    """Build the SQL for a value (or single-card OHLC) series.
+
+    Stored resolutions read their own table directly. Month and year are
+    regrouped from the daily tables, taking each card's first open and
+    last close within the period, or the period's last daily value.
+    """
+    if resolution in STORED_RESOLUTIONS:
+        params = [bucket_start(start, resolution), bucket_start(end, resolution)]
+        if card_id is None:
+            sql = f'''
+                SELECT bucket, value FROM value_rollup_{resolution}
+                WHERE bucket BETWEEN ? AND ? ORDER BY bucket
+            '''
+        else:
+            sql = f'''
+                SELECT bucket, open, high, low, close FROM price_rollup_{resolution}
+                WHERE card_id = ? AND bucket BETWEEN ? AND ? ORDER BY bucket
+            '''
+            params.insert(0, card_id)
+        return sql, params
+
+    group = DERIVED_RESOLUTIONS[resolution][0].format(date='bucket')
+    params = [bucket_start(start, resolution), bucket_start(end, 'day')]
+    if card_id is None:
+        # The value at the end of each period is that of its last daily bucket
+        sql = f'''
+            SELECT period AS bucket, value FROM (
+                SELECT {group} AS period, value,
+                       ROW_NUMBER() OVER (PARTITION BY {group} ORDER BY bucket DESC) AS is_last
+                FROM value_rollup_day
+                WHERE bucket BETWEEN ? AND ?
+            )
+            WHERE is_last = 1 ORDER BY period
+        '''
+        return sql, params
+
+    params.append(card_id)
+    sql = f'''
+        SELECT period AS bucket,
+               MAX(CASE WHEN is_first = 1 THEN open END) AS open,
+               MAX(high) AS high, MIN(low) AS low,
+               MAX(CASE WHEN is_last = 1 THEN close END) AS close
+        FROM (
+            SELECT card_id, {group} AS period, open, high, low, close,
+                   ROW_NUMBER() OVER (PARTITION BY card_id, {group} ORDER BY bucket) AS is_first,
+                   ROW_NUMBER() OVER (PARTITION BY card_id, {group} ORDER BY bucket DESC) AS is_last
+            FROM price_rollup_day
+            WHERE bucket BETWEEN ? AND ? AND card_id = ?
+        )
+        GROUP BY period ORDER BY period
+    '''
+    return sql, params
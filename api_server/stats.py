@@ -0,0 +1,97 @@
+"""Incrementally maintained collection statistics.
+
+Triggers installed by migration 4 keep the ``stats_*`` tables in step with
+every insert, update and delete on ``pokemon_cards``, so reading the stats
+never scans the collection. The value history comes from the daily
+portfolio rollup (see rollups.py). ``check_stats`` compares
+the aggregates with a from-scratch computation and ``rebuild_stats``
+recomputes them, should they ever drift.
+"""
+import rollups
+
+# Queries the stats endpoint runs; each reads a small aggregate table
+TOTALS_QUERY = 'SELECT unique_cards, total_cards, total_value FROM stats_totals WHERE id = 1'
+RARITY_QUERY = 'SELECT rarity, count FROM stats_rarity ORDER BY count DESC'
+SET_QUERY = '''
+    SELECT set_name as "set", count, total_quantity, total_value
+    FROM stats_sets
+    ORDER BY total_value DESC
+'''
+VALUE_HISTORY_QUERY = rollups.STATS_VALUE_HISTORY_QUERY
+
+# The same figures computed directly from the base tables
+_EXPECTED_QUERIES = {
+    'totals': ('''
+        SELECT COUNT(*), IFNULL(SUM(quantity), 0), IFNULL(SUM(price * quantity), 0)
+        FROM pokemon_cards
+    ''', 'SELECT unique_cards, total_cards, total_value FROM stats_totals'),
+    'rarity': ('''
+        SELECT rarity, COUNT(*) FROM pokemon_cards GROUP BY rarity
+    ''', 'SELECT rarity, count FROM stats_rarity'),
+    'sets': ('''
+        SELECT set_name, COUNT(*), IFNULL(SUM(quantity), 0), IFNULL(SUM(price * quantity), 0)
+        FROM pokemon_cards GROUP BY set_name
+    ''', 'SELECT set_name, count, total_quantity, total_value FROM stats_sets'),
+}
+
+
+def rebuild_stats(conn):
+    """Recompute every aggregate table from the base tables.
+
+    Runs inside the caller's transaction (or the migration's).
+    """
+    conn.execute('DELETE FROM stats_rarity')
+    conn.execute('DELETE FROM stats_sets')
+    conn.execute('''
+        UPDATE stats_totals SET
+            unique_cards = (SELECT COUNT(*) FROM pokemon_cards),
+            total_cards = (SELECT IFNULL(SUM(quantity), 0) FROM pokemon_cards),
+            total_value = (SELECT IFNULL(SUM(price * quantity), 0) FROM pokemon_cards)
+        WHERE id = 1
+    ''')
+    conn.execute('''
+        INSERT INTO stats_rarity (rarity, count)
+        SELECT rarity, COUNT(*) FROM pokemon_cards GROUP BY rarity
+    ''')
+    conn.execute('''
+        INSERT INTO stats_sets (set_name, count, total_quantity, total_value)
+        SELECT set_name, COUNT(*), IFNULL(SUM(quantity), 0), IFNULL(SUM(price * quantity), 0)
+        FROM pokemon_cards GROUP BY set_name
+    ''')
+
+
+def _normalise(rows):
+    # Round floats so harmless summation-order differences don't count as drift
+    return sorted(
+        (tuple(round(value, 6) if isinstance(value, float) else value for value in row)
+         for row in rows),
+        key=repr
+    )
+
+
+def check_stats(conn):
+    """Compare the aggregates with a full recomputation.
+
+    Returns the names of the aggregates that disagree (empty if consistent).
+    """
+    mismatched = []
+    for name, (expected_query, actual_query) in _EXPECTED_QUERIES.items():
+        expected = _normalise(conn.execute(expected_query).fetchall())
+        actual = _normalise(conn.execute(actual_query).fetchall())
+        if expected != actual:
+            mismatched.append(name)
+    return mismatched
+
+
+def format_stats(totals, rarity_distribution, set_distribution, value_history):
+    """Assemble the /api/stats/ response from the aggregate rows."""
+    unique_cards, total_cards, total_value = totals
+    return {
+        "total_cards": total_cards,
+        "unique_cards": unique_cards,
+        "total_value": total_value,
+        "average_card_value": total_value / total_cards if total_cards > 0 else 0,
+        "rarity_distribution": rarity_distribution,
+        "set_distribution": set_distribution,
+        "value_history": value_history
+    }
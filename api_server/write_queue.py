@@ -0,0 +1,208 @@
+"""Single writer with group commit for a database's collection and wishlist.
+
+SQLite lets one connection write at a time. Rather than every request
+opening its own write transaction and racing the others (and the other
+uvicorn workers) for the lock, each database has one ``WriteQueue``: a
+single task that takes queued writes off the queue and applies them in
+order, in one transaction per group. The writes queued while the
+previous group was committing (and any arriving within the optional
+``POKETRACK_WRITE_GROUP_WINDOW_MS``) make up the next group and share its
+transaction and its commit, up to ``POKETRACK_WRITE_GROUP_MAX`` writes.
+Under load the groups grow by themselves; a lone write is committed at
+once.
+
+Each write runs inside a savepoint, so one that fails is rolled back on
+its own without failing the rest of its group. Its caller awaits a future
+that resolves with its result once the group has committed, or raises
+its error. Groups commit with ``synchronous = FULL``, so a write that has
+resolved survives a power loss, not just a crash of the process.
+"""
+import asyncio
+import contextvars
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from common import config
+from common.sqlite_pool import connection_pragmas
+
+# A write runs on the writer's connection inside the group's transaction and
+# returns its result and a callback (or None) to run once the group commits
+Write = Callable[..., Awaitable[Tuple[Any, Optional[Callable[[], Any]]]]]
+
+# What the writer's pooled connection goes back to after a group
+POOL_SYNCHRONOUS = dict(connection_pragmas())["synchronous"]
+
+
+class _Pending:
+    __slots__ = ('write', 'args', 'future')
+
+    def __init__(self, write: Write, args: tuple, future: asyncio.Future):
+        self.write = write
+        self.args = args
+        self.future = future
+
+
+class WriteQueue:
+    def __init__(self,
+                 pool: Any,
+                 window: float = config.WRITE_GROUP_WINDOW_MS / 1000,
+                 max_group: int = config.WRITE_GROUP_MAX):
+        """``pool`` is the AsyncConnectionPool the writer borrows its connection from."""
+        self.pool = pool
+        self.window = window
+        self.max_group = max(max_group, 1)
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self.writes = 0
+        self.failed = 0
+        self.groups = 0
+        self.largest_group = 0
+        self.commit_seconds = 0.0
+
+    def _start(self):
+        loop = asyncio.get_running_loop()
+        if self._task is None or self._task.done() or self._task.get_loop() is not loop:
+            self._queue = asyncio.Queue()
+            # Not in the context of the request that happened to start it
+            self._task = contextvars.Context().run(loop.create_task, self._run())
+
+    async def submit(self, write: Write, *args: Any) -> Any:
+        """Queue ``write(conn, *args)``; returns its result once it is committed."""
+        self._start()
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait(_Pending(write, args, future))
+        return await future
+
+    async def _next_group(self) -> List[Optional[_Pending]]:
+        group = [await self._queue.get()]
+        deadline = time.monotonic() + self.window
+        while len(group) < self.max_group and group[-1] is not None:
+            if not self._queue.empty():
+                group.append(self._queue.get_nowait())
+                continue
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                group.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return group
+
+    async def _run(self):
+        while True:
+            group = await self._next_group()
+            # None is queued by close(), after the writes it must let finish
+            stop = group[-1] is None
+            pending = [item for item in group if item is not None]
+            if pending:
+                try:
+                    await self._commit(pending)
+                except Exception as e:
+                    # No connection to write with; fail the group rather than the writer
+                    self._fail(pending, e)
+                except asyncio.CancelledError:
+                    # Closed from another loop (see close) in the middle of the group
+                    self._fail(pending, RuntimeError("The write queue was closed before this write committed"))
+                    raise
+            if stop:
+                return
+
+    @staticmethod
+    def _fail(items: List[_Pending], error: BaseException):
+        for item in items:
+            if not item.future.done():
+                item.future.set_exception(error)
+
+    async def _commit(self, group: List[_Pending]):
+        results: List[Tuple[_Pending, Any, Optional[BaseException]]] = []
+        callbacks = []
+        started = time.perf_counter()
+        async with self.pool.acquire() as conn:
+            await conn.execute('PRAGMA synchronous = FULL')
+            try:
+                await conn.execute('BEGIN IMMEDIATE')
+                for item in group:
+                    await conn.execute('SAVEPOINT write')
+                    try:
+                        result, on_commit = await item.write(conn, *item.args)
+                    except Exception as e:
+                        await conn.execute('ROLLBACK TO write')
+                        await conn.execute('RELEASE write')
+                        results.append((item, None, e))
+                        continue
+                    await conn.execute('RELEASE write')
+                    results.append((item, result, None))
+                    if on_commit is not None:
+                        callbacks.append(on_commit)
+                await conn.commit()
+            except Exception as e:
+                # Nothing in the group was committed
+                print(f"Error committing a group of {len(group)} writes: {e}")
+                await conn.rollback()
+                results = [(item, None, e) for item in group]
+                callbacks = []
+            except asyncio.CancelledError:
+                await conn.rollback()
+                raise
+            finally:
+                await conn.execute(f'PRAGMA synchronous = {POOL_SYNCHRONOUS}')
+
+        for on_commit in callbacks:
+            on_commit()
+        self.groups += 1
+        self.largest_group = max(self.largest_group, len(group))
+        self.commit_seconds += time.perf_counter() - started
+        for item, result, error in results:
+            self.writes += 1
+            if error is not None:
+                self.failed += 1
+            if item.future.done():
+                # The caller stopped waiting (its request was cancelled)
+                continue
+            if error is not None:
+                item.future.set_exception(error)
+            else:
+                item.future.set_result(result)
+
+    async def close(self):
+        """Let the queued writes finish, then stop the writer.
+
+        A writer running on another event loop cannot be waited for from
+        this one; its queued writes are failed and it is cancelled instead.
+        """
+        if self._task is None or self._task.done():
+            return
+        if self._task.get_loop() is asyncio.get_running_loop():
+            self._queue.put_nowait(None)
+            await self._task
+            return
+        try:
+            # The futures and the task belong to the writer's loop
+            self._task.get_loop().call_soon_threadsafe(self._abandon)
+        except RuntimeError:
+            # That loop is closed; nothing is left waiting on it
+            pass
+
+    def _abandon(self):
+        error = RuntimeError("The write queue was closed before this write committed")
+        queued = []
+        while not self._queue.empty():
+            item = self._queue.get_nowait()
+            if item is not None:
+                queued.append(item)
+        self._fail(queued, error)
+        self._task.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "writes": self.writes,
+            "failed": self.failed,
+            "groups": self.groups,
+            "average_group": round(self.writes / self.groups, 2) if self.groups else 0,
+            "largest_group": self.largest_group,
+            "average_commit_ms": round(self.commit_seconds / self.groups * 1000, 3) if self.groups else 0,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "window_ms": self.window * 1000,
+            "max_group": self.max_group,
+        }
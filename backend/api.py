@@ -1,18 +1,177 @@
 import requests
+from requests.adapters import HTTPAdapter
 from typing import List, Dict, Any, Optional
 from datetime import datetime, timedelta
+from urllib.parse import urlsplit
 import random
+import threading
+import time
+
+from common import catalog, config
+from common.metrics import observe_upstream
+
+# TCGPlayer's category id for the Pokemon TCG
+POKEMON_CATEGORY_ID = 3
+
+# Most product ids TCGPlayer accepts in one catalog or pricing request
+MAX_BATCH_SIZE = 250
+
+# Renew the bearer token this long before TCGPlayer says it expires
+TOKEN_EXPIRY_MARGIN = timedelta(minutes=5)
+
+# Cards in each discover section
+DISCOVER_SIZE = 6
+
 
 class TCGPlayerAPI:
-    def __init__(self):
-        self.base_url = "https://api.tcgplayer.com/v1.37.0"
-        self.api_key = "YOUR_API_KEY"  # Replace with actual API key
-    
-    def _get_auth_token(self) -> str:
-        """Get authentication token from TCGPlayer."""
-        # Implementation depends on TCGPlayer authentication flow
-        pass
-    
+    def __init__(self,
+                 base_url: Optional[str] = None,
+                 public_key: Optional[str] = None,
+                 private_key: Optional[str] = None,
+                 batch_size: int = 100,
+                 pool_size: int = config.HTTP_MAX_CONNECTIONS):
+        self.base_url = (base_url or config.TCGPLAYER_API_URL).rstrip('/')
+        # The token endpoint sits at the root of the host, outside the versioned API
+        parts = urlsplit(self.base_url)
+        self.token_url = f"{parts.scheme}://{parts.netloc}/token"
+        self.upstream = parts.hostname or parts.netloc
+        self.public_key = config.TCGPLAYER_PUBLIC_KEY if public_key is None else public_key
+        self.private_key = config.TCGPLAYER_PRIVATE_KEY if private_key is None else private_key
+        self.batch_size = min(batch_size, MAX_BATCH_SIZE)
+        self.timeout = (config.HTTP_CONNECT_TIMEOUT, config.HTTP_READ_TIMEOUT)
+
+        # One pooled session shared by every thread that calls the client
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self._token: Optional[str] = None
+        self._token_expires = datetime.min
+        self._token_lock = threading.Lock()
+        self._groups: Dict[int, Dict[str, Any]] = {}
+        self._groups_lock = threading.Lock()
+        self.token_requests = 0
+
+    @property
+    def configured(self) -> bool:
+        """Whether API keys are set; without them the client serves sample data."""
+        return bool(self.public_key and self.private_key)
+
+    def _request(self, method: str, url: str, **kwargs) -> requests.Response:
+        """Send a request on the pooled session, timing it for /metrics."""
+        started = time.perf_counter()
+        status = None
+        try:
+            response = self.session.request(method, url, timeout=self.timeout, **kwargs)
+            status = response.status_code
+            return response
+        finally:
+            observe_upstream(self.upstream, time.perf_counter() - started, status)
+
+    def _get_auth_token(self, refresh: bool = False) -> str:
+        """Get a bearer token from TCGPlayer, reusing the cached one until it expires."""
+        with self._token_lock:
+            if not refresh and self._token and datetime.now() < self._token_expires:
+                return self._token
+            response = self._request('POST', self.token_url, data={
+                "grant_type": "client_credentials",
+                "client_id": self.public_key,
+                "client_secret": self.private_key,
+            })
+            response.raise_for_status()
+            payload = response.json()
+            self.token_requests += 1
+            self._token = payload["access_token"]
+            self._token_expires = datetime.now() + timedelta(seconds=payload["expires_in"]) - TOKEN_EXPIRY_MARGIN
+            return self._token
+
+    def _call(self, method: str, path: str, **kwargs) -> List[Any]:
+        """Call an API path and return its ``results`` (empty when nothing matched)."""
+        url = f"{self.base_url}{path}"
+        for attempt in range(2):
+            # A 401 with a cached token means it was revoked early; renew once and retry
+            token = self._get_auth_token(refresh=attempt > 0)
+            response = self._request(method, url, headers={"Authorization": f"bearer {token}"}, **kwargs)
+            if response.status_code != 401:
+                break
+        if response.status_code == 404:
+            # TCGPlayer answers 404 when none of the requested items exist
+            return []
+        response.raise_for_status()
+        return response.json().get("results", [])
+
+    def _get(self, path: str, params: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        return self._call('GET', path, params=params)
+
+    def _batches(self, ids: List[str]) -> List[List[str]]:
+        return [ids[i:i + self.batch_size] for i in range(0, len(ids), self.batch_size)]
+
+    def get_prices(self, card_ids: List[str]) -> Dict[str, float]:
+        """Market price per card, one pricing request per batch of ids.
+
+        A product has one price per printing (Normal, Holofoil, ...); the
+        highest market price is used. Cards that are not TCGPlayer products
+        (local catalog ids), or every card when no keys are set, are priced
+        from the catalog instead.
+        """
+        product_ids = [card_id for card_id in card_ids if card_id.isdigit()] if self.configured else []
+        prices: Dict[str, float] = {}
+        for batch in self._batches(product_ids):
+            for result in self._get(f"/pricing/product/{','.join(batch)}"):
+                price = result.get("marketPrice")
+                if price is None:
+                    price = result.get("midPrice")
+                if price is None:
+                    continue
+                product_id = str(result["productId"])
+                prices[product_id] = max(price, prices.get(product_id, price))
+
+        priced_upstream = set(product_ids)
+        other_ids = [card_id for card_id in card_ids if card_id not in priced_upstream]
+        if other_ids:
+            for card in catalog.get_cards(catalog.get_connection(), other_ids):
+                price = catalog.market_price(card)
+                if price is not None:
+                    prices[card["id"]] = price
+        return prices
+
+    def _get_groups(self, group_ids: List[int]) -> Dict[int, Dict[str, Any]]:
+        """Set details by group id; groups rarely change, so they are cached for good."""
+        with self._groups_lock:
+            missing = sorted({group_id for group_id in group_ids if group_id not in self._groups})
+        # Fetched without the lock; two threads may both fetch a group, which is harmless
+        fetched = {}
+        for batch in self._batches([str(group_id) for group_id in missing]):
+            for group in self._get(f"/catalog/groups/{','.join(batch)}"):
+                fetched[group["groupId"]] = group
+        with self._groups_lock:
+            self._groups.update(fetched)
+            return {group_id: self._groups.get(group_id, {}) for group_id in group_ids}
+
+    def _to_cards(self, products: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Convert TCGPlayer products to the app's card shape, with prices and sets."""
+        ids = [str(product["productId"]) for product in products]
+        prices = self.get_prices(ids)
+        groups = self._get_groups([product["groupId"] for product in products])
+        cards = []
+        for product in products:
+            extended = {field["name"]: field["value"] for field in product.get("extendedData", [])}
+            group = groups.get(product["groupId"], {})
+            cards.append({
+                "id": str(product["productId"]),
+                "name": product.get("name", ""),
+                "set": group.get("name", ""),
+                "number": extended.get("Number", ""),
+                "rarity": extended.get("Rarity", ""),
+                "type": extended.get("Card Type", ""),
+                "price": prices.get(str(product["productId"]), 0.0),
+                "image": product.get("imageUrl", ""),
+                "artist": extended.get("Artist", ""),
+                "releaseDate": (group.get("publishedOn") or "")[:10],
+            })
+        return cards
+
     def search_cards(self,
                      query: str,
                      rarity: Optional[str] = None,
@@ -20,9 +179,61 @@ class TCGPlayerAPI:
                      min_price: Optional[float] = None,
                      max_price: Optional[float] = None) -> List[Dict[str, Any]]:
         """Search for Pokemon cards using TCGPlayer API."""
-        # TODO: Implement actual API call
-        # For now, return mock data
-        mock_cards = [
+        # Serve from the local catalog mirror while it is fresh
+        conn = catalog.get_connection()
+        if catalog.is_fresh(conn):
+            cards = catalog.search(conn, query, limit=50, rarity=rarity, set_name=set_name,
+                                   min_price=min_price, max_price=max_price)
+            if cards:
+                return [catalog.to_app_card(card) for card in cards]
+
+        if not self.configured:
+            return self._sample_cards()
+
+        products = self._get("/catalog/products", {
+            "categoryId": POKEMON_CATEGORY_ID,
+            "productName": query,
+            "productTypes": "Cards",
+            "getExtendedFields": "true",
+            "limit": 50,
+        })
+        cards = self._to_cards(products)
+        return [
+            card for card in cards
+            if (not rarity or card["rarity"] == rarity)
+            and (not set_name or card["set"] == set_name)
+            and (min_price is None or card["price"] >= min_price)
+            and (max_price is None or card["price"] <= max_price)
+        ]
+
+    def get_cards(self, card_ids: List[str]) -> List[Dict[str, Any]]:
+        """Get many cards, one catalog request (plus one pricing request) per batch.
+
+        Cards that are not found are left out.
+        """
+        product_ids = [card_id for card_id in card_ids if card_id.isdigit()]
+        other_ids = [card_id for card_id in card_ids if not card_id.isdigit()]
+        cards = [catalog.to_app_card(card) for card in catalog.get_cards(catalog.get_connection(), other_ids)]
+        if not self.configured:
+            found = {card["id"] for card in cards}
+            cards.extend(self._sample_card(card_id) for card_id in card_ids if card_id not in found)
+        else:
+            for batch in self._batches(product_ids):
+                products = self._get(f"/catalog/products/{','.join(batch)}", {"getExtendedFields": "true"})
+                cards.extend(self._to_cards(products))
+        order = {card_id: i for i, card_id in enumerate(card_ids)}
+        return sorted(cards, key=lambda card: order.get(card["id"], len(order)))
+
+    def get_card(self, card_id: str) -> Dict[str, Any]:
+        """Get detailed information about a specific card."""
+        cards = self.get_cards([card_id])
+        if not cards:
+            raise ValueError(f"Card {card_id} not found")
+        return cards[0]
+
+    def _sample_cards(self) -> List[Dict[str, Any]]:
+        """Random sample cards, for running without TCGPlayer keys."""
+        return [
             {
                 "id": f"card_{i}",
                 "name": f"Pokemon Card {i}",
@@ -37,12 +248,8 @@ class TCGPlayerAPI:
             }
             for i in range(1, 13)
         ]
-        return mock_cards
-    
-    def get_card(self, card_id: str) -> Dict[str, Any]:
-        """Get detailed information about a specific card."""
-        # TODO: Implement actual API call
-        # For now, return mock data
+
+    def _sample_card(self, card_id: str) -> Dict[str, Any]:
         return {
             "id": card_id,
             "name": f"Pokemon Card {card_id}",
@@ -55,18 +262,51 @@ class TCGPlayerAPI:
             "artist": "Pokemon Artist",
             "releaseDate": "2023-01-01"
         }
-    
+
+    def _top_products(self, sort: str, limit: int = DISCOVER_SIZE) -> List[Dict[str, Any]]:
+        """The first ``limit`` Pokemon cards in a catalog-wide ``sort`` order ("Sales DESC", ...)."""
+        product_ids = self._call('POST', f"/catalog/categories/{POKEMON_CATEGORY_ID}/search", json={
+            "sort": sort,
+            "limit": limit,
+            "offset": 0,
+            "filters": [{"name": "ProductTypeName", "values": ["Cards"]}],
+        })
+        return self.get_cards([str(product_id) for product_id in product_ids])
+
     def get_featured_cards(self) -> List[Dict[str, Any]]:
-        """Get featured Pokemon cards."""
-        # TODO: Implement actual API call
-        return self.search_cards("featured")[:6]
-    
+        """The most valuable Pokemon cards on TCGPlayer."""
+        if not self.configured:
+            return self._sample_cards()[:DISCOVER_SIZE]
+        return self._top_products("MinPrice DESC")
+
     def get_new_releases(self) -> List[Dict[str, Any]]:
-        """Get newly released Pokemon cards."""
-        # TODO: Implement actual API call
-        return self.search_cards("new")[:6]
-    
+        """Cards from the most recently published Pokemon set."""
+        if not self.configured:
+            return self._sample_cards()[:DISCOVER_SIZE]
+        groups = self._get("/catalog/groups", {
+            "categoryId": POKEMON_CATEGORY_ID,
+            "sortOrder": "publishedOn",
+            "sortDesc": "true",
+            "limit": 1,
+        })
+        if not groups:
+            return []
+        with self._groups_lock:
+            self._groups[groups[0]["groupId"]] = groups[0]
+        products = self._get("/catalog/products", {
+            "categoryId": POKEMON_CATEGORY_ID,
+            "groupId": groups[0]["groupId"],
+            "productTypes": "Cards",
+            "getExtendedFields": "true",
+            "limit": DISCOVER_SIZE,
+        })
+        return self._to_cards(products)
+
     def get_trending_cards(self) -> List[Dict[str, Any]]:
-        """Get trending Pokemon cards."""
-        # TODO: Implement actual API call
-        return self.search_cards("trending")[:6]
+        """The best-selling Pokemon cards on TCGPlayer."""
+        if not self.configured:
+            return self._sample_cards()[:DISCOVER_SIZE]
+        return self._top_products("Sales DESC")
+
+    def close(self):
+        self.session.close()
@@ -1,14 +1,42 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import Depends, FastAPI, Header, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from database import Database
 from api import TCGPlayerAPI
-from typing import List, Optional
+from common import catalog, metrics
+from discover import DiscoverFeed
+from price_refresh import PriceRefresher
+from common.etag import RenderedCache
+from common.events import Broadcaster
+from common.image_cache import ImageCache, ImageError, image_response
+from common.pagination import DEFAULT_PAGE_SIZE, PageRequestError
+from common.search_cache import SearchCache, search_key
+from common.shards import USER_PARAM, ShardError, ShardRouter
+from typing import AsyncIterator, List, Optional, Sequence, Union
 from pydantic import BaseModel
+import search_engine
 import uvicorn
 
 app = FastAPI()
-db = Database('pokemon_cards.db')
+# Each user's collection lives in its own database (see common/shards.py)
+shards = ShardRouter(Database, Database.close)
 tcg_api = TCGPlayerAPI()
+search_cache = SearchCache()
+rendered_cache = RenderedCache()
+image_cache = ImageCache()
+broadcaster = Broadcaster()
+metrics.register_cache("search", search_cache)
+metrics.register_cache("rendered", rendered_cache)
+metrics.register_cache("images", image_cache)
+price_refresher = PriceRefresher(
+    shards, tcg_api.get_prices,
+    on_update=lambda prices, user: broadcaster.publish("prices_updated", {"prices": prices}, user)
+)
+discover_feed = DiscoverFeed({
+    "featured": tcg_api.get_featured_cards,
+    "newReleases": tcg_api.get_new_releases,
+    "trending": tcg_api.get_trending_cards,
+})
 
 # Enable CORS
 app.add_middleware(
@@ -18,6 +46,7 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(metrics.MetricsMiddleware)
 
 # Models
 class Card(BaseModel):
@@ -32,6 +61,13 @@ class Card(BaseModel):
     artist: str
     releaseDate: str
 
+class CardPage(BaseModel):
+    items: List[Card]
+    next_cursor: Optional[str] = None
+
+class CardIds(BaseModel):
+    ids: List[str]
+
 class SearchParams(BaseModel):
     query: str
     rarity: Optional[str] = None
@@ -39,6 +75,50 @@ class SearchParams(BaseModel):
     minPrice: Optional[float] = None
     maxPrice: Optional[float] = None
     sortBy: Optional[str] = None
+    # Paging; when none is given the first page is returned as a plain list
+    limit: Optional[int] = None
+    offset: Optional[int] = None
+    cursor: Optional[str] = None
+
+@app.on_event("startup")
+def start_background_jobs():
+    price_refresher.start()
+    discover_feed.start()
+
+@app.on_event("shutdown")
+def stop_background_jobs():
+    broadcaster.close()
+    discover_feed.stop()
+    price_refresher.stop()
+    image_cache.close()
+    shards.close_all()
+
+# Both are async so that FastAPI does not hand them to the threadpool;
+# opening a shard that is not open yet still happens off the event loop
+async def user_id(x_user_id: Optional[str] = Header(None)) -> Optional[str]:
+    """The requesting user (None when storage is not sharded)."""
+    try:
+        return shards.user_id(x_user_id)
+    except ShardError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+async def stream_user_id(x_user_id: Optional[str] = Header(None),
+                         user_param: Optional[str] = Query(None, alias=USER_PARAM)) -> Optional[str]:
+    """``user_id`` for event streams, which browsers open without custom headers: ``?user=`` works too."""
+    return await user_id(x_user_id if x_user_id is not None else user_param)
+
+async def user_db(user: Optional[str] = Depends(user_id)) -> AsyncIterator[Database]:
+    """The requesting user's database, held open until the response is sent."""
+    async with shards.use_async(user) as db:
+        yield db
+
+def cached_listing(request: Request, db: Database, user: Optional[str], tables: List[str], render):
+    """Answer 304, or from the rendered cache, while ``tables`` are unchanged."""
+    key = f"{request.url.path}?{request.url.query}"
+    return rendered_cache.respond(
+        request.headers.get('if-none-match'), f"{user}:{key}" if user else key,
+        db.get_table_versions(*tables), render
+    )
 
 # Routes
 @app.get("/health")
@@ -46,29 +126,83 @@ def health_check():
     return {"status": "ok"}
 
 @app.get("/sets")
-def get_sets() -> List[str]:
-    return db.get_sets()
+def get_sets(request: Request, user: Optional[str] = Depends(user_id),
+             db: Database = Depends(user_db)) -> List[str]:
+    return cached_listing(request, db, user, ['collection'], db.get_sets)
 
 @app.post("/search")
-def search_cards(params: SearchParams) -> List[Card]:
-    try:
+def search_cards(params: SearchParams) -> Union[List[Card], CardPage]:
+    paged = params.limit is not None or params.offset is not None or params.cursor is not None
+
+    def fetch():
+        conn = catalog.get_connection()
+        if catalog.is_fresh(conn):
+            # Filtering, sorting and paging all happen in one indexed query
+            page = search_engine.search(
+                conn,
+                query=params.query,
+                rarity=params.rarity,
+                set_name=params.set,
+                min_price=params.minPrice,
+                max_price=params.maxPrice,
+                sort_by=params.sortBy,
+                limit=params.limit or DEFAULT_PAGE_SIZE,
+                offset=params.offset or 0,
+                cursor=params.cursor
+            )
+            return page if paged else page["items"]
+
+        # No synced catalog: search upstream and sort the (single page of) results here
         cards = tcg_api.search_cards(
             query=params.query,
-            rarity=params.rarity,
-            set_name=params.set,
+            rarity=params.rarity or None,
+            set_name=params.set or None,
             min_price=params.minPrice,
             max_price=params.maxPrice
         )
-        
-        if params.sortBy:
-            field, order = params.sortBy.split('-')
-            reverse = order == 'desc'
-            cards.sort(key=lambda x: getattr(x, field), reverse=reverse)
-        
-        return cards
+        field, order = search_engine.parse_sort(params.sortBy)
+        cards.sort(key=search_engine.sort_key(field), reverse=order == 'desc')
+        return {"items": cards, "next_cursor": None} if paged else cards
+
+    try:
+        key = search_key(
+            params.query,
+            rarity=params.rarity,
+            set=params.set,
+            minPrice=params.minPrice,
+            maxPrice=params.maxPrice,
+            sortBy=params.sortBy,
+            limit=params.limit,
+            offset=params.offset,
+            cursor=params.cursor
+        )
+        return search_cache.get_or_load(key, fetch)
+    except PageRequestError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/search/stats")
+def search_cache_stats():
+    return search_cache.stats()
+
+def publish_cards_changed(user: Optional[str], list_name: str, cards: Sequence[dict] = (),
+                          removed: Sequence[str] = ()):
+    """Tell the user's event subscribers which cards were added to or removed from a list."""
+    if cards or removed:
+        broadcaster.publish("cards_changed", {"list": list_name, "cards": list(cards), "removed": list(removed)},
+                            user)
+
+def add_cards(ids: List[str], add_many, user: Optional[str], list_name: str):
+    # One catalog lookup per batch of ids rather than one per card
+    cards = tcg_api.get_cards(list(dict.fromkeys(ids)))
+    result = add_many(cards)
+    added = set(result["added"])
+    publish_cards_changed(user, list_name, [card for card in cards if card['id'] in added])
+    found = {card['id'] for card in cards}
+    result["not_found"] = [card_id for card_id in dict.fromkeys(ids) if card_id not in found]
+    return result
+
 @app.get("/cards/{card_id}")
 def get_card(card_id: str) -> Card:
     try:
@@ -77,67 +211,164 @@ def get_card(card_id: str) -> Card:
         raise HTTPException(status_code=404, detail="Card not found")
 
 @app.get("/collection")
-def get_collection() -> List[Card]:
+def get_collection(request: Request, limit: Optional[int] = None, sort: str = "name", order: str = "asc",
+                   cursor: Optional[str] = None, set_name: Optional[str] = Query(None, alias="set"),
+                   rarity: Optional[str] = None, user: Optional[str] = Depends(user_id),
+                   db: Database = Depends(user_db)) -> Union[List[Card], CardPage]:
+    def render():
+        # Without paging parameters keep returning the whole collection.
+        # Rows are already in Card shape, so they skip model validation.
+        if limit is None and cursor is None:
+            return db.get_collection(set_name, rarity)
+        return db.get_collection_page(sort, order, limit or DEFAULT_PAGE_SIZE, cursor, set_name, rarity)
+
     try:
-        return db.get_collection()
+        return cached_listing(request, db, user, ['collection'], render)
+    except PageRequestError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/collection/batch")
+def add_many_to_collection(body: CardIds, user: Optional[str] = Depends(user_id),
+                           db: Database = Depends(user_db)):
+    try:
+        return add_cards(body.ids, db.add_many_to_collection, user, 'collection')
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/collection/{card_id}")
-def add_to_collection(card_id: str):
+def add_to_collection(card_id: str, user: Optional[str] = Depends(user_id),
+                      db: Database = Depends(user_db)):
     try:
         card = tcg_api.get_card(card_id)
         db.add_to_collection(card)
+        publish_cards_changed(user, 'collection', cards=[card])
         return {"status": "success"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.delete("/collection/{card_id}")
-def remove_from_collection(card_id: str):
+def remove_from_collection(card_id: str, user: Optional[str] = Depends(user_id),
+                           db: Database = Depends(user_db)):
     try:
         db.remove_from_collection(card_id)
+        publish_cards_changed(user, 'collection', removed=[card_id])
         return {"status": "success"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/wishlist")
-def get_wishlist() -> List[Card]:
+def get_wishlist(request: Request, limit: Optional[int] = None, sort: str = "name", order: str = "asc",
+                 cursor: Optional[str] = None, set_name: Optional[str] = Query(None, alias="set"),
+                 rarity: Optional[str] = None, user: Optional[str] = Depends(user_id),
+                 db: Database = Depends(user_db)) -> Union[List[Card], CardPage]:
+    def render():
+        if limit is None and cursor is None:
+            return db.get_wishlist(set_name, rarity)
+        return db.get_wishlist_page(sort, order, limit or DEFAULT_PAGE_SIZE, cursor, set_name, rarity)
+
     try:
-        return db.get_wishlist()
+        return cached_listing(request, db, user, ['wishlist'], render)
+    except PageRequestError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/wishlist/batch")
+def add_many_to_wishlist(body: CardIds, user: Optional[str] = Depends(user_id),
+                         db: Database = Depends(user_db)):
+    try:
+        return add_cards(body.ids, db.add_many_to_wishlist, user, 'wishlist')
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/wishlist/{card_id}")
-def add_to_wishlist(card_id: str):
+def add_to_wishlist(card_id: str, user: Optional[str] = Depends(user_id),
+                    db: Database = Depends(user_db)):
     try:
         card = tcg_api.get_card(card_id)
         db.add_to_wishlist(card)
+        publish_cards_changed(user, 'wishlist', cards=[card])
         return {"status": "success"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.delete("/wishlist/{card_id}")
-def remove_from_wishlist(card_id: str):
+def remove_from_wishlist(card_id: str, user: Optional[str] = Depends(user_id),
+                         db: Database = Depends(user_db)):
     try:
         db.remove_from_wishlist(card_id)
+        publish_cards_changed(user, 'wishlist', removed=[card_id])
         return {"status": "success"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/prices/refresh/stats")
+def price_refresh_stats():
+    return price_refresher.stats()
+
+@app.post("/prices/refresh")
+def refresh_prices():
+    cycle = price_refresher.refresh_once()
+    if cycle is None:
+        raise HTTPException(status_code=409, detail="A price refresh is already running")
+    return cycle
+
 @app.get("/discover")
 def get_discover():
     try:
-        featured = tcg_api.get_featured_cards()
-        new_releases = tcg_api.get_new_releases()
-        trending = tcg_api.get_trending_cards()
-        
-        return {
-            "featured": featured,
-            "newReleases": new_releases,
-            "trending": trending
-        }
+        # Served from the precomputed snapshot; the body is already JSON
+        return Response(content=discover_feed.get().body, media_type="application/json")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/events")
+async def stream_events(request: Request, user: Optional[str] = Depends(stream_user_id)):
+    """Server-sent change events of the user's lists: cards_changed, prices_updated and resync."""
+    return StreamingResponse(
+        broadcaster.subscribe(request.headers.get('last-event-id'), user),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.get("/events/stats")
+def event_stats():
+    return broadcaster.stats()
+
+@app.get("/discover/stats")
+def discover_stats():
+    return discover_feed.stats()
+
+@app.get("/images")
+def get_image(request: Request, url: str, w: Optional[int] = None):
+    """A card image from the local image cache; ``w`` asks for a thumbnail that wide."""
+    try:
+        image = image_cache.get(url, w)
+    except ImageError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    return image_response(image, request.headers.get('if-none-match'))
+
+@app.get("/lists/stats")
+def list_stats(db: Database = Depends(user_db)):
+    return db.get_list_stats()
+
+@app.get("/shards/stats")
+def shard_stats():
+    return shards.stats()
+
+@app.get("/images/stats")
+def image_cache_stats():
+    return image_cache.stats()
+
+@app.get("/metrics")
+def prometheus_metrics():
+    """Request, data-layer, SQL and upstream latencies and cache hit ratios."""
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+@app.get("/metrics/slow-queries")
+def slow_queries():
+    return metrics.slow_queries()
+
 if __name__ == "__main__":
     uvicorn.run("api_server:app", host="0.0.0.0", port=8000, reload=True)
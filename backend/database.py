@@ -1,96 +1,198 @@
+import operator
+import os
 import sqlite3
-from typing import List, Dict, Any
+import sys
+import threading
+from contextlib import contextmanager
+from typing import List, Dict, Any, Optional
 from datetime import datetime
 
+# Make the shared ``common`` package importable when run from this directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common import price_archive, table_versions
+from common.list_cache import ListCache, Record
+from common.metrics import timed_methods
+from common.sqlite_pool import close_pool, get_pool
+
+# Sort keys accepted by the paginated listings, mapped to their column.
+# Each has a matching (column, id) index (see migration 2).
+SORT_COLUMNS = {
+    'name': 'name',
+    'price': 'price',
+    'added_date': 'added_date',
+    'set': 'set_name',
+}
+
+# Tables whose change counters (see common.table_versions) the read
+# endpoints turn into ETags
+VERSIONED_TABLES = ('collection', 'wishlist')
+
+# The Card fields, aliased to their API names, so rows come out of SQLite
+# ready to serialize without renaming keys in Python
+CARD_COLUMNS = """
+    id, name, set_name AS "set", number, rarity, type, price,
+    image, artist, release_date AS "releaseDate"
+"""
+
+# The same orderings as SORT_COLUMNS, for the listings served from memory
+SORT_KEYS = {
+    'name': operator.attrgetter('name'),
+    'price': operator.attrgetter('price'),
+    'added_date': operator.attrgetter('added_date'),
+    'set': operator.attrgetter('set'),
+}
+
+class CardRecord(Record):
+    """A collection or wishlist row; ``added_date`` is kept for sorting only."""
+    __slots__ = ('id', 'name', 'set', 'number', 'rarity', 'type', 'price',
+                 'image', 'artist', 'releaseDate', 'added_date')
+    FIELDS = __slots__[:-1]
+
+LIST_COLUMNS = f"{CARD_COLUMNS.rstrip()}, added_date"
+
+def refresh_queue(conn: sqlite3.Connection, stale_before: str) -> List[Dict[str, Any]]:
+    """Every tracked card (collection and wishlist), most urgent first.
+
+    Cards whose price is older than ``stale_before`` come first; within
+    each group the most valuable cards lead, then the longest unrefreshed.
+    Takes any connection to the database, so the price refresher can read
+    it without opening it as a ``Database``.
+    """
+    rows = conn.execute("""
+        SELECT id, MAX(price) AS price, MIN(IFNULL(price_updated, '')) AS price_updated
+        FROM (
+            SELECT id, price, price_updated FROM collection
+            UNION ALL
+            SELECT id, price, price_updated FROM wishlist
+        )
+        GROUP BY id
+        ORDER BY price_updated >= ?, price DESC, price_updated
+    """, (stale_before,))
+    return [{"id": card_id, "price": price, "price_updated": updated} for card_id, price, updated in rows]
+
+def price_freshness(conn: sqlite3.Connection, stale_before: str) -> Dict[str, Any]:
+    """How many tracked cards there are, how many are stale, and the oldest refresh time."""
+    tracked, stale, oldest = conn.execute("""
+        SELECT COUNT(*),
+               IFNULL(SUM(price_updated IS NULL OR price_updated < ?), 0),
+               MIN(price_updated)
+        FROM (
+            SELECT id, MIN(price_updated) AS price_updated
+            FROM (
+                SELECT id, price_updated FROM collection
+                UNION ALL
+                SELECT id, price_updated FROM wishlist
+            )
+            GROUP BY id
+        )
+    """, (stale_before,)).fetchone()
+    return {"tracked_cards": tracked, "stale_cards": stale, "oldest_update": oldest}
+
+@timed_methods
 class Database:
-    def __init__(self, db_path: str):
-        self.db_path = db_path
+    def __init__(self, db_path: Optional[str] = None):
+        self._pool = get_pool(db_path)
+        self.db_path = self._pool.db_path
         self._init_db()
+        # In-memory copies of the lists (see common.list_cache), filterable by set and rarity
+        self._lists = {
+            table: ListCache(CardRecord, SORT_KEYS, {'set': 'set', 'rarity': 'rarity'})
+            for table in VERSIONED_TABLES
+        }
+        self._reload_lock = threading.Lock()
     
     def _init_db(self):
-        """Initialize the database with required tables."""
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            
-            # Create collection table
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS collection (
-                    id TEXT PRIMARY KEY,
-                    name TEXT NOT NULL,
-                    set_name TEXT NOT NULL,
-                    number TEXT NOT NULL,
-                    rarity TEXT NOT NULL,
-                    type TEXT NOT NULL,
-                    price REAL NOT NULL,
-                    image TEXT NOT NULL,
-                    artist TEXT NOT NULL,
-                    release_date TEXT NOT NULL,
-                    added_date TEXT NOT NULL
-                )
-            """)
-            
-            # Create wishlist table
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS wishlist (
-                    id TEXT PRIMARY KEY,
-                    name TEXT NOT NULL,
-                    set_name TEXT NOT NULL,
-                    number TEXT NOT NULL,
-                    rarity TEXT NOT NULL,
-                    type TEXT NOT NULL,
-                    price REAL NOT NULL,
-                    image TEXT NOT NULL,
-                    artist TEXT NOT NULL,
-                    release_date TEXT NOT NULL,
-                    added_date TEXT NOT NULL
-                )
-            """)
-            
-            # Create price history table
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS price_history (
-                    id TEXT,
-                    price REAL NOT NULL,
-                    date TEXT NOT NULL,
-                    PRIMARY KEY (id, date)
-                )
-            """)
-            
+        """Create or upgrade the schema by running any pending migrations."""
+        from migrations import run_migrations
+        run_migrations(self.db_path)
+    
+    def close(self):
+        """Close every connection to the database file."""
+        close_pool(self.db_path)
+    
+    def get_table_versions(self, *tables: str) -> Dict[str, int]:
+        """Current change counters of ``tables``; bumped by every write to them."""
+        with self._pool.connection() as conn:
+            return table_versions.get_versions(conn, tables)
+    
+    def _version(self, conn: sqlite3.Connection, table: str) -> int:
+        return table_versions.get_versions(conn, (table,))[table]
+    
+    def _current_list(self, table: str) -> ListCache:
+        """The table's ListCache, reloaded first if the table has changed since it was filled."""
+        cache = self._lists[table]
+        conn = self._pool.connection()
+        if cache.version == self._version(conn, table):
+            return cache
+        with self._reload_lock:
+            # One read transaction, so the rows and the version match
+            conn.execute("BEGIN")
+            try:
+                version = self._version(conn, table)
+                if cache.version != version:
+                    cache.load(conn.execute(f"SELECT {LIST_COLUMNS} FROM {table}"), version)
+            finally:
+                conn.commit()
+        return cache
+    
+    @contextmanager
+    def _writing(self, changes: Dict[str, List[str]]):
+        """A write transaction whose changes to the ``changes`` cards are copied into the lists.
+        
+        ``changes`` maps each table written to the ids of the cards that may
+        change; the rows they are left with are read back before the commit.
+        """
+        conn = self._pool.connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            before = {table: self._version(conn, table) for table in changes}
+            yield conn
+            after = {}
+            for table, card_ids in changes.items():
+                rows = []
+                for start in range(0, len(card_ids), 500):
+                    chunk = card_ids[start:start + 500]
+                    placeholders = ', '.join('?' for _ in chunk)
+                    rows.extend(conn.execute(
+                        f"SELECT {LIST_COLUMNS} FROM {table} WHERE id IN ({placeholders})", chunk
+                    ).fetchall())
+                after[table] = (self._version(conn, table), rows)
             conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        for table, (version, rows) in after.items():
+            self._lists[table].apply(before[table], version, changes[table], rows)
     
-    def _dict_factory(self, cursor: sqlite3.Cursor, row: tuple) -> Dict[str, Any]:
-        """Convert database row to dictionary."""
-        d = {}
-        for idx, col in enumerate(cursor.description):
-            value = row[idx]
-            # Convert database column names to API format
-            key = col[0]
-            if key == 'set_name':
-                key = 'set'
-            elif key == 'release_date':
-                key = 'releaseDate'
-            d[key] = value
-        return d
+    def get_list_stats(self) -> Dict[str, Any]:
+        """Size, version and load/write counts of the in-memory lists."""
+        return {table: cache.stats() for table, cache in self._lists.items()}
     
     def get_sets(self) -> List[str]:
         """Get list of all sets in the collection."""
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT DISTINCT set_name FROM collection ORDER BY set_name")
-            return [row[0] for row in cursor.fetchall()]
+        return self._current_list('collection').values('set')
     
-    def get_collection(self) -> List[Dict[str, Any]]:
-        """Get all cards in the collection."""
-        with sqlite3.connect(self.db_path) as conn:
-            conn.row_factory = self._dict_factory
-            cursor = conn.cursor()
-            cursor.execute("SELECT * FROM collection ORDER BY name")
-            return cursor.fetchall()
+    def get_collection(self, set_name: Optional[str] = None,
+                       rarity: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Get all cards in the collection, by name, optionally only one set's or rarity's."""
+        return self._current_list('collection').cards('name', set=set_name, rarity=rarity)
+    
+    def _get_page(self, table: str, sort: str, order: str, limit: int, cursor: Optional[str],
+                  set_name: Optional[str], rarity: Optional[str]) -> Dict[str, Any]:
+        return self._current_list(table).page(sort, order, limit, cursor, set=set_name, rarity=rarity)
+    
+    def get_collection_page(self, sort: str = 'name', order: str = 'asc', limit: int = 50,
+                            cursor: Optional[str] = None, set_name: Optional[str] = None,
+                            rarity: Optional[str] = None) -> Dict[str, Any]:
+        """Get one keyset-paginated page of the collection."""
+        return self._get_page('collection', sort, order, limit, cursor, set_name, rarity)
     
     def add_to_collection(self, card: Dict[str, Any]):
         """Add a card to the collection."""
-        with sqlite3.connect(self.db_path) as conn:
+        with self._writing({'collection': [card['id']]}) as conn:
             cursor = conn.cursor()
+            now = datetime.now().isoformat()
             
             # Check if card already exists
             cursor.execute("SELECT id FROM collection WHERE id = ?", (card['id'],))
@@ -101,43 +203,77 @@ class Database:
             cursor.execute("""
                 INSERT INTO collection (
                     id, name, set_name, number, rarity, type,
-                    price, image, artist, release_date, added_date
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    price, image, artist, release_date, added_date, price_updated
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
             """, (
                 card['id'], card['name'], card['set'], card['number'],
                 card['rarity'], card['type'], card['price'], card['image'],
-                card['artist'], card['releaseDate'], datetime.now().isoformat()
+                card['artist'], card['releaseDate'], now, now
             ))
             
             # Add initial price history entry
             cursor.execute("""
-                INSERT INTO price_history (id, price, date)
+                INSERT INTO price_history (card_id, price, date)
                 VALUES (?, ?, ?)
-            """, (card['id'], card['price'], datetime.now().isoformat()))
-            
-            conn.commit()
+            """, (card['id'], card['price'], now))
+    
+    def _add_many(self, table: str, cards: List[Dict[str, Any]], record_prices: bool) -> Dict[str, List[str]]:
+        """Insert the cards not already in ``table`` in one transaction."""
+        now = datetime.now().isoformat()
+        with self._writing({table: [card['id'] for card in cards]}) as conn:
+            placeholders = ', '.join('?' for _ in cards)
+            existing = {row[0] for row in conn.execute(
+                f"SELECT id FROM {table} WHERE id IN ({placeholders})", [card['id'] for card in cards]
+            )} if cards else set()
+            new_cards = [card for card in cards if card['id'] not in existing]
+            conn.executemany(f"""
+                INSERT INTO {table} (
+                    id, name, set_name, number, rarity, type,
+                    price, image, artist, release_date, added_date, price_updated
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, [(
+                card['id'], card['name'], card['set'], card['number'],
+                card['rarity'], card['type'], card['price'], card['image'],
+                card['artist'], card['releaseDate'], now, now
+            ) for card in new_cards])
+            if record_prices:
+                conn.executemany("""
+                    INSERT OR REPLACE INTO price_history (card_id, price, date)
+                    VALUES (?, ?, ?)
+                """, [(card['id'], card['price'], now) for card in new_cards])
+        return {
+            "added": [card['id'] for card in new_cards],
+            "existing": [card['id'] for card in cards if card['id'] in existing],
+        }
+    
+    def add_many_to_collection(self, cards: List[Dict[str, Any]]) -> Dict[str, List[str]]:
+        """Add several cards to the collection, skipping ones already there."""
+        return self._add_many('collection', cards, record_prices=True)
     
     def remove_from_collection(self, card_id: str):
         """Remove a card from the collection."""
-        with sqlite3.connect(self.db_path) as conn:
+        with self._writing({'collection': [card_id]}) as conn:
             cursor = conn.cursor()
             cursor.execute("DELETE FROM collection WHERE id = ?", (card_id,))
             if cursor.rowcount == 0:
                 raise ValueError("Card not found in collection")
-            conn.commit()
     
-    def get_wishlist(self) -> List[Dict[str, Any]]:
-        """Get all cards in the wishlist."""
-        with sqlite3.connect(self.db_path) as conn:
-            conn.row_factory = self._dict_factory
-            cursor = conn.cursor()
-            cursor.execute("SELECT * FROM wishlist ORDER BY name")
-            return cursor.fetchall()
+    def get_wishlist(self, set_name: Optional[str] = None,
+                     rarity: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Get all cards in the wishlist, by name, optionally only one set's or rarity's."""
+        return self._current_list('wishlist').cards('name', set=set_name, rarity=rarity)
+    
+    def get_wishlist_page(self, sort: str = 'name', order: str = 'asc', limit: int = 50,
+                          cursor: Optional[str] = None, set_name: Optional[str] = None,
+                          rarity: Optional[str] = None) -> Dict[str, Any]:
+        """Get one keyset-paginated page of the wishlist."""
+        return self._get_page('wishlist', sort, order, limit, cursor, set_name, rarity)
     
     def add_to_wishlist(self, card: Dict[str, Any]):
         """Add a card to the wishlist."""
-        with sqlite3.connect(self.db_path) as conn:
+        with self._writing({'wishlist': [card['id']]}) as conn:
             cursor = conn.cursor()
+            now = datetime.now().isoformat()
             
             # Check if card already exists
             cursor.execute("SELECT id FROM wishlist WHERE id = ?", (card['id'],))
@@ -148,61 +284,67 @@ class Database:
             cursor.execute("""
                 INSERT INTO wishlist (
                     id, name, set_name, number, rarity, type,
-                    price, image, artist, release_date, added_date
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    price, image, artist, release_date, added_date, price_updated
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
             """, (
                 card['id'], card['name'], card['set'], card['number'],
                 card['rarity'], card['type'], card['price'], card['image'],
-                card['artist'], card['releaseDate'], datetime.now().isoformat()
+                card['artist'], card['releaseDate'], now, now
             ))
-            
-            conn.commit()
+    
+    def add_many_to_wishlist(self, cards: List[Dict[str, Any]]) -> Dict[str, List[str]]:
+        """Add several cards to the wishlist, skipping ones already there."""
+        return self._add_many('wishlist', cards, record_prices=False)
     
     def remove_from_wishlist(self, card_id: str):
         """Remove a card from the wishlist."""
-        with sqlite3.connect(self.db_path) as conn:
+        with self._writing({'wishlist': [card_id]}) as conn:
             cursor = conn.cursor()
             cursor.execute("DELETE FROM wishlist WHERE id = ?", (card_id,))
             if cursor.rowcount == 0:
                 raise ValueError("Card not found in wishlist")
-            conn.commit()
     
     def get_price_history(self, card_id: str) -> List[Dict[str, Any]]:
-        """Get price history for a card."""
-        with sqlite3.connect(self.db_path) as conn:
-            conn.row_factory = self._dict_factory
-            cursor = conn.cursor()
-            cursor.execute("""
-                SELECT price, date
-                FROM price_history
-                WHERE id = ?
-                ORDER BY date
-            """, (card_id,))
-            return cursor.fetchall()
+        """Get price history for a card, including archived months."""
+        with self._pool.connection() as conn:
+            return price_archive.history(conn, card_id)
+    
+    def archive_price_history(self, days: Optional[int] = None) -> Dict[str, int]:
+        """Compact price history older than ``days`` (whole months) into the archive."""
+        before = price_archive.cutoff() if days is None else price_archive.cutoff(days)
+        with self._pool.transaction() as conn:
+            return price_archive.archive(conn, before)
     
     def update_price(self, card_id: str, new_price: float):
         """Update the price of a card and record in price history."""
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            
-            # Update price in collection
-            cursor.execute("""
-                UPDATE collection
-                SET price = ?
-                WHERE id = ?
-            """, (new_price, card_id))
-            
-            # Update price in wishlist
-            cursor.execute("""
-                UPDATE wishlist
-                SET price = ?
-                WHERE id = ?
-            """, (new_price, card_id))
-            
-            # Add price history entry
-            cursor.execute("""
-                INSERT INTO price_history (id, price, date)
-                VALUES (?, ?, ?)
-            """, (card_id, new_price, datetime.now().isoformat()))
-            
-            conn.commit()
+        self.update_prices({card_id: new_price})
+    
+    def update_prices(self, prices: Dict[str, float]) -> int:
+        """Update many card prices in one transaction.
+        
+        Sets the price and refresh time in both the collection and the
+        wishlist and records a price history entry per card. Returns the
+        number of cards updated.
+        """
+        if not prices:
+            return 0
+        now = datetime.now().isoformat()
+        rows = [(price, now, card_id) for card_id, price in prices.items()]
+        with self._writing({table: list(prices) for table in VERSIONED_TABLES}) as conn:
+            conn.executemany("UPDATE collection SET price = ?, price_updated = ? WHERE id = ?", rows)
+            conn.executemany("UPDATE wishlist SET price = ?, price_updated = ? WHERE id = ?", rows)
+            conn.executemany(
+                "INSERT OR REPLACE INTO price_history (card_id, price, date) VALUES (?, ?, ?)",
+                [(card_id, price, now) for card_id, price in prices.items()]
+            )
+        return len(rows)
+    
+    def get_refresh_queue(self, stale_before: str) -> List[Dict[str, Any]]:
+        """Every tracked card (collection and wishlist), most urgent first (see ``refresh_queue``)."""
+        with self._pool.connection() as conn:
+            return refresh_queue(conn, stale_before)
+    
+    def get_price_freshness(self, stale_before: str) -> Dict[str, Any]:
+        """How many tracked cards there are, how many are stale, and the oldest refresh time."""
+        with self._pool.connection() as conn:
+            return price_freshness(conn, stale_before)
@@ -0,0 +1,132 @@
+"""Precomputed snapshot of the discover feed.
+
+The feed's sections (featured, new releases, trending) each cost an
+upstream search, so they are computed off the request path: a refresh
+runs every section concurrently and swaps in a new, versioned snapshot
+whose JSON body is rendered once. Requests just return the current
+snapshot. Once it is older than the refresh interval, the next request
+still gets it immediately and kicks off a refresh in the background
+(stale-while-revalidate), so a slow upstream never holds up the page.
+"""
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+
+from common import config
+
+Section = Callable[[], List[Dict[str, Any]]]
+
+
+class Snapshot(NamedTuple):
+    version: int
+    generated_at: float
+    sections: Dict[str, List[Dict[str, Any]]]
+    body: bytes
+
+
+class DiscoverFeed:
+    def __init__(self, sections: Dict[str, Section], interval: float = config.DISCOVER_REFRESH_INTERVAL):
+        self.sections = sections
+        self.interval = interval
+        self._snapshot: Optional[Snapshot] = None
+        self._executor = ThreadPoolExecutor(max_workers=len(sections), thread_name_prefix='discover')
+        self._refresh_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._refreshes = 0
+        self._failures = 0
+        self._last_duration: Optional[float] = None
+
+    def refresh(self) -> Optional[Snapshot]:
+        """Recompute every section concurrently and publish a new snapshot.
+
+        A section that fails keeps its previous cards. Returns the new
+        snapshot, or None if another refresh was already running.
+        """
+        if not self._refresh_lock.acquire(blocking=False):
+            return None
+        try:
+            started = time.perf_counter()
+            previous = self._snapshot
+            futures = {name: self._executor.submit(section) for name, section in self.sections.items()}
+            sections = {}
+            for name, future in futures.items():
+                try:
+                    sections[name] = future.result()
+                except Exception as e:
+                    self._failures += 1
+                    print(f"Error refreshing discover section {name}: {e}")
+                    sections[name] = previous.sections.get(name, []) if previous else []
+
+            version = previous.version + 1 if previous else 1
+            generated_at = time.time()
+            body = json.dumps({
+                **sections,
+                "version": version,
+                "generatedAt": datetime.fromtimestamp(generated_at).isoformat(),
+            }).encode()
+            # Publishing is a single reference swap, so readers never see a half-built snapshot
+            self._snapshot = Snapshot(version, generated_at, sections, body)
+            self._refreshes += 1
+            self._last_duration = time.perf_counter() - started
+            return self._snapshot
+        finally:
+            self._refresh_lock.release()
+
+    def _refresh_in_background(self):
+        if self._refresh_lock.locked():
+            return
+        threading.Thread(target=self._refresh_logged, name='discover-revalidate', daemon=True).start()
+
+    def _refresh_logged(self):
+        try:
+            self.refresh()
+        except Exception as e:
+            print(f"Error refreshing discover feed: {e}")
+
+    def get(self) -> Snapshot:
+        """The current snapshot, revalidated in the background once it is stale."""
+        snapshot = self._snapshot
+        while snapshot is None:
+            # Nothing to serve yet: wait for the refresh already running, or run one
+            with self._refresh_lock:
+                pass
+            snapshot = self._snapshot or self.refresh()
+        if time.time() - snapshot.generated_at > self.interval:
+            self._refresh_in_background()
+        return snapshot
+
+    def stats(self) -> Dict[str, Any]:
+        snapshot = self._snapshot
+        return {
+            "version": snapshot.version if snapshot else None,
+            "age_seconds": round(time.time() - snapshot.generated_at, 1) if snapshot else None,
+            "interval_seconds": self.interval,
+            "refreshing": self._refresh_lock.locked(),
+            "refreshes": self._refreshes,
+            "section_failures": self._failures,
+            "last_refresh_seconds": round(self._last_duration, 3) if self._last_duration is not None else None,
+        }
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._refresh_logged()
+            self._stop.wait(self.interval)
+
+    def start(self):
+        """Build the first snapshot now and refresh it every ``interval`` seconds."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='discover-refresh', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self._executor.shutdown(wait=True)
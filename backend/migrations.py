@@ -0,0 +1,160 @@
+"""Schema migrations for the backend database.
+
+Append new migrations to the end of MIGRATIONS; never edit one that has
+shipped. Statements are written out here rather than built from constants
+elsewhere, so a shipped migration cannot change under later edits. Apply
+them to a database file by hand with::
+
+    python migrations.py path/to/pokemon_cards.db
+"""
+import sys
+
+import database  # noqa: F401  (puts the shared ``common`` package on sys.path)
+from common.migrations import Migration, column_names, migrate
+from common.sqlite_pool import get_pool
+
+CARD_TABLE_COLUMNS = """
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    set_name TEXT NOT NULL,
+    number TEXT NOT NULL,
+    rarity TEXT NOT NULL,
+    type TEXT NOT NULL,
+    price REAL NOT NULL,
+    image TEXT NOT NULL,
+    artist TEXT NOT NULL,
+    release_date TEXT NOT NULL,
+    added_date TEXT NOT NULL
+"""
+
+
+def _pagination_indexes():
+    columns = {'name': 'name', 'price': 'price', 'added_date': 'added_date', 'set': 'set_name'}
+    return [
+        f"CREATE INDEX IF NOT EXISTS idx_{table}_{sort} ON {table} ({column}, id)"
+        for table in ('collection', 'wishlist')
+        for sort, column in columns.items()
+    ]
+
+
+def _rename_price_history_card_column(conn):
+    # Match api_server's price_history, which keys rows by card_id.
+    # RENAME COLUMN rewrites the schema in place, the table is not copied.
+    if 'card_id' not in column_names(conn, 'price_history'):
+        conn.execute("ALTER TABLE price_history RENAME COLUMN id TO card_id")
+
+
+def _add_price_updated_columns(conn):
+    # When each card's price was last refreshed, seeded from its latest
+    # price history entry (or the date it was added)
+    for table in ('collection', 'wishlist'):
+        if 'price_updated' not in column_names(conn, table):
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN price_updated TEXT")
+        conn.execute(f"""
+            UPDATE {table} SET price_updated = IFNULL(
+                (SELECT MAX(date) FROM price_history WHERE card_id = {table}.id),
+                added_date
+            )
+            WHERE price_updated IS NULL
+        """)
+
+
+MIGRATIONS = [
+    # Files created before versioning already have these tables, hence IF NOT EXISTS
+    Migration(1, "Base schema", [
+        f"CREATE TABLE IF NOT EXISTS collection ({CARD_TABLE_COLUMNS})",
+        f"CREATE TABLE IF NOT EXISTS wishlist ({CARD_TABLE_COLUMNS})",
+        """
+        CREATE TABLE IF NOT EXISTS price_history (
+            id TEXT,
+            price REAL NOT NULL,
+            date TEXT NOT NULL,
+            PRIMARY KEY (id, date)
+        )
+        """,
+    ]),
+    Migration(2, "Keyset pagination indexes", _pagination_indexes()),
+    Migration(3, "Unify price_history with api_server and add hot-path indexes", [
+        _rename_price_history_card_column,
+        # Price history per card, in date order, answered from the index alone
+        "CREATE INDEX IF NOT EXISTS idx_price_history_card_date ON price_history (card_id, date, price)",
+        "CREATE INDEX IF NOT EXISTS idx_collection_rarity ON collection (rarity)",
+        "CREATE INDEX IF NOT EXISTS idx_wishlist_rarity ON wishlist (rarity)",
+    ]),
+    Migration(4, "Track when each card's price was last refreshed", [
+        _add_price_updated_columns,
+        "CREATE INDEX IF NOT EXISTS idx_collection_price_updated ON collection (price_updated)",
+        "CREATE INDEX IF NOT EXISTS idx_wishlist_price_updated ON wishlist (price_updated)",
+    ]),
+    Migration(5, "Compact archive for old price history", [
+        """
+        CREATE TABLE IF NOT EXISTS price_archive (
+            card_id TEXT NOT NULL,
+            month TEXT NOT NULL,
+            points INTEGER NOT NULL,
+            first_date TEXT NOT NULL,
+            last_date TEXT NOT NULL,
+            data BLOB NOT NULL,
+            PRIMARY KEY (card_id, month)
+        ) WITHOUT ROWID
+        """,
+        # Finds the rows old enough to archive without a full scan
+        "CREATE INDEX IF NOT EXISTS idx_price_history_date ON price_history (date)",
+    ]),
+    Migration(6, "Change counters for conditional GETs", [
+        """
+        CREATE TABLE IF NOT EXISTS table_versions (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL
+        ) WITHOUT ROWID
+        """,
+        # Counters start from the current time in milliseconds (see common/table_versions.py)
+        """
+        INSERT OR IGNORE INTO table_versions (name, version)
+        VALUES ('collection', CAST((julianday('now') - 2440587.5) * 86400000 AS INTEGER))
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS collection_version_insert AFTER INSERT ON collection BEGIN
+            UPDATE table_versions SET version = version + 1 WHERE name = 'collection';
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS collection_version_update AFTER UPDATE ON collection BEGIN
+            UPDATE table_versions SET version = version + 1 WHERE name = 'collection';
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS collection_version_delete AFTER DELETE ON collection BEGIN
+            UPDATE table_versions SET version = version + 1 WHERE name = 'collection';
+        END
+        """,
+        """
+        INSERT OR IGNORE INTO table_versions (name, version)
+        VALUES ('wishlist', CAST((julianday('now') - 2440587.5) * 86400000 AS INTEGER))
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS wishlist_version_insert AFTER INSERT ON wishlist BEGIN
+            UPDATE table_versions SET version = version + 1 WHERE name = 'wishlist';
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS wishlist_version_update AFTER UPDATE ON wishlist BEGIN
+            UPDATE table_versions SET version = version + 1 WHERE name = 'wishlist';
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS wishlist_version_delete AFTER DELETE ON wishlist BEGIN
+            UPDATE table_versions SET version = version + 1 WHERE name = 'wishlist';
+        END
+        """,
+    ]),
+]
+
+
+def run_migrations(db_path=None):
+    """Migrate a database file (the configured one by default) to the latest version."""
+    return migrate(get_pool(db_path).connection(), MIGRATIONS)
+
+
+if __name__ == '__main__':
+    print(f"Database is at version {run_migrations(sys.argv[1] if len(sys.argv) > 1 else None)}")
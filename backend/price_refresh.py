@@ -0,0 +1,236 @@
+"""Background refresh of market prices for every tracked card.
+
+Each cycle takes every card in every user's collection and wishlist (see
+common/shards.py; with a single database that is just the one), most
+urgent first (stale prices, then the most valuable cards), splits them
+into batches, and hands the batches to a small worker pool. A card that
+several users track is looked up once. A worker looks up a whole batch
+with one upstream request (``TCGPlayerAPI.get_prices`` by default) and
+writes the results with one transaction per user
+(``Database.update_prices``), then passes each user's new prices to
+``on_update`` if one is given. After each cycle, history old enough for
+the archive is compacted. ``stats()`` reports throughput and how far
+behind the prices are.
+
+The queue, the freshness stats and the check for history to archive
+read each user's file over a read-only connection of their own rather
+than through the shard router, which would open (and migrate) every
+user's database each time and push the users being served out of its
+open set. Only users with new prices or history to archive are opened
+through it.
+
+Run a single cycle by hand with::
+
+    python price_refresh.py
+"""
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from database import Database, price_freshness, refresh_queue
+from api import TCGPlayerAPI
+from common import config, price_archive
+from common.shards import ShardRouter
+
+PriceFetcher = Callable[[List[str]], Dict[str, float]]
+PriceListener = Callable[[Dict[str, float], Optional[str]], None]
+
+
+class PriceRefresher:
+    def __init__(self,
+                 shards: ShardRouter,
+                 fetch_prices: Optional[PriceFetcher] = None,
+                 batch_size: int = config.PRICE_REFRESH_BATCH_SIZE,
+                 workers: int = config.PRICE_REFRESH_WORKERS,
+                 interval: float = config.PRICE_REFRESH_INTERVAL,
+                 stale_after: float = config.PRICE_STALE_AFTER,
+                 on_update: Optional[PriceListener] = None):
+        self.shards = shards
+        self._client = None
+        if fetch_prices is None:
+            self._client = TCGPlayerAPI(batch_size=batch_size, pool_size=workers)
+            fetch_prices = self._client.get_prices
+        self.fetch_prices = fetch_prices
+        self.batch_size = batch_size
+        self.workers = workers
+        self.interval = interval
+        self.stale_after = stale_after
+        self.on_update = on_update
+
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='price-refresh')
+        self._cycle_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._totals = {"cycles": 0, "cards_refreshed": 0, "cards_failed": 0, "batches_failed": 0}
+        self._last_cycle: Optional[Dict[str, Any]] = None
+
+    def _stale_before(self) -> str:
+        return (datetime.now() - timedelta(seconds=self.stale_after)).isoformat()
+
+    def _refresh_batch(self, card_ids: List[str], owners: Dict[str, List[Optional[str]]]) -> int:
+        prices = self.fetch_prices(card_ids)
+        # Ignore anything upstream returned that we did not ask for
+        prices = {card_id: prices[card_id] for card_id in card_ids if card_id in prices}
+        by_user: Dict[Optional[str], Dict[str, float]] = {}
+        for card_id, price in prices.items():
+            for user_id in owners[card_id]:
+                by_user.setdefault(user_id, {})[card_id] = price
+        for user_id, user_prices in by_user.items():
+            with self.shards.use(user_id) as db:
+                db.update_prices(user_prices)
+            if self.on_update is not None:
+                self.on_update(user_prices, user_id)
+        return len(prices)
+
+    @contextmanager
+    def _reading(self, user_id: Optional[str]) -> Iterator[sqlite3.Connection]:
+        """A read-only connection to ``user_id``'s database, opened beside the router."""
+        conn = sqlite3.connect(Path(self.shards.path(user_id)).absolute().as_uri() + "?mode=ro", uri=True)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def _read_each(self, read: Callable[[sqlite3.Connection], Any]) -> Iterator[tuple]:
+        """(user id, ``read(conn)``) for every user whose database can be read."""
+        for user_id in self.shards.user_ids():
+            try:
+                with self._reading(user_id) as conn:
+                    result = read(conn)
+            except sqlite3.Error as e:
+                # Not migrated yet, say; it is once its user is next served
+                print(f"Error reading {user_id or 'the database'} for the price refresh: {e}")
+                continue
+            yield user_id, result
+
+    def _queue(self) -> Dict[str, List[Optional[str]]]:
+        """Every tracked card, most urgent first, with the users tracking it."""
+        stale_before = self._stale_before()
+        rows = {}
+        owners: Dict[str, List[Optional[str]]] = {}
+        for user_id, cards in self._read_each(lambda conn: refresh_queue(conn, stale_before)):
+            for card in cards:
+                owners.setdefault(card['id'], []).append(user_id)
+                known = rows.get(card['id'])
+                # Across users a card is as urgent as its stalest copy
+                if known is None or card['price_updated'] < known['price_updated']:
+                    rows[card['id']] = card
+        # The same order as Database.get_refresh_queue
+        ordered = sorted(rows.values(), key=lambda card: (
+            card['price_updated'] >= stale_before, -(card['price'] or 0), card['price_updated']
+        ))
+        return {card['id']: owners[card['id']] for card in ordered}
+
+    def refresh_once(self) -> Optional[Dict[str, Any]]:
+        """Run one full refresh cycle; returns its stats, or None if one is already running."""
+        if not self._cycle_lock.acquire(blocking=False):
+            return None
+        try:
+            started = time.perf_counter()
+            owners = self._queue()
+            queue = list(owners)
+            batches = [queue[i:i + self.batch_size] for i in range(0, len(queue), self.batch_size)]
+
+            refreshed = failed_batches = 0
+            futures = {self._executor.submit(self._refresh_batch, batch, owners): batch for batch in batches}
+            for future in as_completed(futures):
+                try:
+                    refreshed += future.result()
+                except Exception as e:
+                    failed_batches += 1
+                    print(f"Error refreshing prices for {len(futures[future])} cards: {e}")
+
+            duration = time.perf_counter() - started
+            archived = 0
+            before = price_archive.cutoff()
+            for user_id, due in self._read_each(lambda conn: price_archive.pending(conn, before)):
+                if not due:
+                    continue
+                try:
+                    with self.shards.use(user_id) as db:
+                        archived += db.archive_price_history()['archived_rows']
+                except Exception as e:
+                    print(f"Error archiving price history: {e}")
+            cycle = {
+                "finished_at": datetime.now().isoformat(),
+                "cards": len(queue),
+                "batches": len(batches),
+                "cards_refreshed": refreshed,
+                "cards_failed": len(queue) - refreshed,
+                "batches_failed": failed_batches,
+                "duration_seconds": round(duration, 3),
+                "cards_per_second": round(refreshed / duration, 1) if duration > 0 else 0,
+                "history_archived": archived,
+            }
+            self._totals["cycles"] += 1
+            self._totals["cards_refreshed"] += refreshed
+            self._totals["cards_failed"] += cycle["cards_failed"]
+            self._totals["batches_failed"] += failed_batches
+            self._last_cycle = cycle
+            return cycle
+        finally:
+            self._cycle_lock.release()
+
+    def stats(self) -> Dict[str, Any]:
+        """Throughput of the last cycle, running totals, and current price lag."""
+        freshness = {"tracked_cards": 0, "stale_cards": 0, "oldest_update": None}
+        stale_before = self._stale_before()
+        for _, user_freshness in self._read_each(lambda conn: price_freshness(conn, stale_before)):
+            freshness["tracked_cards"] += user_freshness['tracked_cards']
+            freshness["stale_cards"] += user_freshness['stale_cards']
+            if user_freshness['oldest_update'] and (freshness['oldest_update'] is None or
+                                                    user_freshness['oldest_update'] < freshness['oldest_update']):
+                freshness['oldest_update'] = user_freshness['oldest_update']
+        lag = None
+        if freshness['oldest_update']:
+            oldest = datetime.fromisoformat(freshness['oldest_update'])
+            lag = round((datetime.now() - oldest).total_seconds(), 1)
+        return {
+            "running": self._thread is not None and self._thread.is_alive(),
+            "refreshing": self._cycle_lock.locked(),
+            "interval_seconds": self.interval,
+            "batch_size": self.batch_size,
+            "workers": self.workers,
+            "tracked_cards": freshness['tracked_cards'],
+            "stale_cards": freshness['stale_cards'],
+            "lag_seconds": lag,
+            "last_cycle": self._last_cycle,
+            **self._totals,
+        }
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.refresh_once()
+            except Exception as e:
+                print(f"Error in price refresh cycle: {e}")
+            self._stop.wait(self.interval)
+
+    def start(self):
+        """Refresh now and then every ``interval`` seconds on a background thread."""
+        if self.interval <= 0 or (self._thread is not None and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='price-refresh-scheduler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self._executor.shutdown(wait=True)
+        if self._client is not None:
+            self._client.close()
+
+
+if __name__ == '__main__':
+    refresher = PriceRefresher(ShardRouter(Database, Database.close))
+    print(refresher.refresh_once())
+    print(refresher.stats())
+    refresher.stop()
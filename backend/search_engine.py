@@ -0,0 +1,98 @@
+"""Searches pushed down into SQL over the local card catalog.
+
+``build_query`` turns the search form (text, rarity, set, price range and
+a ``field-order`` sort) into one parameterized query: the text goes to
+the FTS index, the filters and sort to indexed expressions on
+``catalog_cards`` (see ``catalog.INDEXES``), and paging to LIMIT/OFFSET
+or a keyset cursor. Only the requested page is ever read into Python.
+"""
+import json
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from common import catalog
+from common.pagination import DEFAULT_PAGE_SIZE, SORT_ORDERS, PageRequestError, build_page, keyset_query
+
+SORT_FIELDS = tuple(catalog.SORT_EXPRESSIONS)
+
+
+def parse_sort(sort_by: Optional[str]) -> Tuple[str, str]:
+    """Split a ``field-order`` sort such as ``price-desc``, checking the field is allowed."""
+    if not sort_by:
+        return 'name', 'asc'
+    field, _, order = sort_by.partition('-')
+    if field not in SORT_FIELDS:
+        raise PageRequestError(f"Unknown sort field {field!r}; expected one of {', '.join(SORT_FIELDS)}")
+    order = order or 'asc'
+    if order not in SORT_ORDERS:
+        raise PageRequestError("order must be 'asc' or 'desc'")
+    return field, order
+
+
+def sort_key(field: str) -> Callable[[Dict[str, Any]], Any]:
+    """Sort key matching SORT_EXPRESSIONS, for app-format cards that did not come from SQL."""
+    if field == 'price':
+        return lambda card: card.get('price') or 0
+    if field == 'rarity':
+        ranks = {rarity: rank for rank, rarity in enumerate(catalog.RARITY_ORDER)}
+        return lambda card: ranks.get(card.get('rarity') or '', len(ranks))
+    return lambda card: card.get(field) or ''
+
+
+def build_query(query: Optional[str] = None,
+                rarity: Optional[str] = None,
+                set_name: Optional[str] = None,
+                min_price: Optional[float] = None,
+                max_price: Optional[float] = None,
+                sort_by: Optional[str] = None,
+                limit: int = DEFAULT_PAGE_SIZE,
+                offset: int = 0,
+                cursor: Optional[str] = None) -> Tuple[str, List[Any], str, str]:
+    """Build the SQL for one page of search results.
+
+    Returns (sql, params, sort field, order). Empty strings count as "no
+    filter", matching what the search form sends for unset fields.
+    """
+    sort, order = parse_sort(sort_by)
+    if cursor and offset:
+        raise PageRequestError("Use either cursor or offset, not both")
+
+    filters = []
+    expression = catalog.match_expression(query or '')
+    if expression:
+        filters.append(('rowid IN (SELECT rowid FROM catalog_fts WHERE catalog_fts MATCH ?)', expression))
+    if rarity:
+        filters.append(('rarity = ?', rarity))
+    if set_name:
+        filters.append(('set_name = ?', set_name))
+    if min_price is not None:
+        filters.append(('IFNULL(price, 0) >= ?', min_price))
+    if max_price is not None:
+        filters.append(('IFNULL(price, 0) <= ?', max_price))
+
+    sql, params = keyset_query('catalog_cards', 'id, data', catalog.SORT_EXPRESSIONS,
+                               sort, order, limit, cursor, filters, offset)
+    return sql, params, sort, order
+
+
+def search(conn,
+           query: Optional[str] = None,
+           rarity: Optional[str] = None,
+           set_name: Optional[str] = None,
+           min_price: Optional[float] = None,
+           max_price: Optional[float] = None,
+           sort_by: Optional[str] = None,
+           limit: int = DEFAULT_PAGE_SIZE,
+           offset: int = 0,
+           cursor: Optional[str] = None) -> Dict[str, Any]:
+    """Run a search against the catalog and return one page of app-format cards.
+
+    The page looks like ``{"items": [...], "next_cursor": ...}``.
+    """
+    sql, params, sort, order = build_query(query, rarity, set_name, min_price, max_price,
+                                           sort_by, limit, offset, cursor)
+    cursor_rows = conn.execute(sql, params)
+    columns = [description[0] for description in cursor_rows.description]
+    rows = [dict(zip(columns, row)) for row in cursor_rows.fetchall()]
+    page = build_page(rows, sort, order, limit)
+    page["items"] = [catalog.to_app_card(json.loads(item["data"])) for item in page["items"]]
+    return page
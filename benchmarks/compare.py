@@ -0,0 +1,70 @@
+"""Compare two benchmark result files written by run.py.
+
+Prints the change in p50, p99 and throughput for every endpoint found in
+both, and exits with status 1 if any endpoint's p50 latency grew, or its
+throughput fell, by more than ``--threshold`` (p99 is shown but not
+checked, being too noisy over a few hundred requests)::
+
+    python benchmarks/compare.py benchmarks/results/old.json benchmarks/results/new.json
+"""
+import argparse
+import json
+import sys
+from typing import Any, Dict, Optional, Tuple
+
+Key = Tuple[str, int, str]
+
+
+def load(path: str) -> Dict[Key, Dict[str, Any]]:
+    with open(path) as f:
+        results = json.load(f)
+    return {
+        (run['service'], run['size'], endpoint['endpoint']): endpoint
+        for run in results['runs']
+        for endpoint in run['endpoints']
+    }
+
+
+def change(old: Optional[float], new: Optional[float]) -> Optional[float]:
+    if not old or new is None:
+        return None
+    return (new - old) / old
+
+
+def fmt(value: Optional[float]) -> str:
+    return f"{value:+.0%}" if value is not None else "n/a"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('baseline')
+    parser.add_argument('current')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='relative slowdown counted as a regression (default 0.2 = 20%%)')
+    args = parser.parse_args()
+
+    baseline, current = load(args.baseline), load(args.current)
+    regressions = []
+    print(f"{'service':<11} {'size':>8}  {'endpoint':<32} {'p50':>7} {'p99':>7} {'req/s':>7}")
+    for key in sorted(baseline.keys() & current.keys()):
+        old, new = baseline[key], current[key]
+        p50 = change(old['p50_ms'], new['p50_ms'])
+        p99 = change(old['p99_ms'], new['p99_ms'])
+        throughput = change(old['throughput_rps'], new['throughput_rps'])
+        regressed = (p50 is not None and p50 > args.threshold) or \
+                    (throughput is not None and throughput < -args.threshold)
+        if regressed:
+            regressions.append(key)
+        service, size, endpoint = key
+        print(f"{service:<11} {size:>8}  {endpoint:<32} {fmt(p50):>7} {fmt(p99):>7} {fmt(throughput):>7}"
+              + ("  REGRESSION" if regressed else ""))
+
+    for key in sorted(baseline.keys() ^ current.keys()):
+        print(f"only in {'baseline' if key in baseline else 'current'}: {key[0]} {key[1]} {key[2]}")
+    if regressions:
+        print(f"\n{len(regressions)} regression(s) above {args.threshold:.0%}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,171 @@
+"""Synthetic, reproducible databases for the benchmarks.
+
+``build`` creates a service's database with the real migrations, then
+bulk-loads ``size`` cards (the same ids, names and sets as the stand-in
+Pokemon TCG API) with a year of price history each: prices start from a
+long-tailed distribution (mostly cheap cards, a few expensive ones) and
+follow a random walk. Triggers on the card and history tables are
+dropped during the load and recreated afterwards, and the aggregates
+they maintain are rebuilt once, which is much faster than maintaining
+them row by row. The same seed always gives the same database.
+
+It must run in a process that has the service's directory first on
+``sys.path`` (see harness.py), because it uses that service's migrations.
+"""
+import random
+import sqlite3
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterator, List, Sequence
+
+from common.sqlite_pool import get_pool
+from common.standin import ARTISTS, NAMES, RARITIES, SETS, TYPES
+
+# Days of price history per card, ending at the fixed date below so a
+# dataset built today matches one built next month
+HISTORY_DAYS = 365
+HISTORY_END = datetime(2024, 6, 30, 12, 0, 0)
+
+# One card in this many is on the wishlist as well
+WISHLIST_EVERY = 10
+
+INSERT_BATCH = 10000
+
+
+def generate_cards(size: int, history_points: int, seed: int) -> Iterator[Dict[str, Any]]:
+    """Cards with a price history of ``history_points`` (date, price) pairs, oldest first."""
+    rng = random.Random(seed)
+    step = timedelta(days=HISTORY_DAYS) / max(history_points, 1)
+    start = HISTORY_END - timedelta(days=HISTORY_DAYS)
+    for i in range(size):
+        set_id, set_name, _, release_date = SETS[i % len(SETS)]
+        number = str(i // len(SETS) + 1)
+        price = min(rng.lognormvariate(1.0, 1.3), 2000.0)
+        # Each card is priced on its own schedule, so updates spread over every day
+        first = start + step * rng.random()
+        history = []
+        for point in range(history_points):
+            price = max(0.05, price * (1 + rng.gauss(0, 0.03)))
+            moment = first + step * point
+            history.append((moment, round(price, 2)))
+        yield {
+            "id": f"{set_id}-{number}",
+            "name": NAMES[i % len(NAMES)] + ("" if i < len(NAMES) else f" {i // len(NAMES)}"),
+            "set_name": set_name,
+            "number": number,
+            "rarity": rng.choice(RARITIES),
+            "type": rng.choice(TYPES),
+            "artist": rng.choice(ARTISTS),
+            "image": f"https://images.pokemontcg.io/{set_id}/{number}.png",
+            "release_date": release_date.replace('/', '-'),
+            "price": round(price, 2),
+            "quantity": rng.choice((1, 1, 1, 2, 3)),
+            "history": history,
+            "wishlist": i % WISHLIST_EVERY == 0,
+        }
+
+
+@contextmanager
+def _triggers_dropped(conn: sqlite3.Connection, tables: Sequence[str]):
+    placeholders = ', '.join('?' for _ in tables)
+    triggers = conn.execute(
+        f"SELECT name, sql FROM sqlite_master WHERE type = 'trigger' AND tbl_name IN ({placeholders})",
+        list(tables)
+    ).fetchall()
+    for name, _ in triggers:
+        conn.execute(f"DROP TRIGGER {name}")
+    yield
+    for _, sql in triggers:
+        conn.execute(sql)
+
+
+def _batches(rows: Iterator[Dict[str, Any]]) -> Iterator[List[Dict[str, Any]]]:
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= INSERT_BATCH:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _load_api_server(conn: sqlite3.Connection, cards: Iterator[Dict[str, Any]]):
+    import rollups
+    import stats
+    with _triggers_dropped(conn, ('pokemon_cards', 'wishlist', 'price_history')):
+        for batch in _batches(cards):
+            rows = [(card['id'], card['name'], card['set_name'], card['rarity'], card['image'],
+                     card['price'], card['number'], card['quantity'],
+                     card['history'][0][0].strftime('%Y-%m-%d %H:%M:%S') if card['history'] else None)
+                    for card in batch]
+            conn.executemany('''
+                INSERT INTO pokemon_cards (id, name, set_name, rarity, image_url, price, card_number, quantity, added_date)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, IFNULL(?, datetime('now')))
+            ''', rows)
+            conn.executemany('''
+                INSERT INTO wishlist (id, name, set_name, rarity, image_url, price, card_number)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', [row[:7] for row, card in zip(rows, batch) if card['wishlist']])
+            conn.executemany('INSERT INTO price_history (card_id, price, date) VALUES (?, ?, ?)', [
+                (card['id'], price, moment.strftime('%Y-%m-%d %H:%M:%S'))
+                for card in batch for moment, price in card['history']
+            ])
+    stats.rebuild_stats(conn)
+    rollups.rebuild_rollups(conn)
+
+
+def _load_backend(conn: sqlite3.Connection, cards: Iterator[Dict[str, Any]]):
+    with _triggers_dropped(conn, ('collection', 'wishlist', 'price_history')):
+        for batch in _batches(cards):
+            rows = []
+            for card in batch:
+                added = card['history'][0][0].isoformat() if card['history'] else HISTORY_END.isoformat()
+                updated = card['history'][-1][0].isoformat() if card['history'] else added
+                rows.append((card['id'], card['name'], card['set_name'], card['number'], card['rarity'],
+                             card['type'], card['price'], card['image'], card['artist'],
+                             card['release_date'], added, updated))
+            insert = '''
+                INSERT INTO {table} (
+                    id, name, set_name, number, rarity, type,
+                    price, image, artist, release_date, added_date, price_updated
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            '''
+            conn.executemany(insert.format(table='collection'), rows)
+            conn.executemany(insert.format(table='wishlist'),
+                             [row for row, card in zip(rows, batch) if card['wishlist']])
+            conn.executemany('INSERT INTO price_history (card_id, price, date) VALUES (?, ?, ?)', [
+                (card['id'], price, moment.isoformat())
+                for card in batch for moment, price in card['history']
+            ])
+
+
+LOADERS = {
+    'api_server': _load_api_server,
+    'backend': _load_backend,
+}
+
+
+def build(service: str, path: str, size: int, history_points: int, seed: int) -> Dict[str, Any]:
+    """Create ``path`` with the service's schema and ``size`` synthetic cards."""
+    from migrations import run_migrations
+    started = time.perf_counter()
+    run_migrations(path)
+    get_pool(path).close_all()
+
+    conn = sqlite3.connect(path, isolation_level=None)
+    conn.execute('PRAGMA synchronous = OFF')
+    conn.execute('BEGIN')
+    LOADERS[service](conn, generate_cards(size, history_points, seed))
+    conn.execute('COMMIT')
+    conn.execute('ANALYZE')
+    # Fold the WAL into the main file so the dataset can be copied as one file
+    conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    history_rows = conn.execute('SELECT COUNT(*) FROM price_history').fetchone()[0]
+    conn.close()
+    return {
+        "cards": size,
+        "price_history_rows": history_rows,
+        "build_seconds": round(time.perf_counter() - started, 2),
+    }
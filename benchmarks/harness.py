@@ -0,0 +1,239 @@
+"""Benchmark one service against one synthetic dataset, in this process.
+
+The service's ASGI app is imported and driven through httpx's ASGI
+transport, so no sockets or server processes are involved and the
+numbers measure the app itself: routing, validation, queries and
+serialization. Each endpoint gets a few warm-up requests, then runs
+until ``--requests`` requests or ``--max-seconds`` have been spent
+(whichever comes first, with a minimum of a few requests), with
+``--concurrency`` requests in flight.
+
+run.py starts one process per service and dataset size, since the two
+services have modules of the same name and read their configuration at
+import. The results are printed as JSON on stdout::
+
+    python benchmarks/harness.py --service backend --size 1000
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import math
+import os
+import shutil
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SERVICES = ('api_server', 'backend')
+
+# Every endpoint gets at least this many timed requests, whatever the time budget
+MIN_REQUESTS = 5
+
+# Cards seeded into the local catalog that /api/search/ reads from
+CATALOG_CARDS = 5000
+
+# The backend looks cards up on a TCGPlayer stand-in with at least this
+# many products, numbered from FIRST_PRODUCT_ID
+FIRST_PRODUCT_ID = 100000
+UPSTREAM_CARDS = 500
+
+Request = Tuple[str, str, Optional[Any]]
+
+
+class Endpoint(NamedTuple):
+    name: str
+    request: Callable[[int], Request]
+    warmup: bool = True
+    # Run at most as many requests as this endpoint completed (deletes undo adds)
+    limit_by: Optional[str] = None
+
+
+def api_server_endpoints() -> List[Endpoint]:
+    from common.standin import NAMES
+
+    def new_card(i):
+        return {"id": f"bench-{i}", "name": f"Bench Card {i}", "set_name": "Benchmark", "rarity": "Rare",
+                "image_url": "https://example.com/bench.png", "price": 1.0 + i % 50, "card_number": str(i)}
+
+    return [
+        Endpoint("GET /api/cards/", lambda i: ("GET", "/api/cards/", None)),
+        Endpoint("GET /api/cards/?limit=50", lambda i: ("GET", "/api/cards/?limit=50&sort=price&order=desc", None)),
+        Endpoint("GET /api/stats/", lambda i: ("GET", "/api/stats/", None)),
+        Endpoint("GET /api/search/", lambda i: ("GET", f"/api/search/?query={NAMES[i % len(NAMES)]}", None)),
+        Endpoint("POST /api/cards/", lambda i: ("POST", "/api/cards/", new_card(i)), warmup=False),
+        Endpoint("DELETE /api/cards/{id}", lambda i: ("DELETE", f"/api/cards/bench-{i}", None),
+                 warmup=False, limit_by="POST /api/cards/"),
+    ]
+
+
+def backend_endpoints() -> List[Endpoint]:
+    return [
+        Endpoint("GET /collection", lambda i: ("GET", "/collection", None)),
+        Endpoint("GET /collection?limit=50", lambda i: ("GET", "/collection?limit=50&sort=price&order=desc", None)),
+        Endpoint("GET /sets", lambda i: ("GET", "/sets", None)),
+        Endpoint("GET /discover", lambda i: ("GET", "/discover", None)),
+        Endpoint("POST /collection/{id}", lambda i: ("POST", f"/collection/{FIRST_PRODUCT_ID + i}", None),
+                 warmup=False),
+        Endpoint("DELETE /collection/{id}", lambda i: ("DELETE", f"/collection/{FIRST_PRODUCT_ID + i}", None),
+                 warmup=False, limit_by="POST /collection/{id}"),
+    ]
+
+
+ENDPOINTS = {
+    'api_server': api_server_endpoints,
+    'backend': backend_endpoints,
+}
+
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    return sorted_values[max(0, math.ceil(p / 100 * len(sorted_values)) - 1)]
+
+
+async def measure(client, endpoint: Endpoint, requests: int, concurrency: int,
+                  max_seconds: float) -> Dict[str, Any]:
+    latencies: List[float] = []
+    errors = 0
+    counter = itertools.count()
+    deadline = time.perf_counter() + max_seconds
+
+    async def worker():
+        nonlocal errors
+        while True:
+            i = next(counter)
+            if i >= requests or (i >= MIN_REQUESTS and time.perf_counter() > deadline):
+                return
+            method, url, body = endpoint.request(i)
+            started = time.perf_counter()
+            try:
+                response = await client.request(method, url, json=body)
+                await response.aread()
+            except Exception:
+                # ASGITransport re-raises the app's unhandled exceptions
+                latencies.append(time.perf_counter() - started)
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - started)
+            if response.status_code >= 400:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "endpoint": endpoint.name,
+        "requests": len(latencies),
+        "errors": errors,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 3),
+        "max_ms": round(latencies[-1] * 1000, 3),
+        "throughput_rps": round(len(latencies) / elapsed, 1) if elapsed > 0 else None,
+    }
+
+
+async def run_endpoints(app, endpoints: List[Endpoint], args) -> List[Dict[str, Any]]:
+    import httpx
+
+    results: Dict[str, Dict[str, Any]] = {}
+    await app.router.startup()
+    try:
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+            for endpoint in endpoints:
+                if endpoint.warmup:
+                    for i in range(args.warmup):
+                        method, url, body = endpoint.request(i)
+                        try:
+                            await client.request(method, url, json=body)
+                        except Exception:
+                            pass  # Counted when the endpoint is measured
+                requests = args.requests
+                if endpoint.limit_by:
+                    requests = min(requests, results[endpoint.limit_by]["requests"])
+                results[endpoint.name] = await measure(client, endpoint, requests, args.concurrency,
+                                                       args.max_seconds)
+                print(f"  {endpoint.name}: p50 {results[endpoint.name]['p50_ms']} ms", file=sys.stderr)
+    finally:
+        await app.router.shutdown()
+    return list(results.values())
+
+
+def dataset_file(args) -> str:
+    return os.path.join(args.data_dir, f"{args.service}-{args.size}-h{args.history_points}-s{args.seed}.db")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark one service against one synthetic dataset")
+    parser.add_argument('--service', choices=SERVICES, required=True)
+    parser.add_argument('--size', type=int, required=True, help='cards in the synthetic collection')
+    parser.add_argument('--history-points', type=int, default=12, help='price history entries per card')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--data-dir', default=os.path.join(ROOT, 'benchmarks', 'data'),
+                        help='where generated datasets are kept for reuse')
+    parser.add_argument('--requests', type=int, default=200, help='requests per endpoint at most')
+    parser.add_argument('--max-seconds', type=float, default=10.0, help='time budget per endpoint')
+    parser.add_argument('--concurrency', type=int, default=1, help='requests in flight')
+    parser.add_argument('--warmup', type=int, default=3, help='untimed requests per read endpoint')
+    parser.add_argument('--no-response-cache', action='store_true',
+                        help='disable the rendered-body cache so every read hits the database')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='poketrack-bench-')
+    service_dir = os.path.join(ROOT, args.service)
+    sys.path[:0] = [service_dir, ROOT, os.path.join(ROOT, 'benchmarks')]
+    from common.standin import tcgplayer_server, sample_cards
+
+    # The backend's card lookups and discover sections go to TCGPlayer;
+    # a local stand-in answers them instead of the real API
+    upstream = tcgplayer_server(sample_cards(max(args.requests, UPSTREAM_CARDS), seed=args.seed)).start()
+    # Configuration is read at import, so it is set before anything is imported
+    os.environ.update({
+        'POKETRACK_DB_PATH': os.path.join(workdir, 'cards.db'),
+        'POKETRACK_CATALOG_DB_PATH': os.path.join(workdir, 'catalog.db'),
+        'POKETRACK_PRICE_REFRESH_INTERVAL': '0',
+        'TCGPLAYER_API_URL': upstream.url,
+        'TCGPLAYER_PUBLIC_KEY': 'benchmark',
+        'TCGPLAYER_PRIVATE_KEY': 'benchmark',
+    })
+    if args.no_response_cache:
+        os.environ['POKETRACK_ETAG_CACHE_ENTRIES'] = '0'
+    os.chdir(workdir)
+
+    # The services log with print(); keep stdout for the results
+    results = sys.stdout
+    sys.stdout = sys.stderr
+    try:
+        import datasets
+        from common import catalog
+
+        path = dataset_file(args)
+        dataset = {"cards": args.size, "history_points": args.history_points, "seed": args.seed,
+                   "build_seconds": None}
+        if not os.path.exists(path):
+            print(f"Building {path}", file=sys.stderr)
+            os.makedirs(args.data_dir, exist_ok=True)
+            dataset.update(datasets.build(args.service, path + '.tmp', args.size, args.history_points, args.seed))
+            os.replace(path + '.tmp', path)
+        # Writes go to a copy, so every run starts from the same data
+        shutil.copyfile(path, os.environ['POKETRACK_DB_PATH'])
+        catalog.sync(catalog.get_connection(), sample_cards(min(args.size, CATALOG_CARDS), seed=args.seed))
+
+        from api_server import app
+        endpoints = asyncio.run(run_endpoints(app, ENDPOINTS[args.service](), args))
+    finally:
+        upstream.stop()
+        os.chdir(ROOT)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    json.dump({"service": args.service, "size": args.size, "dataset": dataset, "endpoints": endpoints},
+              results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""Benchmark both API servers on synthetic collections of several sizes.
+
+For every service and size, harness.py runs in its own process against a
+generated database (built on first use and kept in ``--data-dir``) and
+times each endpoint. The combined results, with the git commit and
+machine they came from, are written as JSON to ``--output``; compare two
+result files with compare.py to catch regressions::
+
+    python benchmarks/run.py --sizes 1000 100000 1000000
+    python benchmarks/compare.py benchmarks/results/old.json benchmarks/results/new.json
+
+Building the 1M-card datasets takes several minutes the first time.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+from datetime import datetime
+
+from harness import ROOT, SERVICES
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--services', nargs='+', choices=SERVICES, default=list(SERVICES))
+    parser.add_argument('--sizes', nargs='+', type=int, default=[1000, 100000, 1000000])
+    parser.add_argument('--output', help='results file (default benchmarks/results/<timestamp>.json)')
+    args, harness_args = parser.parse_known_args()
+
+    started = datetime.now()
+    output = args.output or os.path.join(ROOT, 'benchmarks', 'results', f"{started:%Y%m%dT%H%M%S}.json")
+    runs = []
+    for size in args.sizes:
+        for service in args.services:
+            print(f"{service}, {size} cards", file=sys.stderr)
+            completed = subprocess.run(
+                [sys.executable, os.path.join(ROOT, 'benchmarks', 'harness.py'),
+                 '--service', service, '--size', str(size), *harness_args],
+                stdout=subprocess.PIPE, check=True
+            )
+            runs.append(json.loads(completed.stdout))
+
+    results = {
+        "started_at": started.isoformat(timespec='seconds'),
+        "git_commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "options": harness_args,
+        "runs": runs,
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+
+    for run in runs:
+        print(f"\n{run['service']} ({run['size']} cards)")
+        print(f"  {'endpoint':<32} {'p50 ms':>10} {'p99 ms':>10} {'req/s':>10}")
+        for endpoint in run['endpoints']:
+            print(f"  {endpoint['endpoint']:<32} {endpoint['p50_ms']:>10} {endpoint['p99_ms']:>10} "
+                  f"{endpoint['throughput_rps']:>10}")
+    print(f"\nResults written to {output}")
+
+
+if __name__ == '__main__':
+    main()
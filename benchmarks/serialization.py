@@ -0,0 +1,93 @@
+"""Per-row cost of serving the collection listing, before and after the fast path.
+
+"before" is how /collection used to build its response: ``SELECT *``, keys
+renamed by a Python row factory, every row validated into a ``Card`` and
+then walked by ``jsonable_encoder`` before ``json.dumps``. "after" is the
+current path: the collection held in memory as ``Record`` objects (see
+``common.list_cache``), turned into dicts and encoded directly by
+``common.fast_json``.
+
+Run from the repository root::
+
+    python benchmarks/serialization.py --rows 10000 --repeat 5
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=10000, help='cards in the collection')
+    parser.add_argument('--repeat', type=int, default=5, help='runs per path; the best is reported')
+    args = parser.parse_args()
+
+    # Point the backend at throwaway databases before it is imported
+    workdir = tempfile.mkdtemp(prefix='poketrack-bench-')
+    os.environ['POKETRACK_DB_PATH'] = os.path.join(workdir, 'cards.db')
+    os.environ['POKETRACK_CATALOG_DB_PATH'] = os.path.join(workdir, 'catalog.db')
+    os.environ['POKETRACK_PRICE_REFRESH_INTERVAL'] = '0'
+    sys.path[:0] = [os.path.join(ROOT, 'backend'), ROOT]
+    os.chdir(os.path.join(ROOT, 'backend'))
+
+    from fastapi.encoders import jsonable_encoder
+    from api_server import Card
+    from common import fast_json
+    from database import Database
+
+    db = Database()
+    db.add_many_to_collection([{
+        "id": f"bench-{i}",
+        "name": f"Pokemon Card {i}",
+        "set": f"Set {i % 40}",
+        "number": str(i % 200),
+        "rarity": "Rare Holo",
+        "type": "Fire",
+        "price": round(1 + (i % 5000) / 100, 2),
+        "image": f"https://example.com/cards/{i}.png",
+        "artist": "Pokemon Artist",
+        "releaseDate": "2023-01-01",
+    } for i in range(args.rows)])
+
+    def before():
+        with db._pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.row_factory = _api_names
+            cursor.execute("SELECT * FROM collection ORDER BY name")
+            cards = [Card(**row) for row in cursor.fetchall()]
+        return json.dumps(jsonable_encoder(cards)).encode()
+
+    def after():
+        return fast_json.dumps(db.get_collection())
+
+    if json.loads(before()) != json.loads(after()):
+        sys.exit("before and after produced different bodies")
+
+    results = {}
+    for name, run in (('before', before), ('after', after)):
+        best = min(_timed(run) for _ in range(args.repeat))
+        results[name] = best
+        print(f"{name:>6}: {best * 1000:8.1f} ms total, {best / args.rows * 1e6:6.2f} us/row")
+    print(f"speedup: {results['before'] / results['after']:.1f}x "
+          f"({'orjson' if fast_json.ORJSON_AVAILABLE else 'json fallback'})")
+
+
+def _api_names(cursor, row):
+    """The row factory the listing used to rename columns to their API names with."""
+    names = {'set_name': 'set', 'release_date': 'releaseDate'}
+    return {names.get(column[0], column[0]): value for column, value in zip(cursor.description, row)}
+
+
+def _timed(run):
+    started = time.perf_counter()
+    run()
+    return time.perf_counter() - started
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1 @@
+"""Shared infrastructure used by both the api_server and backend services."""
@@ -0,0 +1,375 @@
+"""Local mirror of the Pokemon TCG card catalog.
+
+Cards are stored in ``catalog_cards`` with an FTS5 index over name, set,
+artist and type, so searches are answered locally instead of with an
+upstream round trip. Syncs are incremental: each card carries a hash of
+its upstream JSON and only cards whose hash changed are rewritten.
+
+Sync from a dump file or from the API (or a stand-in of it)::
+
+    python -m common.catalog --dump cards.json
+    python -m common.catalog --api http://127.0.0.1:8100/v2
+"""
+import argparse
+import hashlib
+import json
+import sqlite3
+import time
+from datetime import datetime
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+from urllib.parse import urlsplit
+
+import requests
+
+from common import config
+from common.metrics import observe_upstream
+from common.sqlite_pool import get_pool
+
+_initialized = set()
+
+# The Pokemon TCG API's rarities in collecting order, for sorting Common ->
+# Rare; rarities not listed here sort last
+RARITY_ORDER = [
+    "Common", "Uncommon", "Rare", "Rare Holo",
+    "Rare Holo Star", "Rare Holo LV.X", "Rare Prime", "LEGEND", "Rare BREAK",
+    "Rare Prism Star", "Rare ACE", "ACE SPEC Rare",
+    "Rare Holo EX", "Rare Holo GX", "Rare Holo V", "Rare Holo VMAX", "Rare Holo VSTAR", "Double Rare",
+    "Radiant Rare", "Amazing Rare", "Trainer Gallery Rare Holo",
+    "Rare Shining", "Rare Shiny", "Shiny Rare", "Rare Shiny GX", "Shiny Ultra Rare",
+    "Rare Ultra", "Ultra Rare", "Illustration Rare", "Rare Rainbow", "Rare Secret",
+    "Special Illustration Rare", "Hyper Rare",
+    "Classic Collection", "Promo",
+]
+RARITY_RANK = "CASE IFNULL(rarity, '') {} ELSE {} END".format(
+    " ".join(f"WHEN '{rarity}' THEN {rank}" for rank, rarity in enumerate(RARITY_ORDER)),
+    len(RARITY_ORDER)
+)
+
+# Sortable fields, mapped to the expression each is ordered by. Every one
+# has a matching (expression, id) index so sorted pages are read off an
+# index instead of sorting every match.
+SORT_EXPRESSIONS = {
+    "name": "name",
+    "price": "IFNULL(price, 0)",
+    "set": "IFNULL(set_name, '')",
+    "rarity": RARITY_RANK,
+}
+
+INDEXES = [
+    *(f"CREATE INDEX IF NOT EXISTS idx_catalog_sort_{field} ON catalog_cards ({expression}, id)"
+      for field, expression in SORT_EXPRESSIONS.items()),
+    # Filter by set or rarity and order or range-filter by price in one seek
+    "CREATE INDEX IF NOT EXISTS idx_catalog_set_price ON catalog_cards (set_name, IFNULL(price, 0), id)",
+    "CREATE INDEX IF NOT EXISTS idx_catalog_rarity_price ON catalog_cards (rarity, IFNULL(price, 0), id)",
+]
+
+
+def init_catalog(conn: sqlite3.Connection):
+    """Create the catalog tables, indexes, FTS index and sync triggers if missing."""
+    conn.executescript("""
+        CREATE TABLE IF NOT EXISTS catalog_cards (
+            id TEXT PRIMARY KEY,
+            name TEXT NOT NULL,
+            set_id TEXT,
+            set_name TEXT,
+            number TEXT,
+            rarity TEXT,
+            type TEXT,
+            artist TEXT,
+            price REAL,
+            image TEXT,
+            release_date TEXT,
+            content_hash TEXT NOT NULL,
+            synced_at TEXT NOT NULL,
+            data TEXT NOT NULL
+        );
+
+        CREATE VIRTUAL TABLE IF NOT EXISTS catalog_fts USING fts5(
+            name, set_name, artist, type,
+            content='catalog_cards',
+            content_rowid='rowid',
+            prefix='2 3 4'
+        );
+
+        CREATE TRIGGER IF NOT EXISTS catalog_cards_ai AFTER INSERT ON catalog_cards BEGIN
+            INSERT INTO catalog_fts (rowid, name, set_name, artist, type)
+            VALUES (new.rowid, new.name, new.set_name, new.artist, new.type);
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS catalog_cards_ad AFTER DELETE ON catalog_cards BEGIN
+            INSERT INTO catalog_fts (catalog_fts, rowid, name, set_name, artist, type)
+            VALUES ('delete', old.rowid, old.name, old.set_name, old.artist, old.type);
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS catalog_cards_au AFTER UPDATE ON catalog_cards BEGIN
+            INSERT INTO catalog_fts (catalog_fts, rowid, name, set_name, artist, type)
+            VALUES ('delete', old.rowid, old.name, old.set_name, old.artist, old.type);
+            INSERT INTO catalog_fts (rowid, name, set_name, artist, type)
+            VALUES (new.rowid, new.name, new.set_name, new.artist, new.type);
+        END;
+
+        CREATE TABLE IF NOT EXISTS catalog_meta (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        );
+    """)
+    # An index whose expression has since changed (RARITY_ORDER grew) is
+    # rebuilt, or sorted pages would no longer be read off it
+    existing = dict(conn.execute(
+        "SELECT name, sql FROM sqlite_master WHERE type = 'index' AND tbl_name = 'catalog_cards' AND sql IS NOT NULL"
+    ))
+    for statement in INDEXES:
+        name = statement.split(" ON ")[0].split()[-1]
+        if existing.get(name) not in (None, statement.replace(" IF NOT EXISTS", "")):
+            conn.execute(f"DROP INDEX {name}")
+        conn.execute(statement)
+    conn.commit()
+
+
+def get_connection(db_path: Optional[str] = None) -> sqlite3.Connection:
+    """Get this thread's catalog connection, creating the schema on first use."""
+    pool = get_pool(db_path or config.CATALOG_DB_PATH)
+    conn = pool.connection()
+    if pool.db_path not in _initialized:
+        init_catalog(conn)
+        _initialized.add(pool.db_path)
+    return conn
+
+
+def market_price(card: Dict[str, Any]) -> Optional[float]:
+    """Pick a market price out of the card's TCGPlayer price variants."""
+    prices = (card.get("tcgplayer") or {}).get("prices") or {}
+    for variant in prices.values():
+        for field in ("market", "mid", "low"):
+            if variant.get(field) is not None:
+                return variant[field]
+    return None
+
+
+def _row_from_card(card: Dict[str, Any], synced_at: str) -> tuple:
+    data = json.dumps(card, sort_keys=True, separators=(",", ":"))
+    card_set = card.get("set") or {}
+    images = card.get("images") or {}
+    return (
+        card["id"],
+        card.get("name", ""),
+        card_set.get("id"),
+        card_set.get("name"),
+        card.get("number"),
+        card.get("rarity"),
+        ", ".join(card.get("types") or []) or card.get("supertype"),
+        card.get("artist"),
+        market_price(card),
+        images.get("large") or images.get("small"),
+        card_set.get("releaseDate"),
+        hashlib.sha1(data.encode()).hexdigest(),
+        synced_at,
+        data,
+    )
+
+
+def upsert_cards(conn: sqlite3.Connection, cards: Iterable[Dict[str, Any]]) -> int:
+    """Insert new cards and rewrite changed ones; return how many rows changed.
+
+    Cards whose content hash matches the stored one are skipped, so neither
+    the table nor the FTS index is touched for them.
+    """
+    synced_at = datetime.now().isoformat()
+    cursor = conn.executemany("""
+        INSERT INTO catalog_cards (
+            id, name, set_id, set_name, number, rarity, type, artist,
+            price, image, release_date, content_hash, synced_at, data
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (id) DO UPDATE SET
+            name = excluded.name,
+            set_id = excluded.set_id,
+            set_name = excluded.set_name,
+            number = excluded.number,
+            rarity = excluded.rarity,
+            type = excluded.type,
+            artist = excluded.artist,
+            price = excluded.price,
+            image = excluded.image,
+            release_date = excluded.release_date,
+            content_hash = excluded.content_hash,
+            synced_at = excluded.synced_at,
+            data = excluded.data
+        WHERE catalog_cards.content_hash != excluded.content_hash
+    """, (_row_from_card(card, synced_at) for card in cards))
+    return cursor.rowcount
+
+
+def _set_meta(conn: sqlite3.Connection, key: str, value: str):
+    conn.execute("""
+        INSERT INTO catalog_meta (key, value) VALUES (?, ?)
+        ON CONFLICT (key) DO UPDATE SET value = excluded.value
+    """, (key, value))
+
+
+def last_synced(conn: sqlite3.Connection) -> Optional[float]:
+    row = conn.execute("SELECT value FROM catalog_meta WHERE key = 'last_sync'").fetchone()
+    return float(row[0]) if row else None
+
+
+def is_fresh(conn: sqlite3.Connection, max_age: float = config.CATALOG_MAX_AGE) -> bool:
+    """Whether the catalog has been fully synced within max_age seconds."""
+    synced = last_synced(conn)
+    return synced is not None and time.time() - synced < max_age
+
+
+def sync(conn: sqlite3.Connection, cards: Iterable[Dict[str, Any]], batch_size: int = 1000) -> Dict[str, int]:
+    """Sync a full catalog listing, committing once per batch.
+
+    Returns counts of cards seen and rows actually changed.
+    """
+    seen = changed = 0
+    batch: List[Dict[str, Any]] = []
+    for card in cards:
+        batch.append(card)
+        if len(batch) >= batch_size:
+            with conn:
+                changed += upsert_cards(conn, batch)
+            seen += len(batch)
+            batch = []
+    with conn:
+        if batch:
+            changed += upsert_cards(conn, batch)
+            seen += len(batch)
+        _set_meta(conn, "last_sync", str(time.time()))
+    return {"seen": seen, "changed": changed}
+
+
+def read_dump(path: str) -> Iterator[Dict[str, Any]]:
+    """Read cards from a JSON dump (a list or {"data": [...]}) or NDJSON file."""
+    with open(path, encoding="utf-8") as f:
+        if path.endswith(".ndjson") or path.endswith(".jsonl"):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+            return
+        payload = json.load(f)
+    yield from payload["data"] if isinstance(payload, dict) else payload
+
+
+def fetch_all(base_url: str, api_key: str = "", page_size: int = 250) -> Iterator[Dict[str, Any]]:
+    """Page through ``GET {base_url}/cards`` until every card has been read."""
+    session = requests.Session()
+    page = 1
+    upstream = urlsplit(base_url).hostname or base_url
+    while True:
+        started = time.perf_counter()
+        status = None
+        try:
+            response = session.get(
+                f"{base_url.rstrip('/')}/cards",
+                params={"page": page, "pageSize": page_size},
+                headers={"X-Api-Key": api_key},
+                timeout=(config.HTTP_CONNECT_TIMEOUT, config.HTTP_READ_TIMEOUT),
+            )
+            status = response.status_code
+        finally:
+            observe_upstream(upstream, time.perf_counter() - started, status)
+        response.raise_for_status()
+        payload = response.json()
+        yield from payload["data"]
+        if page * page_size >= payload.get("totalCount", 0) or not payload["data"]:
+            break
+        page += 1
+
+
+def match_expression(query: str, column: Optional[str] = None) -> str:
+    """Turn free text into an FTS5 prefix query matching every word, in ``column`` if given."""
+    scope = f"{column} : " if column else ""
+    terms = []
+    for word in query.split():
+        word = "".join(ch for ch in word if ch.isalnum())
+        if word:
+            terms.append(f'{scope}"{word}"*')
+    return " ".join(terms)
+
+
+def search(conn: sqlite3.Connection,
+           query: str,
+           limit: int = 20,
+           rarity: Optional[str] = None,
+           set_name: Optional[str] = None,
+           min_price: Optional[float] = None,
+           max_price: Optional[float] = None) -> List[Dict[str, Any]]:
+    """Search card names, returning cards in the upstream API format.
+
+    Only the name is matched, like the upstream searches this stands in for
+    (``name:{query}*`` on the Pokemon TCG API, ``productName`` on TCGPlayer);
+    "fire" finds Fire cards by name, not every Fire-type card.
+    """
+    expression = match_expression(query, "name")
+    if not expression:
+        return []
+    sql = """
+        SELECT c.data
+        FROM catalog_fts
+        JOIN catalog_cards c ON c.rowid = catalog_fts.rowid
+        WHERE catalog_fts MATCH ?
+    """
+    params: List[Any] = [expression]
+    if rarity:
+        sql += " AND c.rarity = ?"
+        params.append(rarity)
+    if set_name:
+        sql += " AND c.set_name = ?"
+        params.append(set_name)
+    if min_price is not None:
+        sql += " AND c.price >= ?"
+        params.append(min_price)
+    if max_price is not None:
+        sql += " AND c.price <= ?"
+        params.append(max_price)
+    sql += " ORDER BY c.name LIMIT ?"
+    params.append(limit)
+    return [json.loads(row[0]) for row in conn.execute(sql, params).fetchall()]
+
+
+def get_cards(conn: sqlite3.Connection, card_ids: List[str]) -> List[Dict[str, Any]]:
+    """Look cards up by id, returning those found in the upstream API format."""
+    if not card_ids:
+        return []
+    placeholders = ", ".join("?" for _ in card_ids)
+    rows = conn.execute(f"SELECT data FROM catalog_cards WHERE id IN ({placeholders})", list(card_ids))
+    return [json.loads(row[0]) for row in rows.fetchall()]
+
+
+def to_app_card(card: Dict[str, Any]) -> Dict[str, Any]:
+    """Convert an upstream-format card to the backend's Card shape."""
+    card_set = card.get("set") or {}
+    images = card.get("images") or {}
+    return {
+        "id": card["id"],
+        "name": card.get("name", ""),
+        "set": card_set.get("name", ""),
+        "number": card.get("number", ""),
+        "rarity": card.get("rarity") or "",
+        "type": ", ".join(card.get("types") or []) or card.get("supertype") or "",
+        "price": market_price(card) or 0.0,
+        "image": images.get("large") or images.get("small") or "",
+        "artist": card.get("artist") or "",
+        "releaseDate": card_set.get("releaseDate", ""),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sync the local card catalog")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--dump", help="JSON or NDJSON file of cards")
+    source.add_argument("--api", help="Base URL of the Pokemon TCG API or a stand-in")
+    parser.add_argument("--db", default=config.CATALOG_DB_PATH)
+    args = parser.parse_args()
+
+    conn = get_connection(args.db)
+    cards = read_dump(args.dump) if args.dump else fetch_all(args.api, config.POKEMONTCG_API_KEY)
+    started = time.perf_counter()
+    result = sync(conn, cards)
+    print(f"Synced {result['seen']} cards ({result['changed']} changed) "
+          f"in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
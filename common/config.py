@@ -0,0 +1,98 @@
+import os
+
+from dotenv import load_dotenv
+
+# Load settings from a .env file in the working directory, if there is one
+load_dotenv()
+
+# SQLite database file used by the service data layers
+DB_PATH = os.getenv("POKETRACK_DB_PATH", "pokemon_cards.db")
+
+# Connection tuning
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("POKETRACK_SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_CACHE_SIZE_KB = int(os.getenv("POKETRACK_SQLITE_CACHE_SIZE_KB", "20000"))
+SQLITE_MMAP_SIZE = int(os.getenv("POKETRACK_SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+SQLITE_STATEMENT_CACHE = int(os.getenv("POKETRACK_SQLITE_STATEMENT_CACHE", "256"))
+SQLITE_ASYNC_POOL_SIZE = int(os.getenv("POKETRACK_SQLITE_ASYNC_POOL_SIZE", "4"))
+
+# Upstream Pokemon TCG API
+POKEMONTCG_API_URL = os.getenv("POKEMONTCG_API_URL", "https://api.pokemontcg.io/v2")
+POKEMONTCG_API_KEY = os.getenv("POKEMONTCG_API_KEY", "")
+
+# Outbound HTTP client
+HTTP_CONNECT_TIMEOUT = float(os.getenv("POKETRACK_HTTP_CONNECT_TIMEOUT", "3.0"))
+HTTP_READ_TIMEOUT = float(os.getenv("POKETRACK_HTTP_READ_TIMEOUT", "10.0"))
+HTTP_MAX_CONNECTIONS = int(os.getenv("POKETRACK_HTTP_MAX_CONNECTIONS", "20"))
+HTTP_MAX_CONCURRENCY = int(os.getenv("POKETRACK_HTTP_MAX_CONCURRENCY", "10"))
+
+# Search result cache
+SEARCH_CACHE_TTL = float(os.getenv("POKETRACK_SEARCH_CACHE_TTL", "300"))
+SEARCH_CACHE_SIZE = int(os.getenv("POKETRACK_SEARCH_CACHE_SIZE", "1024"))
+
+# Local card catalog mirror
+CATALOG_DB_PATH = os.getenv("POKETRACK_CATALOG_DB_PATH", "catalog.db")
+CATALOG_MAX_AGE = float(os.getenv("POKETRACK_CATALOG_MAX_AGE", str(24 * 60 * 60)))
+
+# TCGPlayer API
+TCGPLAYER_API_URL = os.getenv("TCGPLAYER_API_URL", "https://api.tcgplayer.com/v1.37.0")
+TCGPLAYER_PUBLIC_KEY = os.getenv("TCGPLAYER_PUBLIC_KEY", "")
+TCGPLAYER_PRIVATE_KEY = os.getenv("TCGPLAYER_PRIVATE_KEY", "")
+
+# Background price refresh (backend); an interval of 0 disables the schedule,
+# which is the default until TCGPlayer keys are configured
+PRICE_REFRESH_INTERVAL = float(os.getenv(
+    "POKETRACK_PRICE_REFRESH_INTERVAL",
+    str(60 * 60) if TCGPLAYER_PUBLIC_KEY and TCGPLAYER_PRIVATE_KEY else "0"
+))
+PRICE_REFRESH_BATCH_SIZE = int(os.getenv("POKETRACK_PRICE_REFRESH_BATCH_SIZE", "100"))
+PRICE_REFRESH_WORKERS = int(os.getenv("POKETRACK_PRICE_REFRESH_WORKERS", "4"))
+PRICE_STALE_AFTER = float(os.getenv("POKETRACK_PRICE_STALE_AFTER", str(24 * 60 * 60)))
+
+# Price history older than this many days is compacted into the archive
+PRICE_ARCHIVE_AFTER_DAYS = int(os.getenv("POKETRACK_PRICE_ARCHIVE_AFTER_DAYS", "90"))
+
+# Discover feed snapshot (backend): seconds before it is refreshed
+DISCOVER_REFRESH_INTERVAL = float(os.getenv("POKETRACK_DISCOVER_REFRESH_INTERVAL", "300"))
+
+# Rendered listing bodies kept for conditional GETs (one per distinct request)
+ETAG_CACHE_ENTRIES = int(os.getenv("POKETRACK_ETAG_CACHE_ENTRIES", "256"))
+
+# Server-sent change events: events kept for clients that reconnect,
+# events queued per slow client before it is told to resync, and seconds
+# between keep-alive comments on an idle stream
+EVENT_HISTORY = int(os.getenv("POKETRACK_EVENT_HISTORY", "256"))
+EVENT_QUEUE_SIZE = int(os.getenv("POKETRACK_EVENT_QUEUE_SIZE", "256"))
+EVENT_HEARTBEAT = float(os.getenv("POKETRACK_EVENT_HEARTBEAT", "15"))
+
+# Slow-query log: statements taking at least this many milliseconds are
+# logged with their query plan (0 disables it), appended as JSON lines to
+# POKETRACK_SLOW_QUERY_LOG if set (printed otherwise), and the most
+# recent ones are kept for /metrics/slow-queries
+SLOW_QUERY_MS = float(os.getenv("POKETRACK_SLOW_QUERY_MS", "100"))
+SLOW_QUERY_LOG = os.getenv("POKETRACK_SLOW_QUERY_LOG", "")
+SLOW_QUERY_HISTORY = int(os.getenv("POKETRACK_SLOW_QUERY_HISTORY", "100"))
+
+# Card image cache (/images): directory, disk budget in bytes, thumbnail
+# widths it serves, hosts images may be fetched from ("*" for any) and
+# the largest image it downloads
+IMAGE_CACHE_DIR = os.getenv("POKETRACK_IMAGE_CACHE_DIR", "image_cache")
+IMAGE_CACHE_MAX_BYTES = int(os.getenv("POKETRACK_IMAGE_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+IMAGE_THUMBNAIL_WIDTHS = tuple(int(w) for w in os.getenv("POKETRACK_IMAGE_THUMBNAIL_WIDTHS", "160,320").split(","))
+IMAGE_HOSTS = os.getenv("POKETRACK_IMAGE_HOSTS", "images.pokemontcg.io,tcgplayer-cdn.tcgplayer.com").split(",")
+IMAGE_MAX_BYTES = int(os.getenv("POKETRACK_IMAGE_MAX_BYTES", str(10 * 1024 * 1024)))
+
+# Per-user storage: with a shard directory set, each X-User-Id gets its
+# own database file there (in one of SHARD_BUCKETS hashed subdirectories),
+# and at most SHARD_MAX_OPEN of them are kept open at once; without one,
+# every request uses DB_PATH
+SHARD_DIR = os.getenv("POKETRACK_SHARD_DIR", "")
+SHARD_BUCKETS = int(os.getenv("POKETRACK_SHARD_BUCKETS", "256"))
+SHARD_MAX_OPEN = int(os.getenv("POKETRACK_SHARD_MAX_OPEN", "64"))
+
+# Writes to the collection and wishlist go through one writer per database
+# (api_server): writes queued while the previous group was committing, and
+# those arriving within WRITE_GROUP_WINDOW_MS after it, are committed
+# together, up to WRITE_GROUP_MAX per transaction. A window makes larger
+# groups out of a steady trickle of writes but adds to every write's latency
+WRITE_GROUP_WINDOW_MS = float(os.getenv("POKETRACK_WRITE_GROUP_WINDOW_MS", "0"))
+WRITE_GROUP_MAX = int(os.getenv("POKETRACK_WRITE_GROUP_MAX", "256"))
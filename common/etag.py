@@ -0,0 +1,109 @@
+"""Conditional GETs for read endpoints, driven by table versions.
+
+A listing's ETag is derived from the request it answers (path and query)
+and the versions of the tables it reads (see ``common.table_versions``).
+When the client's ``If-None-Match`` still matches, the endpoint answers
+304 after reading only the version counters. Otherwise the body rendered
+for that request and version is kept, so repeat requests from other
+clients are served without querying or serializing again until one of
+the tables changes.
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from starlette.responses import Response
+
+from common import config
+from common.fast_json import dumps
+
+# Clients must revalidate each time, which a matching ETag makes cheap
+CACHE_CONTROL = "no-cache"
+
+
+def make_etag(key: str, versions: Dict[str, int]) -> str:
+    digest = hashlib.blake2b(key.encode(), digest_size=6).hexdigest()
+    return '"' + '-'.join([digest, *(str(versions[table]) for table in sorted(versions))]) + '"'
+
+
+def matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Whether an ``If-None-Match`` header covers ``etag`` (weak comparison)."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    tags = (tag.strip() for tag in if_none_match.split(','))
+    return any((tag[2:] if tag.startswith('W/') else tag) == etag for tag in tags)
+
+
+class RenderedCache:
+    """Rendered JSON bodies by request, each valid for one set of table versions.
+
+    Holds the latest body per request key, evicting the least recently
+    used keys beyond ``max_entries``.
+    """
+
+    def __init__(self, max_entries: int = config.ETAG_CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self._bodies: "OrderedDict[str, Tuple[str, bytes]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+
+    def _lookup(self, if_none_match: Optional[str], key: str,
+                versions: Dict[str, int]) -> Tuple[str, Optional[Response]]:
+        etag = make_etag(key, versions)
+        headers = {"ETag": etag, "Cache-Control": CACHE_CONTROL}
+        if matches(if_none_match, etag):
+            with self._lock:
+                self.not_modified += 1
+            return etag, Response(status_code=304, headers=headers)
+        with self._lock:
+            cached = self._bodies.get(key)
+            if cached is not None and cached[0] == etag:
+                self._bodies.move_to_end(key)
+                self.hits += 1
+                return etag, Response(cached[1], media_type="application/json", headers=headers)
+            self.misses += 1
+        return etag, None
+
+    def _store(self, key: str, etag: str, content: Any) -> Response:
+        body = dumps(content)
+        if isinstance(content, dict) and "error" in content:
+            # A failed read is returned as usual but not kept for later requests
+            return Response(body, media_type="application/json")
+        with self._lock:
+            self._bodies[key] = (etag, body)
+            self._bodies.move_to_end(key)
+            while len(self._bodies) > self.max_entries:
+                self._bodies.popitem(last=False)
+        return Response(body, media_type="application/json",
+                        headers={"ETag": etag, "Cache-Control": CACHE_CONTROL})
+
+    def respond(self, if_none_match: Optional[str], key: str, versions: Dict[str, int],
+                render: Callable[[], Any]) -> Response:
+        """A 304, the cached body, or ``render()`` encoded and cached."""
+        etag, response = self._lookup(if_none_match, key, versions)
+        if response is not None:
+            return response
+        return self._store(key, etag, render())
+
+    async def respond_async(self, if_none_match: Optional[str], key: str, versions: Dict[str, int],
+                            render: Callable[[], Awaitable[Any]]) -> Response:
+        """``respond`` for endpoints whose rendering is a coroutine."""
+        etag, response = self._lookup(if_none_match, key, versions)
+        if response is not None:
+            return response
+        return self._store(key, etag, await render())
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "entries": len(self._bodies),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "not_modified": self.not_modified,
+            }
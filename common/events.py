@@ -0,0 +1,158 @@
+"""In-process fan-out of change events to server-sent event streams.
+
+Write paths call ``Broadcaster.publish`` (from any thread or the event
+loop) after a change is committed. Each event is numbered and encoded
+as an SSE frame once, then handed to every subscriber's queue, so the
+cost of a change does not depend on what the clients do with it. A
+client that reconnects with ``Last-Event-ID`` gets the events it missed
+replayed from a short history; if they are no longer there, or a slow
+client lets its queue fill up, it gets a ``resync`` event telling it to
+reload instead. Events published on a channel (a user's, when storage is
+sharded per user) only reach the streams subscribed to that channel.
+"""
+import asyncio
+import itertools
+import json
+import threading
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Deque, Dict, List, Optional, Set, Tuple
+
+from common import config
+
+RESYNC = 'resync'
+
+
+def format_event(event_id: Optional[str], event: str, data: Any) -> bytes:
+    frame = f"event: {event}\ndata: {json.dumps(data)}\n\n"
+    return (f"id: {event_id}\n{frame}" if event_id else frame).encode()
+
+
+class _Subscriber:
+    def __init__(self, loop: asyncio.AbstractEventLoop, queue_size: int, channel: Optional[str]):
+        self.loop = loop
+        self.channel = channel
+        self.queue: "asyncio.Queue[Optional[bytes]]" = asyncio.Queue(queue_size)
+        self.dropped = False
+
+    def deliver(self, frame: Optional[bytes]):
+        # Runs on the subscriber's event loop
+        if frame is None:
+            self._reset(None)
+        elif self.dropped:
+            return
+        elif self.queue.full():
+            # Too far behind to catch up event by event
+            self.dropped = True
+            self._reset(format_event(None, RESYNC, {"reason": "overflow"}))
+        else:
+            self.queue.put_nowait(frame)
+
+    def _reset(self, frame: Optional[bytes]):
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.queue.put_nowait(frame)
+
+
+class Broadcaster:
+    def __init__(self,
+                 history: int = config.EVENT_HISTORY,
+                 queue_size: int = config.EVENT_QUEUE_SIZE,
+                 heartbeat: float = config.EVENT_HEARTBEAT):
+        self.queue_size = queue_size
+        self.heartbeat = heartbeat
+        # Ids are "<epoch>-<n>"; the epoch tells a client reconnecting after
+        # a restart that the history it knows about is gone
+        self._epoch = format(int(time.time() * 1000), 'x')
+        self._ids = itertools.count(1)
+        self._last_id = 0
+        self._history: Deque[Tuple[int, Optional[str], bytes]] = deque(maxlen=history)
+        self._subscribers: Set[_Subscriber] = set()
+        self._lock = threading.Lock()
+        self.published = 0
+        self.resyncs = 0
+
+    def publish(self, event: str, data: Any, channel: Optional[str] = None) -> str:
+        """Send an event to every subscriber of ``channel``; returns its id."""
+        with self._lock:
+            self._last_id = next(self._ids)
+            event_id = f"{self._epoch}-{self._last_id}"
+            frame = format_event(event_id, event, data)
+            self._history.append((self._last_id, channel, frame))
+            subscribers = [subscriber for subscriber in self._subscribers if subscriber.channel == channel]
+            self.published += 1
+        for subscriber in subscribers:
+            try:
+                subscriber.loop.call_soon_threadsafe(subscriber.deliver, frame)
+            except RuntimeError:
+                # Its event loop has closed; the stream is gone
+                self._discard(subscriber)
+        return event_id
+
+    def _discard(self, subscriber: _Subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def _missed(self, last_event_id: str, channel: Optional[str]) -> Optional[List[bytes]]:
+        """Frames of ``channel`` after ``last_event_id``, or None if some are no longer kept."""
+        epoch, _, number = last_event_id.partition('-')
+        if epoch != self._epoch or not number.isdigit() or int(number) > self._last_id:
+            return None
+        last = int(number)
+        if last < self._last_id and (not self._history or self._history[0][0] > last + 1):
+            return None
+        return [frame for event_id, event_channel, frame in self._history
+                if event_id > last and event_channel == channel]
+
+    async def subscribe(self, last_event_id: Optional[str] = None,
+                        channel: Optional[str] = None) -> AsyncIterator[bytes]:
+        """Yield SSE frames of ``channel`` until the client disconnects or ``close`` is called."""
+        subscriber = _Subscriber(asyncio.get_running_loop(), self.queue_size, channel)
+        with self._lock:
+            # Registering and reading the history under one lock means no
+            # event is both replayed and delivered, or neither
+            missed = self._missed(last_event_id, channel) if last_event_id else []
+            self._subscribers.add(subscriber)
+        try:
+            # Tell the browser to reconnect quickly if the stream drops
+            yield b"retry: 3000\n\n"
+            if missed is None:
+                self.resyncs += 1
+                yield format_event(None, RESYNC, {"reason": "missed events"})
+            else:
+                for frame in missed:
+                    yield frame
+            while True:
+                try:
+                    frame = await asyncio.wait_for(subscriber.queue.get(), self.heartbeat)
+                except asyncio.TimeoutError:
+                    # Comment lines keep proxies from timing out an idle stream
+                    yield b": keep-alive\n\n"
+                    continue
+                if frame is None:
+                    return
+                if subscriber.dropped:
+                    self.resyncs += 1
+                    subscriber.dropped = False
+                yield frame
+        finally:
+            self._discard(subscriber)
+
+    def close(self):
+        """End every open stream (on shutdown)."""
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            try:
+                subscriber.loop.call_soon_threadsafe(subscriber.deliver, None)
+            except RuntimeError:
+                pass
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "subscribers": len(self._subscribers),
+                "published": self.published,
+                "resyncs": self.resyncs,
+                "history": len(self._history),
+            }
@@ -0,0 +1,34 @@
+"""Fast JSON responses for large listings.
+
+Rows read from our own database are already plain str/int/float/None
+values in the shape the API returns, so there is nothing to validate or
+convert: ``FastJSONResponse`` encodes them as-is with orjson (when it is
+installed) and skips FastAPI's per-value ``jsonable_encoder`` walk and
+any response-model validation.
+"""
+import json
+from typing import Any
+
+from starlette.responses import Response
+
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    orjson = None
+    ORJSON_AVAILABLE = False
+
+
+def dumps(content: Any) -> bytes:
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(content)
+    return json.dumps(content, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+class FastJSONResponse(Response):
+    """A JSON response for trusted, already JSON-compatible content."""
+
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
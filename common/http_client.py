@@ -0,0 +1,105 @@
+import asyncio
+import time
+from typing import Any, Dict, Optional
+
+import httpx
+
+from common import config
+from common.metrics import observe_upstream
+
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+
+class UpstreamError(Exception):
+    """Raised when an upstream API call fails or times out."""
+
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class AsyncHTTPClient:
+    """A pooled, keep-alive HTTP client for one upstream host.
+
+    Connections are reused across requests (HTTP/2 when the ``h2`` package is
+    installed), every call has explicit connect and read timeouts, and a
+    semaphore caps how many requests can be in flight to the upstream at once.
+    """
+
+    def __init__(self,
+                 base_url: str,
+                 headers: Optional[Dict[str, str]] = None,
+                 max_connections: int = config.HTTP_MAX_CONNECTIONS,
+                 max_concurrency: int = config.HTTP_MAX_CONCURRENCY,
+                 connect_timeout: float = config.HTTP_CONNECT_TIMEOUT,
+                 read_timeout: float = config.HTTP_READ_TIMEOUT):
+        self.base_url = base_url.rstrip('/')
+        self.upstream = httpx.URL(self.base_url).host
+        self._client = httpx.AsyncClient(
+            base_url=self.base_url,
+            headers=headers,
+            http2=HTTP2_AVAILABLE,
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+            ),
+            timeout=httpx.Timeout(
+                connect=connect_timeout,
+                read=read_timeout,
+                write=read_timeout,
+                pool=connect_timeout,
+            ),
+        )
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def request(self, method: str, path: str, **kwargs) -> httpx.Response:
+        """Send a request, raising UpstreamError on network or HTTP errors."""
+        async with self._semaphore:
+            started = time.perf_counter()
+            status = None
+            try:
+                response = await self._client.request(method, path, **kwargs)
+                status = response.status_code
+                response.raise_for_status()
+                return response
+            except httpx.HTTPStatusError as e:
+                raise UpstreamError(str(e), e.response.status_code) from e
+            except httpx.HTTPError as e:
+                raise UpstreamError(f"{type(e).__name__}: {e}") from e
+            finally:
+                observe_upstream(self.upstream, time.perf_counter() - started, status)
+
+    async def get_json(self,
+                       path: str,
+                       params: Optional[Dict[str, Any]] = None,
+                       headers: Optional[Dict[str, str]] = None) -> Any:
+        response = await self.request("GET", path, params=params, headers=headers)
+        return response.json()
+
+    async def aclose(self):
+        await self._client.aclose()
+
+
+_clients: Dict[str, AsyncHTTPClient] = {}
+
+
+def get_client(base_url: str, **kwargs) -> AsyncHTTPClient:
+    """Get the shared client for an upstream base URL, creating it on first use."""
+    key = base_url.rstrip('/')
+    client = _clients.get(key)
+    if client is None:
+        client = AsyncHTTPClient(key, **kwargs)
+        _clients[key] = client
+    return client
+
+
+async def close_clients():
+    """Close every shared client (called on application shutdown)."""
+    clients = list(_clients.values())
+    _clients.clear()
+    for client in clients:
+        await client.aclose()
@@ -0,0 +1,364 @@
+"""Content-addressed on-disk cache of card images, with thumbnails.
+
+The first request for an image URL downloads it and stores it under the
+SHA-256 of its bytes (the same image behind two URLs is kept once), with
+the URL -> digest mapping in a small SQLite index beside the files.
+Thumbnails are resized from the original once per width and stored next
+to it. A stored file never changes, so it is served with a strong ETag
+(its digest) and a year-long immutable Cache-Control, and browsers stop
+asking for it.
+
+The directory is kept under ``max_bytes`` by deleting the least recently
+served files; their modification times carry that order across restarts.
+An evicted image is downloaded again the next time it is asked for. A
+file is opened as soon as it is looked up and the response reads from
+that handle, so one evicted in the meantime is still served in full.
+"""
+import hashlib
+import io
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, BinaryIO, Dict, NamedTuple, Optional, Sequence, Tuple
+from urllib.parse import urlsplit
+
+import anyio
+import requests
+from requests.adapters import HTTPAdapter
+from starlette.responses import FileResponse, Response
+
+from common import config
+from common.etag import matches
+from common.metrics import observe_upstream
+from common.sqlite_pool import get_pool
+
+try:
+    from PIL import Image, features
+    PILLOW_AVAILABLE = True
+    # WebP thumbnails are a fraction of the size of PNG ones, when Pillow can write them
+    THUMBNAIL_FORMAT = ("WEBP", "webp", "image/webp") if features.check("webp") else ("PNG", "png", "image/png")
+except ImportError:
+    PILLOW_AVAILABLE = False
+    THUMBNAIL_FORMAT = None
+
+CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+# Only refresh a served file's modification time this often, rather than on every hit
+TOUCH_INTERVAL = 60 * 60
+
+# Concurrent misses for URLs that share a stripe wait for each other
+LOCK_STRIPES = 64
+
+
+class ImageError(Exception):
+    """Raised when an image cannot be served; carries the HTTP status to answer with."""
+
+    def __init__(self, message: str, status_code: int = 502):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class CachedImage(NamedTuple):
+    path: str
+    etag: str
+    media_type: str
+    stat: os.stat_result
+    # Open on the file, which may since have been evicted; image_response closes it
+    file: BinaryIO
+
+    def close(self):
+        self.file.close()
+
+
+class ImageCache:
+    def __init__(self,
+                 root: str = config.IMAGE_CACHE_DIR,
+                 max_bytes: int = config.IMAGE_CACHE_MAX_BYTES,
+                 widths: Sequence[int] = config.IMAGE_THUMBNAIL_WIDTHS,
+                 hosts: Sequence[str] = config.IMAGE_HOSTS,
+                 max_image_bytes: int = config.IMAGE_MAX_BYTES):
+        self.root = os.path.abspath(root)
+        self.max_bytes = max_bytes
+        self.widths = tuple(widths)
+        self.hosts = set(hosts)
+        self.max_image_bytes = max_image_bytes
+        self.timeout = (config.HTTP_CONNECT_TIMEOUT, config.HTTP_READ_TIMEOUT)
+
+        os.makedirs(self.root, exist_ok=True)
+        self._pool = get_pool(os.path.join(self.root, "index.db"))
+        with self._pool.transaction() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS images (
+                    url TEXT PRIMARY KEY,
+                    digest TEXT NOT NULL,
+                    media_type TEXT NOT NULL
+                ) WITHOUT ROWID
+            """)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=config.HTTP_MAX_CONNECTIONS)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self._lock = threading.Lock()
+        self._stripes = [threading.Lock() for _ in range(LOCK_STRIPES)]
+        # path -> (size, last touched), least recently served first
+        self._files: "OrderedDict[str, Tuple[int, float]]" = OrderedDict()
+        self._bytes = 0
+        self._scan()
+        self.hits = 0
+        self.misses = 0
+        self.downloads = 0
+        self.thumbnails = 0
+        self.evictions = 0
+
+    # Files
+
+    def _scan(self):
+        found = []
+        for entry in os.scandir(self.root):
+            if not entry.is_dir() or len(entry.name) != 2:
+                continue
+            for file in os.scandir(entry.path):
+                if file.name.endswith(".tmp"):
+                    # Left behind by a write that never finished
+                    os.unlink(file.path)
+                    continue
+                stat = file.stat()
+                found.append((stat.st_mtime, file.path, stat.st_size))
+        for mtime, path, size in sorted(found):
+            self._files[path] = (size, mtime)
+            self._bytes += size
+
+    def _path(self, digest: str, width: Optional[int] = None) -> str:
+        name = digest if width is None else f"{digest}.w{width}.{THUMBNAIL_FORMAT[1]}"
+        return os.path.join(self.root, digest[:2], name)
+
+    def _write(self, path: str, data: bytes):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(temp, path)
+        with self._lock:
+            previous = self._files.pop(path, None)
+            self._bytes += len(data) - (previous[0] if previous else 0)
+            self._files[path] = (len(data), time.time())
+            self._evict(keep=path)
+
+    def _evict(self, keep: str):
+        # Called with self._lock held
+        while self._bytes > self.max_bytes and len(self._files) > 1:
+            path, (size, _) = next(iter(self._files.items()))
+            if path == keep:
+                break
+            del self._files[path]
+            self._bytes -= size
+            self.evictions += 1
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+
+    def _touch(self, path: str) -> bool:
+        """Mark a cached file as just used; False if it is not there."""
+        now = time.time()
+        with self._lock:
+            entry = self._files.get(path)
+            if entry is None:
+                return False
+            self._files.move_to_end(path)
+            touch = now - entry[1] > TOUCH_INTERVAL
+            if touch:
+                self._files[path] = (entry[0], now)
+        try:
+            if touch:
+                os.utime(path)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def _served(self, path: str, etag: str, media_type: str) -> Optional[CachedImage]:
+        if not self._touch(path):
+            return None
+        try:
+            file = open(path, "rb")
+        except FileNotFoundError:
+            # Evicted since it was touched
+            return None
+        return CachedImage(path, etag, media_type, os.fstat(file.fileno()), file)
+
+    # Index
+
+    def _lookup(self, url: str) -> Optional[Tuple[str, str]]:
+        return self._pool.connection().execute(
+            "SELECT digest, media_type FROM images WHERE url = ?", (url,)
+        ).fetchone()
+
+    def _record(self, url: str, digest: str, media_type: str):
+        with self._pool.transaction() as conn:
+            conn.execute("""
+                INSERT INTO images (url, digest, media_type) VALUES (?, ?, ?)
+                ON CONFLICT(url) DO UPDATE SET digest = excluded.digest, media_type = excluded.media_type
+            """, (url, digest, media_type))
+
+    # Fetching
+
+    def _check_url(self, url: str):
+        parts = urlsplit(url)
+        if parts.scheme not in ("http", "https") or not parts.hostname:
+            raise ImageError("url must be an http(s) URL", 400)
+        if "*" not in self.hosts and parts.hostname not in self.hosts:
+            raise ImageError(f"Images are not fetched from {parts.hostname}", 400)
+
+    def _download(self, url: str) -> Tuple[bytes, str]:
+        started = time.perf_counter()
+        status = None
+        try:
+            with self.session.get(url, timeout=self.timeout, stream=True) as response:
+                status = response.status_code
+                if status != 200:
+                    raise ImageError(f"Image host answered {status}", 404 if status == 404 else 502)
+                media_type = response.headers.get("Content-Type", "").split(";")[0].strip()
+                if not media_type.startswith("image/"):
+                    raise ImageError(f"Not an image: {media_type or 'no content type'}")
+                body = bytearray()
+                for chunk in response.iter_content(64 * 1024):
+                    body += chunk
+                    if len(body) > self.max_image_bytes:
+                        raise ImageError(f"Image is larger than {self.max_image_bytes} bytes")
+        except requests.RequestException as e:
+            raise ImageError(f"{type(e).__name__}: {e}") from e
+        finally:
+            observe_upstream(urlsplit(url).hostname, time.perf_counter() - started, status)
+        with self._lock:
+            self.downloads += 1
+        return bytes(body), media_type
+
+    def _original(self, url: str) -> Tuple[str, str]:
+        """(digest, media type) of the image at ``url``, downloading it if it is not stored."""
+        known = self._lookup(url)
+        if known and self._touch(self._path(known[0])):
+            return known
+        body, media_type = self._download(url)
+        digest = hashlib.sha256(body).hexdigest()
+        path = self._path(digest)
+        if not self._touch(path):
+            self._write(path, body)
+        self._record(url, digest, media_type)
+        return digest, media_type
+
+    def _thumbnail(self, digest: str, width: int) -> str:
+        path = self._path(digest, width)
+        out = io.BytesIO()
+        try:
+            with Image.open(self._path(digest)) as image:
+                image.thumbnail((width, width * 4))
+                if image.mode not in ("RGB", "RGBA"):
+                    image = image.convert("RGBA")
+                image.save(out, THUMBNAIL_FORMAT[0], **({"quality": 80} if THUMBNAIL_FORMAT[0] == "WEBP" else {}))
+        except (OSError, Image.DecompressionBombError) as e:
+            raise ImageError(f"Cannot make a thumbnail: {e}") from e
+        self._write(path, out.getvalue())
+        with self._lock:
+            self.thumbnails += 1
+        return path
+
+    def _cached(self, url: str, width: Optional[int]) -> Optional[CachedImage]:
+        known = self._lookup(url)
+        if known is None:
+            return None
+        digest, media_type = known
+        if width is None:
+            return self._served(self._path(digest), f'"{digest}"', media_type)
+        return self._served(self._path(digest, width), f'"{digest}-w{width}"', THUMBNAIL_FORMAT[2])
+
+    def get(self, url: str, width: Optional[int] = None) -> CachedImage:
+        """The image at ``url`` (``width`` pixels wide if given) as a local file.
+
+        Raises ImageError for URLs that are not allowed, widths that are not
+        configured, and images that cannot be downloaded.
+        """
+        if width is not None and width not in self.widths:
+            raise ImageError(f"w must be one of {', '.join(map(str, self.widths))}", 400)
+        if not PILLOW_AVAILABLE:
+            # Without Pillow there are no thumbnails; serve the original
+            width = None
+        self._check_url(url)
+        image = self._cached(url, width)
+        if image is not None:
+            with self._lock:
+                self.hits += 1
+            return image
+        with self._stripes[hash(url) % LOCK_STRIPES]:
+            # Another request may have stored it while this one waited
+            image = self._cached(url, width)
+            if image is None:
+                with self._lock:
+                    self.misses += 1
+                digest, _ = self._original(url)
+                if width is not None:
+                    self._thumbnail(digest, width)
+                image = self._cached(url, width)
+        if image is None:
+            raise ImageError("Image was evicted while it was stored; cache is too small", 503)
+        return image
+
+    def close(self):
+        self.session.close()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "files": len(self._files),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "downloads": self.downloads,
+                "thumbnails": self.thumbnails,
+                "evictions": self.evictions,
+                "thumbnail_format": THUMBNAIL_FORMAT[2] if PILLOW_AVAILABLE else None,
+            }
+
+
+class ZeroCopyFileResponse(FileResponse):
+    """A FileResponse sent from an already open file, with sendfile() when it can.
+
+    The body is read from ``file`` rather than by reopening the path, which
+    eviction may have removed. Servers that support the ASGI
+    ``http.response.zerocopysend`` extension are handed the file; the others
+    get it streamed in chunks as usual. The file is closed once sent.
+    """
+
+    def __init__(self, file: BinaryIO, path: str, **kwargs):
+        super().__init__(path, **kwargs)
+        self.file = file
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+            if "http.response.zerocopysend" in scope.get("extensions", {}):
+                await send({"type": "http.response.zerocopysend", "file": self.file, "more_body": False})
+            else:
+                more_body = True
+                while more_body:
+                    chunk = await anyio.to_thread.run_sync(self.file.read, self.chunk_size)
+                    more_body = len(chunk) == self.chunk_size
+                    await send({"type": "http.response.body", "body": chunk, "more_body": more_body})
+        finally:
+            self.file.close()
+        if self.background is not None:
+            await self.background()
+
+
+def image_response(image: CachedImage, if_none_match: Optional[str]) -> Response:
+    """A 304 when the client already has the image, the file otherwise."""
+    headers = {"ETag": image.etag, "Cache-Control": CACHE_CONTROL}
+    if matches(if_none_match, image.etag):
+        image.close()
+        return Response(status_code=304, headers=headers)
+    return ZeroCopyFileResponse(image.file, image.path, media_type=image.media_type, headers=headers,
+                                stat_result=image.stat)
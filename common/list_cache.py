@@ -0,0 +1,232 @@
+"""In-memory copies of the collection and wishlist, kept coherent with SQLite.
+
+A single user's lists fit in memory many times over, so listings are
+answered from a ``ListCache`` rather than by reading and converting every
+row on each request. Rows are held as compact ``Record`` objects
+(``__slots__``, no per-row dict), indexed by id and by the values of a
+few columns (set and rarity), with a sorted view per sort key built on
+first use after a change for the paginated listings.
+
+A cache knows which ``table_versions`` counter its contents reflect.
+Readers compare that with the database's (one small row) and reload the
+table when some other process - another uvicorn worker, a script - has
+written to it since. Writers in this process update the cache in place
+instead: they read the counter before and after their change inside the
+write transaction, and the change is applied only if the cache was at
+the "before" version, so a write is never applied over one the cache
+did not see.
+"""
+import operator
+import threading
+from bisect import bisect_left, bisect_right
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from common.pagination import PageRequestError, check_page_request, decode_cursor, encode_cursor
+
+
+def sql_order(value: Any) -> Tuple[int, Any]:
+    """A sort key ordering values of mixed types the way SQLite does.
+
+    NULLs come first, then numbers, then text, then blobs, so a text price
+    in a REAL column sorts after every number instead of raising TypeError.
+    """
+    if value is None:
+        return (0, 0)
+    if isinstance(value, (int, float)):
+        return (1, value)
+    if isinstance(value, str):
+        return (2, value)
+    return (3, value)
+
+
+class Record:
+    """A row held in memory; subclasses name its columns in ``__slots__``.
+
+    ``FIELDS`` are the columns ``as_dict`` returns, in order (every slot
+    unless a subclass keeps extra columns just for sorting).
+    """
+    __slots__ = ()
+    FIELDS: Tuple[str, ...] = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.FIELDS = cls.FIELDS or cls.__slots__
+        cls._values = operator.attrgetter(*cls.FIELDS)
+
+    def __init__(self, *values: Any):
+        for name, value in zip(self.__slots__, values):
+            setattr(self, name, value)
+
+    def as_dict(self) -> Dict[str, Any]:
+        return dict(zip(self.FIELDS, self._values(self)))
+
+
+class ListCache:
+    def __init__(self,
+                 record_type: type,
+                 sort_keys: Dict[str, Callable[[Record], Any]],
+                 indexes: Dict[str, str]):
+        """``indexes`` maps a filter name (``set``) to the column it looks up (``set_name``)."""
+        self.record_type = record_type
+        self.sort_keys = sort_keys
+        self.indexes = indexes
+        self.columns = record_type.__slots__
+        # The table version the contents reflect; None until loaded, or after
+        # a write this process could not apply
+        self.version: Optional[int] = None
+        self._records: Dict[str, Record] = {}
+        self._index: Dict[str, Dict[Any, Dict[str, Record]]] = {name: {} for name in indexes}
+        self._sorted: Dict[str, Tuple[List[tuple], List[Record]]] = {}
+        self._lock = threading.Lock()
+        self.loads = 0
+        self.writes = 0
+        self.invalidations = 0
+
+    # Changes
+
+    def _add_to_indexes(self, record: Record):
+        for name, column in self.indexes.items():
+            self._index[name].setdefault(getattr(record, column), {})[record.id] = record
+
+    def _remove_from_indexes(self, record: Record):
+        for name, column in self.indexes.items():
+            bucket = self._index[name][getattr(record, column)]
+            del bucket[record.id]
+            if not bucket:
+                del self._index[name][getattr(record, column)]
+
+    def load(self, rows: Iterable[Sequence[Any]], version: int):
+        """Replace the contents with ``rows`` (in ``columns`` order), read at ``version``."""
+        records = {}
+        for row in rows:
+            record = self.record_type(*row)
+            records[record.id] = record
+        with self._lock:
+            self._records = records
+            self._index = {name: {} for name in self.indexes}
+            for record in records.values():
+                self._add_to_indexes(record)
+            self._sorted.clear()
+            self.version = version
+            self.loads += 1
+
+    def apply(self, before: int, after: int, card_ids: Iterable[str], rows: Iterable[Sequence[Any]]):
+        """Write-through: ``rows`` are the current rows of ``card_ids``; the ids without one were deleted.
+
+        ``before`` and ``after`` are the table version just before and just
+        after the write; if the cache was not at ``before`` it is marked
+        stale instead, to be reloaded by the next read.
+        """
+        with self._lock:
+            if self.version is None or self.version != before:
+                if self.version is not None:
+                    self.invalidations += 1
+                self.version = None
+                return
+            records = [self.record_type(*row) for row in rows]
+            found = {record.id for record in records}
+            for card_id in card_ids:
+                old = self._records.get(card_id)
+                if old is not None and card_id not in found:
+                    self._remove_from_indexes(old)
+                    del self._records[card_id]
+            for record in records:
+                old = self._records.get(record.id)
+                if old is not None:
+                    self._remove_from_indexes(old)
+                # Replacing a key keeps its place, as an UPDATE keeps the rowid
+                self._records[record.id] = record
+                self._add_to_indexes(record)
+            self._sorted.clear()
+            self.version = after
+            self.writes += 1
+
+    def clear(self, before: int, after: int):
+        """Write-through for a write that emptied the table."""
+        with self._lock:
+            if self.version != before:
+                self.version = None
+                return
+            self._records = {}
+            self._index = {name: {} for name in self.indexes}
+            self._sorted.clear()
+            self.version = after
+            self.writes += 1
+
+    # Reads; callers make sure the cache is current first
+
+    def _select(self, filters: Dict[str, Any]) -> Iterable[Record]:
+        filters = {name: value for name, value in filters.items() if value is not None}
+        if not filters:
+            return self._records.values()
+        buckets = [self._index[name].get(value, {}) for name, value in filters.items()]
+        smallest = min(buckets, key=len)
+        return [record for record in smallest.values()
+                if all(record.id in bucket for bucket in buckets)]
+
+    def _sort(self, records: Iterable[Record], sort: str) -> Tuple[List[tuple], List[Record]]:
+        key = self.sort_keys[sort]
+        # Ordered by (sort value, id), like the keyset-paginated SQL
+        pairs = sorted(((sql_order(key(record)), record.id), record) for record in records)
+        return [pair[0] for pair in pairs], [pair[1] for pair in pairs]
+
+    def _view(self, sort: str, filters: Dict[str, Any]) -> Tuple[List[tuple], List[Record]]:
+        if any(value is not None for value in filters.values()):
+            return self._sort(self._select(filters), sort)
+        view = self._sorted.get(sort)
+        if view is None:
+            view = self._sorted[sort] = self._sort(self._records.values(), sort)
+        return view
+
+    def cards(self, sort: Optional[str] = None, **filters: Any) -> List[Dict[str, Any]]:
+        """Every card (matching ``filters``), in load order or by ``sort`` ascending."""
+        with self._lock:
+            if sort is None:
+                return [record.as_dict() for record in self._select(filters)]
+            return [record.as_dict() for record in self._view(sort, filters)[1]]
+
+    def page(self, sort: str, order: str, limit: int, cursor: Optional[str] = None,
+             **filters: Any) -> Dict[str, Any]:
+        """One keyset page, with the same items and cursors as the SQL listing."""
+        check_page_request(self.sort_keys, sort, order, limit)
+        after = None
+        if cursor:
+            value, card_id = decode_cursor(cursor, sort, order)
+            after = (sql_order(value), card_id)
+        with self._lock:
+            keys, records = self._view(sort, filters)
+            try:
+                if order == 'asc':
+                    start = bisect_right(keys, after) if after else 0
+                    chosen = records[start:start + limit + 1]
+                else:
+                    end = bisect_left(keys, after) if after else len(keys)
+                    chosen = records[max(end - limit - 1, 0):end][::-1]
+            except TypeError:
+                raise PageRequestError("Invalid cursor")
+            items = [record.as_dict() for record in chosen[:limit]]
+        next_cursor = None
+        if len(chosen) > limit:
+            last = chosen[limit - 1]
+            next_cursor = encode_cursor(sort, order, self.sort_keys[sort](last), last.id)
+        return {"items": items, "next_cursor": next_cursor}
+
+    def get_many(self, card_ids: Iterable[str]) -> List[Dict[str, Any]]:
+        """The cards of ``card_ids`` that are in the list."""
+        with self._lock:
+            return [self._records[card_id].as_dict() for card_id in card_ids if card_id in self._records]
+
+    def values(self, index: str) -> List[Any]:
+        """The distinct values of an indexed column, sorted."""
+        with self._lock:
+            return sorted(self._index[index])
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "cards": len(self._records),
+                "version": self.version,
+                "loads": self.loads,
+                "writes": self.writes,
+                "invalidations": self.invalidations,
+            }
@@ -0,0 +1,380 @@
+"""Latency histograms and counters, exposed in the Prometheus text format.
+
+Four things are measured in both services:
+
+* every HTTP request, by method, route template and status
+  (``MetricsMiddleware``);
+* every data-layer call, by function (``timed`` on the module functions,
+  ``timed_methods`` on ``Database``);
+* every SQL statement, by its normalised text, through the connection
+  factory the pools open connections with (``InstrumentedConnection``);
+  statements slower than ``POKETRACK_SLOW_QUERY_MS`` are also logged
+  with their ``EXPLAIN QUERY PLAN``;
+* every upstream API call, by host and outcome (``observe_upstream``).
+
+Caches registered with ``register_cache`` are read when ``render`` is
+called, so their hit ratios cost nothing between scrapes.
+"""
+import asyncio
+import functools
+import inspect
+import json
+import re
+import sqlite3
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Sequence, Tuple
+
+from common import config
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Upper bounds in seconds, from sub-millisecond SQLite lookups to slow upstream calls
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Longest statement text kept as a label value
+MAX_STATEMENT_LENGTH = 200
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Histogram:
+    """Observations bucketed by upper bound, one series per label combination."""
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [count per bucket..., sum, count]
+        self._series: Dict[Tuple[str, ...], List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float, *label_values: str):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    series[i] += 1
+                    break
+            series[-2] += seconds
+            series[-1] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((values, list(counts)) for values, counts in self._series.items())
+        for values, counts in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                bucket = _labels(self.labels, values, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{bucket} {cumulative}")
+            bucket = _labels(self.labels, values, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{bucket} {int(counts[-1])}")
+            lines.append(f"{self.name}_sum{_labels(self.labels, values)} {_number(counts[-2])}")
+            lines.append(f"{self.name}_count{_labels(self.labels, values)} {int(counts[-1])}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values: str, amount: float = 1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = sorted(self._values.items())
+        for label_values, value in values:
+            lines.append(f"{self.name}{_labels(self.labels, label_values)} {_number(value)}")
+        return lines
+
+
+HTTP_REQUESTS = Histogram(
+    "poketrack_http_request_duration_seconds", "Time to answer an HTTP request.",
+    ("method", "route", "status"))
+DB_CALLS = Histogram(
+    "poketrack_db_call_duration_seconds", "Time spent in a data-layer function.", ("function",))
+DB_ERRORS = Counter(
+    "poketrack_db_call_errors_total", "Data-layer calls that raised or returned an error.", ("function",))
+SQL_STATEMENTS = Histogram(
+    "poketrack_sql_statement_duration_seconds",
+    "Time SQLite took to execute a statement (up to its first row).", ("statement",))
+SLOW_QUERIES = Counter(
+    "poketrack_slow_queries_total", "Statements slower than the slow-query threshold.")
+UPSTREAM_REQUESTS = Histogram(
+    "poketrack_upstream_request_duration_seconds", "Time taken by a call to an upstream API.",
+    ("upstream", "outcome"))
+
+_METRICS = (HTTP_REQUESTS, DB_CALLS, DB_ERRORS, SQL_STATEMENTS, SLOW_QUERIES, UPSTREAM_REQUESTS)
+
+
+# Caches
+
+_caches: Dict[str, Callable[[], Dict[str, Any]]] = {}
+
+
+def register_cache(name: str, cache: Any):
+    """Report a cache's hits and misses, read from its ``stats()`` at each scrape.
+
+    Coalesced lookups (SearchCache) and 304s (RenderedCache) count as hits:
+    neither had to load anything.
+    """
+    _caches[name] = cache.stats
+
+
+def _render_caches() -> List[str]:
+    hits = ["# HELP poketrack_cache_hits_total Lookups answered without loading.",
+            "# TYPE poketrack_cache_hits_total counter"]
+    misses = ["# HELP poketrack_cache_misses_total Lookups that had to load.",
+              "# TYPE poketrack_cache_misses_total counter"]
+    ratio = ["# HELP poketrack_cache_hit_ratio Share of lookups answered without loading.",
+             "# TYPE poketrack_cache_hit_ratio gauge"]
+    for name, stats in sorted(_caches.items()):
+        values = stats()
+        hit = values["hits"] + values.get("coalesced", 0) + values.get("not_modified", 0)
+        miss = values["misses"]
+        label = _labels(("cache",), (name,))
+        hits.append(f"poketrack_cache_hits_total{label} {hit}")
+        misses.append(f"poketrack_cache_misses_total{label} {miss}")
+        ratio.append(f"poketrack_cache_hit_ratio{label} {_number(hit / (hit + miss) if hit + miss else 0)}")
+    return hits + misses + ratio
+
+
+def render() -> str:
+    """Every metric in the Prometheus text exposition format."""
+    lines: List[str] = []
+    for metric in _METRICS:
+        lines.extend(metric.render())
+    lines.extend(_render_caches())
+    return '\n'.join(lines) + '\n'
+
+
+# HTTP requests
+
+class MetricsMiddleware:
+    """Times every HTTP request, labelled by the route template it matched.
+
+    Streaming responses (server-sent events) are timed until the stream ends.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._routes: Dict[Any, str] = {}
+
+    def _route(self, scope) -> str:
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            # Unmatched paths share one label, whatever was requested
+            return "unmatched"
+        route = self._routes.get(endpoint)
+        if route is None:
+            for candidate in scope["app"].routes:
+                if getattr(candidate, "endpoint", None) is endpoint:
+                    route = self._routes[endpoint] = candidate.path
+                    break
+            else:
+                route = "unmatched"
+        return route
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            HTTP_REQUESTS.observe(time.perf_counter() - started,
+                                  scope["method"], self._route(scope), str(status))
+
+
+# Data-layer functions
+
+def _failed(result: Any) -> bool:
+    # The data layers report most failures as {"error": ...} rather than raising
+    return isinstance(result, dict) and "error" in result
+
+
+def timed(func: Optional[Callable] = None, *, name: Optional[str] = None) -> Callable:
+    """Time a data-layer function (sync or coroutine) and count its failures."""
+    if func is None:
+        return functools.partial(timed, name=name)
+    label = name or func.__name__
+
+    if asyncio.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                result = await func(*args, **kwargs)
+            except Exception:
+                DB_ERRORS.inc(label)
+                raise
+            finally:
+                DB_CALLS.observe(time.perf_counter() - started, label)
+            if _failed(result):
+                DB_ERRORS.inc(label)
+            return result
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            result = func(*args, **kwargs)
+        except Exception:
+            DB_ERRORS.inc(label)
+            raise
+        finally:
+            DB_CALLS.observe(time.perf_counter() - started, label)
+        if _failed(result):
+            DB_ERRORS.inc(label)
+        return result
+    return wrapper
+
+
+def timed_methods(cls):
+    """Class decorator applying ``timed`` to every public method, as ``Class.method``."""
+    for attr, value in list(vars(cls).items()):
+        if not attr.startswith('_') and inspect.isfunction(value):
+            setattr(cls, attr, timed(value, name=f"{cls.__name__}.{attr}"))
+    return cls
+
+
+# SQL statements and the slow-query log
+
+_PLACEHOLDER_RUN = re.compile(r'\?(?:\s*,\s*\?)+')
+_WHITESPACE = re.compile(r'\s+')
+_EXPLAINABLE = ('SELECT', 'WITH', 'INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+
+
+@functools.lru_cache(maxsize=1024)
+def normalize_statement(sql: str) -> str:
+    """One label per statement shape: whitespace collapsed, ``IN (?, ?, ...)`` lists folded."""
+    statement = _PLACEHOLDER_RUN.sub('?, ...', _WHITESPACE.sub(' ', sql).strip())
+    if len(statement) > MAX_STATEMENT_LENGTH:
+        statement = statement[:MAX_STATEMENT_LENGTH - 3] + '...'
+    return statement
+
+
+_slow_queries: Deque[Dict[str, Any]] = deque(maxlen=config.SLOW_QUERY_HISTORY)
+_slow_log_lock = threading.Lock()
+
+
+def query_plan(conn: sqlite3.Connection, sql: str, parameters: Any = ()) -> Optional[List[str]]:
+    """``EXPLAIN QUERY PLAN`` for a statement, indented like the sqlite3 shell prints it."""
+    if not sql.lstrip().upper().startswith(_EXPLAINABLE):
+        return None
+    try:
+        # A plain cursor, so explaining a statement is not itself timed
+        rows = sqlite3.Cursor(conn).execute(f"EXPLAIN QUERY PLAN {sql}", parameters).fetchall()
+    except sqlite3.Error as e:
+        return [f"(no plan: {e})"]
+    depth = {0: -1}
+    plan = []
+    for node, parent, _, detail in rows:
+        depth[node] = depth.get(parent, -1) + 1
+        plan.append('  ' * depth[node] + detail)
+    return plan
+
+
+def _log_slow_query(conn: sqlite3.Connection, sql: str, parameters: Any, seconds: float):
+    SLOW_QUERIES.inc()
+    entry = {
+        "at": time.strftime('%Y-%m-%dT%H:%M:%S'),
+        "ms": round(seconds * 1000, 2),
+        "statement": _WHITESPACE.sub(' ', sql).strip(),
+        "plan": query_plan(conn, sql, parameters),
+    }
+    with _slow_log_lock:
+        _slow_queries.append(entry)
+        if config.SLOW_QUERY_LOG:
+            with open(config.SLOW_QUERY_LOG, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry) + '\n')
+        else:
+            plan = ''.join(f"\n    {line}" for line in entry["plan"] or ())
+            print(f"Slow query ({entry['ms']} ms): {entry['statement']}{plan}")
+
+
+def slow_queries() -> List[Dict[str, Any]]:
+    """The most recent slow statements, newest last."""
+    with _slow_log_lock:
+        return list(_slow_queries)
+
+
+def _record(conn: sqlite3.Connection, sql: str, parameters: Any, seconds: float):
+    SQL_STATEMENTS.observe(seconds, normalize_statement(sql))
+    if config.SLOW_QUERY_MS > 0 and seconds * 1000 >= config.SLOW_QUERY_MS:
+        _log_slow_query(conn, sql, parameters, seconds)
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            _record(self.connection, sql, parameters, time.perf_counter() - started)
+
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            # Explain with the first row of parameters, when they were a list
+            first = seq_of_parameters[0] if isinstance(seq_of_parameters, list) and seq_of_parameters else ()
+            _record(self.connection, sql, first, time.perf_counter() - started)
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """A connection whose statements are timed; pass as ``factory`` to ``sqlite3.connect``."""
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+# Upstream APIs
+
+def observe_upstream(upstream: str, seconds: float, status: Optional[int]):
+    """Record an upstream call; ``status`` is None when no response came back."""
+    UPSTREAM_REQUESTS.observe(seconds, upstream, f"{status // 100}xx" if status else "error")
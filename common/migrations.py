@@ -0,0 +1,62 @@
+"""Versioned schema migrations tracked with ``PRAGMA user_version``.
+
+Each service lists its migrations in order; a database file records the
+version it has reached, and ``migrate`` applies only the ones after it.
+Every migration runs in its own transaction together with the version
+bump, so a failure leaves the file at the last good version. Migrations
+are written to be applied in place on existing files (ALTER TABLE,
+CREATE INDEX, ...) rather than by rebuilding the database.
+"""
+import sqlite3
+from typing import Callable, List, NamedTuple, Sequence, Union
+
+Step = Union[str, Callable[[sqlite3.Connection], None]]
+
+
+class Migration(NamedTuple):
+    version: int
+    description: str
+    steps: Sequence[Step]
+
+
+def current_version(conn: sqlite3.Connection) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def column_names(conn: sqlite3.Connection, table: str) -> List[str]:
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+
+
+def migrate(conn: sqlite3.Connection, migrations: Sequence[Migration]) -> int:
+    """Bring the database up to the latest migration and return its version."""
+    if conn.in_transaction:
+        conn.commit()
+    expected = 1
+    for migration in migrations:
+        if migration.version != expected:
+            raise ValueError(f"Migrations must be numbered 1, 2, 3, ...; got {migration.version}")
+        expected += 1
+
+    version = current_version(conn)
+    for migration in migrations:
+        if migration.version <= version:
+            continue
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Another process may have migrated while we waited for the lock
+            if current_version(conn) >= migration.version:
+                conn.commit()
+                continue
+            for step in migration.steps:
+                if callable(step):
+                    step(conn)
+                else:
+                    conn.execute(step)
+            conn.execute(f"PRAGMA user_version = {migration.version}")
+            conn.commit()
+            print(f"Applied migration {migration.version}: {migration.description}")
+        except Exception:
+            conn.rollback()
+            raise
+        version = migration.version
+    return max(version, current_version(conn))
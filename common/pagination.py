@@ -0,0 +1,102 @@
+import base64
+import json
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+SORT_ORDERS = ('asc', 'desc')
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+
+class PageRequestError(ValueError):
+    """Raised for an unknown sort key, bad page size or invalid cursor."""
+
+
+def encode_cursor(sort: str, order: str, value: Any, row_id: str) -> str:
+    """Build the opaque continuation token for the row a page ended on."""
+    payload = json.dumps([sort, order, value, row_id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token: str, sort: str, order: str) -> Tuple[Any, str]:
+    """Decode a continuation token, checking it belongs to this sort order."""
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        cursor_sort, cursor_order, value, row_id = json.loads(base64.urlsafe_b64decode(padded))
+    except (ValueError, TypeError):
+        raise PageRequestError("Invalid cursor")
+    if (cursor_sort, cursor_order) != (sort, order):
+        raise PageRequestError("Cursor was issued for a different sort order")
+    return value, row_id
+
+
+def check_page_request(sort_keys: Sequence[str], sort: str, order: str, limit: int, offset: int = 0):
+    """Raise PageRequestError unless the paging parameters are valid."""
+    if sort not in sort_keys:
+        raise PageRequestError(f"Unknown sort key {sort!r}; expected one of {', '.join(sort_keys)}")
+    if order not in SORT_ORDERS:
+        raise PageRequestError("order must be 'asc' or 'desc'")
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        raise PageRequestError(f"limit must be between 1 and {MAX_PAGE_SIZE}")
+    if offset < 0:
+        raise PageRequestError("offset must not be negative")
+
+
+def keyset_query(table: str,
+                 columns: str,
+                 sort_columns: Dict[str, str],
+                 sort: str,
+                 order: str,
+                 limit: int,
+                 cursor: Optional[str] = None,
+                 filters: Sequence[Tuple[str, Any]] = (),
+                 offset: int = 0) -> Tuple[str, List[Any]]:
+    """Build the SQL for one page of a keyset-paginated listing.
+
+    Rows are ordered by (sort expression, id) and a page starts strictly
+    after the row encoded in the cursor, so with an index on exactly that
+    pair SQLite seeks straight to the page instead of sorting the table.
+    One extra row is fetched to tell whether there is a next page; the sort
+    value is selected as ``_sort_value`` for building the next cursor.
+
+    ``filters`` are (SQL condition, value) pairs ANDed into the WHERE
+    clause; a value of None adds the condition without a parameter.
+    ``offset`` skips rows for callers paging by position instead of cursor.
+    """
+    check_page_request(sort_columns, sort, order, limit, offset)
+
+    sort_expression = sort_columns[sort]
+    conditions: List[str] = []
+    params: List[Any] = []
+    for condition, value in filters:
+        conditions.append(condition)
+        if value is not None:
+            params.append(value)
+    if cursor:
+        value, row_id = decode_cursor(cursor, sort, order)
+        op = '>' if order == 'asc' else '<'
+        # The plain range term lets SQLite seek an expression index, which it
+        # will not do for the row-value comparison alone
+        conditions.append(f"{sort_expression} {op}= ? AND ({sort_expression}, id) {op} (?, ?)")
+        params.extend([value, value, row_id])
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+    params.extend([limit + 1, offset])
+    sql = f"""
+        SELECT {columns}, {sort_expression} AS _sort_value
+        FROM {table}
+        {where}
+        ORDER BY {sort_expression} {order}, id {order}
+        LIMIT ? OFFSET ?
+    """
+    return sql, params
+
+
+def build_page(rows: Sequence[Dict[str, Any]], sort: str, order: str, limit: int) -> Dict[str, Any]:
+    """Turn the rows fetched by keyset_query into a page with a next cursor."""
+    items = [dict(row) for row in rows[:limit]]
+    for item in items:
+        item.pop('_sort_value', None)
+    next_cursor = None
+    if len(rows) > limit:
+        last = rows[limit - 1]
+        next_cursor = encode_cursor(sort, order, last['_sort_value'], last['id'])
+    return {"items": items, "next_cursor": next_cursor}
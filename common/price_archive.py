@@ -0,0 +1,241 @@
+"""Compact cold storage for old price history.
+
+``price_history`` stores one row per price point with an ISO text
+timestamp, which costs 60+ bytes a point before indexes. ``archive``
+moves every point older than a cutoff into ``price_archive``, one row per
+card per month holding a packed blob: timestamps as deltas from the
+previous point and prices as integer cents (also delta-encoded), both as
+int64 arrays, zlib-compressed. A month of hourly prices for a card fits
+in a few hundred bytes.
+
+Cutoffs are rounded down to the start of a month, so archived months are
+normally complete; a point that turns up later for an archived month is
+merged into that month's blob. ``archived_points`` and ``history`` read the
+archive and ``price_history`` together, so callers see one series.
+
+Archive a service database by hand with::
+
+    python -m common.price_archive path/to/pokemon_cards.db --days 90
+"""
+import argparse
+import sqlite3
+import struct
+import sys
+import zlib
+from array import array
+from datetime import datetime, timedelta
+from itertools import groupby
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from common import config
+
+FORMAT_VERSION = 1
+
+Point = Tuple[str, Optional[float]]
+
+# version, timestamp unit (0 = seconds, 1 = microseconds), date/time separator, point count
+_HEADER = struct.Struct("<BBcI")
+_EPOCH = datetime(1970, 1, 1)
+_UNITS = (timedelta(seconds=1), timedelta(microseconds=1))
+# Stands in for a NULL price in the cents array
+_NO_PRICE = -1
+
+
+def encode(points: Sequence[Point]) -> bytes:
+    """Pack (date, price) points, sorted by date, into an archive blob.
+
+    Dates come back from ``decode`` in the same ISO layout they went in
+    with (separator and whether fractional seconds were present), as long
+    as a blob's points share one layout, which each service's do.
+    """
+    moments = [datetime.fromisoformat(date) for date, _ in points]
+    unit = 1 if any(moment.microsecond for moment in moments) else 0
+    separator = b"T" if points and "T" in points[0][0] else b" "
+
+    times = array("q", ((moment - _EPOCH) // _UNITS[unit] for moment in moments))
+    cents = array("q", (_NO_PRICE if price is None else round(price * 100) for _, price in points))
+    for values in (times, cents):
+        for i in range(len(values) - 1, 0, -1):
+            values[i] -= values[i - 1]
+    if sys.byteorder == "big":
+        times.byteswap()
+        cents.byteswap()
+    return _HEADER.pack(FORMAT_VERSION, unit, separator, len(points)) + \
+        zlib.compress(times.tobytes() + cents.tobytes())
+
+
+def decode(blob: bytes) -> List[Point]:
+    """Unpack an archive blob into (date, price) points in date order."""
+    version, unit, separator, count = _HEADER.unpack_from(blob)
+    if version != FORMAT_VERSION:
+        raise ValueError(f"Unsupported price archive format {version}")
+    packed = array("q")
+    packed.frombytes(zlib.decompress(blob[_HEADER.size:]))
+    if sys.byteorder == "big":
+        packed.byteswap()
+    times, cents = packed[:count], packed[count:]
+    for values in (times, cents):
+        for i in range(1, len(values)):
+            values[i] += values[i - 1]
+
+    sep = separator.decode()
+    step = _UNITS[unit]
+    return [
+        ((_EPOCH + step * moment).isoformat(sep), None if cent == _NO_PRICE else cent / 100)
+        for moment, cent in zip(times, cents)
+    ]
+
+
+def cutoff(days: int = config.PRICE_ARCHIVE_AFTER_DAYS, now: Optional[datetime] = None) -> str:
+    """The first day of the month ``days`` ago; history before it gets archived."""
+    moment = (now or datetime.now()) - timedelta(days=days)
+    return moment.strftime("%Y-%m-01")
+
+
+def has_archive(conn: sqlite3.Connection) -> bool:
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'price_archive'"
+    ).fetchone() is not None
+
+
+def pending(conn: sqlite3.Connection, before: str) -> bool:
+    """Whether any price history is dated before ``before``, i.e. ``archive`` has work to do."""
+    return conn.execute(
+        "SELECT 1 FROM price_history WHERE date < ? AND card_id IS NOT NULL LIMIT 1", (before,)
+    ).fetchone() is not None
+
+
+def archive(conn: sqlite3.Connection, before: str) -> Dict[str, int]:
+    """Move price history dated before ``before`` into the archive.
+
+    Runs inside the caller's transaction. Returns how many rows were moved
+    and how many monthly blobs were written.
+    """
+    rows = conn.execute("""
+        SELECT card_id, date, price FROM price_history
+        WHERE date < ? AND card_id IS NOT NULL
+        ORDER BY card_id, date, rowid
+    """, (before,))
+    moved = written = 0
+    for (card_id, month), group in groupby(rows, key=lambda row: (row[0], row[1][:7])):
+        points = [(date, price) for _, date, price in group]
+        moved += len(points)
+        existing = conn.execute(
+            "SELECT data FROM price_archive WHERE card_id = ? AND month = ?", (card_id, month)
+        ).fetchone()
+        if existing:
+            points = sorted(decode(existing[0]) + points, key=lambda point: point[0])
+        conn.execute("""
+            INSERT OR REPLACE INTO price_archive (card_id, month, points, first_date, last_date, data)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, (card_id, month, len(points), points[0][0], points[-1][0], encode(points)))
+        written += 1
+    conn.execute("DELETE FROM price_history WHERE date < ? AND card_id IS NOT NULL", (before,))
+    return {"archived_rows": moved, "blobs_written": written}
+
+
+def clear(conn: sqlite3.Connection):
+    conn.execute("DELETE FROM price_archive")
+
+
+def archive_query(card_id: Optional[str] = None,
+                  start: Optional[str] = None,
+                  end: Optional[str] = None) -> Tuple[str, List[str]]:
+    """SQL selecting (card_id, data) for the blobs that may hold points in [start, end)."""
+    conditions, params = [], []
+    if card_id is not None:
+        conditions.append("card_id = ?")
+        params.append(card_id)
+    if start:
+        conditions.append("month >= ?")
+        params.append(start[:7])
+    if end:
+        conditions.append("month <= ?")
+        params.append(end[:7])
+    where = " AND ".join(conditions) or "1"
+    return f"SELECT card_id, data FROM price_archive WHERE {where} ORDER BY card_id, month", params
+
+
+def blob_points(data: bytes,
+                start: Optional[str] = None,
+                end: Optional[str] = None) -> Iterator[Point]:
+    """The points of one blob with start <= date < end."""
+    for date, price in decode(data):
+        if (start and date < start) or (end and date >= end):
+            continue
+        yield date, price
+
+
+def archived_points(conn: sqlite3.Connection,
+                    card_id: Optional[str] = None,
+                    start: Optional[str] = None,
+                    end: Optional[str] = None) -> Iterator[Tuple[str, str, Optional[float]]]:
+    """(card_id, date, price) for archived points with start <= date < end."""
+    sql, params = archive_query(card_id, start, end)
+    for row_card_id, data in conn.execute(sql, params):
+        for date, price in blob_points(data, start, end):
+            yield row_card_id, date, price
+
+
+def history(conn: sqlite3.Connection,
+            card_id: str,
+            start: Optional[str] = None,
+            end: Optional[str] = None) -> List[Dict[str, Any]]:
+    """A card's full price series, archived and live, as {"price", "date"} in date order."""
+    conditions, params = ["card_id = ?"], [card_id]
+    if start:
+        conditions.append("date >= ?")
+        params.append(start)
+    if end:
+        conditions.append("date < ?")
+        params.append(end)
+    live = conn.execute(
+        f"SELECT date, price FROM price_history WHERE {' AND '.join(conditions)} ORDER BY date", params
+    ).fetchall()
+    archived = []
+    if has_archive(conn):
+        archived = [(date, price) for _, date, price in archived_points(conn, card_id, start, end)]
+    points: Iterable[Point] = archived + live
+    if archived and live and archived[-1][0] > live[0][0]:
+        points = sorted(points, key=lambda point: point[0])
+    return [{"price": price, "date": date} for date, price in points]
+
+
+def load_temp_table(conn: sqlite3.Connection, name: str = "archived_price_history") -> str:
+    """Copy every archived point into a TEMP table (card_id, price, date) for SQL to read.
+
+    Rows are inserted in archive order, so the temp table's rowid orders
+    points that share a timestamp the way their original rows were.
+    """
+    conn.execute(f"DROP TABLE IF EXISTS temp.{name}")
+    conn.execute(f"CREATE TEMP TABLE {name} (card_id TEXT, price REAL, date TEXT)")
+    if has_archive(conn):
+        conn.executemany(
+            f"INSERT INTO temp.{name} (card_id, date, price) VALUES (?, ?, ?)",
+            archived_points(conn)
+        )
+    return f"temp.{name}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Move old price history into the compact archive")
+    parser.add_argument("db", help="Service database file")
+    parser.add_argument("--days", type=int, default=config.PRICE_ARCHIVE_AFTER_DAYS,
+                        help="Archive whole months older than this many days")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db, isolation_level=None)
+    if not has_archive(conn):
+        parser.error("no price_archive table; start the service once to run its migrations")
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        result = archive(conn, cutoff(args.days))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    print(f"Archived {result['archived_rows']} price history rows into {result['blobs_written']} blobs")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+from common import config
+
+
+def search_key(query: str, **filters: Any) -> Tuple:
+    """Build a cache key from a search query and its filters.
+
+    The query is case-folded and whitespace-collapsed, empty filters are
+    dropped and numeric filters are normalised, so requests that would get
+    the same answer from upstream share one cache entry. Other filters are
+    kept as given: set names, rarities and page cursors are case-sensitive.
+    """
+    normalized = " ".join((query or "").lower().split())
+    parts = []
+    for name in sorted(filters):
+        value = filters[name]
+        if value is None or value == "":
+            continue
+        if isinstance(value, (int, float)):
+            value = float(value)
+        parts.append((name, value))
+    return (normalized, tuple(parts))
+
+
+class _Pending:
+    """A load in progress on some thread that other threads can wait on."""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SearchCache:
+    """A TTL + LRU cache for search results that coalesces concurrent loads.
+
+    When several callers miss on the same key at once, only the first runs
+    the loader; the rest wait for its result. Failed loads are not cached.
+    """
+
+    def __init__(self,
+                 ttl: float = config.SEARCH_CACHE_TTL,
+                 max_entries: int = config.SEARCH_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._inflight_async: Dict[Hashable, asyncio.Future] = {}
+        self._inflight_sync: Dict[Hashable, _Pending] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    def _lookup(self, key: Hashable) -> Tuple[bool, Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return True, value
+                del self._entries[key]
+            return False, None
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        return self._lookup(key)[1]
+
+    def put(self, key: Hashable, value: Any):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    async def get_or_load_async(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any:
+        """Return the cached value for key, or await loader() exactly once for it."""
+        found, value = self._lookup(key)
+        if found:
+            return value
+
+        pending = self._inflight_async.get(key)
+        if pending is not None:
+            self.coalesced += 1
+            return await asyncio.shield(pending)
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._inflight_async[key] = future
+        try:
+            value = await loader()
+        except BaseException as e:
+            future.set_exception(e)
+            # Mark the exception as retrieved in case nobody else was waiting
+            future.exception()
+            raise
+        else:
+            self.put(key, value)
+            future.set_result(value)
+            return value
+        finally:
+            del self._inflight_async[key]
+
+    def get_or_load(self, key: Hashable, loader: Callable[[], Any]) -> Any:
+        """Thread-safe synchronous counterpart of get_or_load_async."""
+        found, value = self._lookup(key)
+        if found:
+            return value
+
+        with self._lock:
+            pending = self._inflight_sync.get(key)
+            owner = pending is None
+            if owner:
+                pending = _Pending()
+                self._inflight_sync[key] = pending
+                self.misses += 1
+            else:
+                self.coalesced += 1
+
+        if not owner:
+            pending.event.wait()
+            if pending.error is not None:
+                raise pending.error
+            return pending.value
+
+        try:
+            pending.value = loader()
+            self.put(key, pending.value)
+            return pending.value
+        except BaseException as e:
+            pending.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._inflight_sync[key]
+            pending.event.set()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            "size": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+            "hit_ratio": (self.hits + self.coalesced) / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,322 @@
+"""Per-user SQLite shards and the router that hands them out.
+
+With ``POKETRACK_SHARD_DIR`` set, every user, named by the ``X-User-Id``
+request header (or, for event streams, a ``user`` query parameter),
+gets a database file of their own instead of a share of one global file. Users never wait on each other's write lock, so write
+throughput grows with the number of users rather than being capped by a
+single writer. The files are spread over ``POKETRACK_SHARD_BUCKETS``
+subdirectories by a stable hash of the user id (``bucket_for``). A
+bucket is the unit that moves between nodes: copy its directory and
+route the users that hash to it to the new node.
+
+``ShardRouter`` opens a user's shard (running its migrations) on first
+use and keeps at most ``POKETRACK_SHARD_MAX_OPEN`` open, closing the
+least recently used ones once no request holds them. Without a shard
+directory every user maps to the configured database, so a single-user
+install works as before.
+"""
+import asyncio
+import hashlib
+import inspect
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+from urllib.parse import parse_qs
+
+from common import config
+
+USER_HEADER = "X-User-Id"
+# The query parameter naming the user where no header can be sent (EventSource)
+USER_PARAM = "user"
+
+# User ids are used as file names, so only a safe subset is accepted
+USER_ID_PATTERN = re.compile(r"[a-z0-9][a-z0-9_.@-]{0,63}")
+
+
+class ShardError(ValueError):
+    """Raised for a missing or malformed user id when sharding is on."""
+
+
+def normalize_user_id(user_id: Optional[str]) -> Optional[str]:
+    """The user id as it is stored (ids are case-insensitive); raises ShardError if it is not valid."""
+    if user_id is None:
+        return None
+    user_id = user_id.strip().lower()
+    if not USER_ID_PATTERN.fullmatch(user_id):
+        raise ShardError(f"{USER_HEADER} must be 1-64 letters, digits, '_', '.', '@' or '-'")
+    return user_id
+
+
+def bucket_for(user_id: str, buckets: int = config.SHARD_BUCKETS) -> int:
+    """The bucket a user's shard lives in; the same on every node and every run."""
+    digest = hashlib.blake2b(user_id.encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') % buckets
+
+
+class _Entry:
+    __slots__ = ('shard', 'users')
+
+    def __init__(self, shard: Any):
+        self.shard = shard
+        self.users = 1
+
+
+class ShardRouter:
+    def __init__(self,
+                 open_shard: Callable[[str], Any],
+                 close_shard: Callable[[Any], Any],
+                 root: str = config.SHARD_DIR,
+                 buckets: int = config.SHARD_BUCKETS,
+                 max_open: int = config.SHARD_MAX_OPEN,
+                 default_path: str = config.DB_PATH):
+        """``open_shard`` makes a shard from a database path; ``close_shard`` closes one.
+
+        ``close_shard`` may be a coroutine function, in which case shards
+        are only closed by ``use_async`` and ``aclose_all``.
+        """
+        self.open_shard = open_shard
+        self.close_shard = close_shard
+        self.root = os.path.abspath(root) if root else ""
+        self.buckets = buckets
+        self.max_open = max(max_open, 1)
+        self.default_path = default_path
+        # path -> entry, least recently used first
+        self._shards: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._closing: List[Any] = []
+        self._lock = threading.Lock()
+        # Opening runs migrations, so it is done outside the main lock,
+        # one shard at a time
+        self._open_lock = threading.Lock()
+        self._binding: ContextVar[Optional["_Binding"]] = ContextVar("shard_binding", default=None)
+        self.opens = 0
+        self.hits = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.root)
+
+    def path(self, user_id: Optional[str]) -> str:
+        """The database file for ``user_id``; raises ShardError if it is missing or invalid."""
+        if not self.enabled:
+            return self.default_path
+        user_id = self.user_id(user_id)
+        return os.path.join(self.root, f"{bucket_for(user_id, self.buckets):03x}", f"{user_id}.db")
+
+    def user_ids(self) -> Iterator[Optional[str]]:
+        """Every user with a shard on disk (just None when sharding is off)."""
+        if not self.enabled:
+            yield None
+            return
+        if not os.path.isdir(self.root):
+            return
+        for bucket in sorted(os.scandir(self.root), key=lambda entry: entry.name):
+            if not bucket.is_dir():
+                continue
+            for file in sorted(os.listdir(bucket.path)):
+                if file.endswith(".db"):
+                    yield file[:-3]
+
+    # Checking shards out and in
+
+    def _claim(self, path: str) -> Optional[_Entry]:
+        with self._lock:
+            entry = self._shards.get(path)
+            if entry is not None:
+                entry.users += 1
+                self._shards.move_to_end(path)
+                self.hits += 1
+            return entry
+
+    def _evict(self):
+        # Called with self._lock held; shards in use are skipped, not waited for
+        excess = len(self._shards) - self.max_open
+        for path in list(self._shards):
+            if excess <= 0:
+                break
+            entry = self._shards[path]
+            if entry.users == 0:
+                del self._shards[path]
+                self._closing.append(entry.shard)
+                self.evictions += 1
+                excess -= 1
+
+    def checkout(self, user_id: Optional[str]) -> Tuple[str, Any]:
+        """(path, shard) for ``user_id``, opened if needed; hand the path to ``checkin`` when done."""
+        path = self.path(user_id)
+        entry = self._claim(path)
+        if entry is None:
+            with self._open_lock:
+                entry = self._claim(path)
+                if entry is None:
+                    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+                    shard = self.open_shard(path)
+                    with self._lock:
+                        entry = self._shards[path] = _Entry(shard)
+                        self.opens += 1
+                        self._evict()
+        return path, entry.shard
+
+    def checkin(self, path: str) -> List[Any]:
+        """Release a checked-out shard; returns the shards evicted since, for the caller to close."""
+        with self._lock:
+            self._shards[path].users -= 1
+            self._evict()
+            closing, self._closing = self._closing, []
+        return closing
+
+    @contextmanager
+    def use(self, user_id: Optional[str]) -> Iterator[Any]:
+        """The shard for ``user_id`` for the duration of the block."""
+        path, shard = self.checkout(user_id)
+        try:
+            yield shard
+        finally:
+            for evicted in self.checkin(path):
+                self.close_shard(evicted)
+
+    async def _checkout_async(self, user_id: Optional[str]) -> Tuple[str, Any]:
+        path = self.path(user_id)
+        entry = self._claim(path)
+        if entry is not None:
+            return path, entry.shard
+        # Opening a shard touches the disk, so keep it off the event loop
+        return await asyncio.to_thread(self.checkout, user_id)
+
+    async def _close_async(self, shards: List[Any]):
+        for shard in shards:
+            result = self.close_shard(shard)
+            if inspect.isawaitable(result):
+                await result
+
+    @asynccontextmanager
+    async def use_async(self, user_id: Optional[str]) -> AsyncIterator[Any]:
+        path, shard = await self._checkout_async(user_id)
+        try:
+            yield shard
+        finally:
+            await self._close_async(self.checkin(path))
+
+    # The current request's shard, for data layers without a handle to pass around
+
+    async def current(self) -> Any:
+        """The shard of the request being served (see ShardMiddleware), checked out on first use."""
+        binding = self._binding.get()
+        if binding is None:
+            # Outside a request (startup, scripts): the default database
+            binding = _Binding(None)
+            self._binding.set(binding)
+        if binding.path is None:
+            path, shard = await self._checkout_async(binding.user_id)
+            if binding.path is None:
+                binding.path, binding.shard = path, shard
+            else:
+                # Another task of the same request checked it out meanwhile
+                await self._close_async(self.checkin(path))
+        return binding.shard
+
+    def current_user(self) -> Optional[str]:
+        """The normalized user id of the request being served (None when sharding is off)."""
+        binding = self._binding.get()
+        return self.user_id(binding.user_id if binding is not None else None)
+
+    def user_id(self, user_id: Optional[str]) -> Optional[str]:
+        """``user_id`` normalized, None when sharding is off; raises ShardError like ``path``."""
+        if not self.enabled:
+            return None
+        user_id = normalize_user_id(user_id)
+        if user_id is None:
+            raise ShardError(f"The {USER_HEADER} header is required")
+        return user_id
+
+    # Shutdown and monitoring
+
+    def _drain(self) -> List[Any]:
+        with self._lock:
+            shards = [entry.shard for entry in self._shards.values()] + self._closing
+            self._shards.clear()
+            self._closing = []
+        return shards
+
+    def close_all(self):
+        """Close every open shard (on shutdown)."""
+        for shard in self._drain():
+            self.close_shard(shard)
+
+    async def aclose_all(self):
+        await self._close_async(self._drain())
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "open": len(self._shards),
+                "in_use": sum(1 for entry in self._shards.values() if entry.users),
+                "max_open": self.max_open,
+                "buckets": self.buckets if self.enabled else None,
+                "opens": self.opens,
+                "hits": self.hits,
+                "evictions": self.evictions,
+            }
+
+
+class _Binding:
+    __slots__ = ('user_id', 'path', 'shard')
+
+    def __init__(self, user_id: Optional[str]):
+        self.user_id = user_id
+        self.path: Optional[str] = None
+        self.shard: Any = None
+
+
+class ShardMiddleware:
+    """Binds each request to its ``X-User-Id`` for ``ShardRouter.current``.
+
+    The shard is only checked out if the request touches the database,
+    and is held until the whole response, streamed bodies included, has
+    been sent. A missing or invalid user id is answered with a 400. On
+    ``query_paths`` (event streams, which browsers open without custom
+    headers) the ``user`` query parameter is accepted in its place.
+    """
+
+    def __init__(self, app, router: ShardRouter, query_paths: Sequence[str] = ()):
+        self.app = app
+        self.router = router
+        self.query_paths = set(query_paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        header = USER_HEADER.lower().encode()
+        user_id = next((value.decode("latin-1") for name, value in scope["headers"] if name == header), None)
+        if user_id is None and scope["path"] in self.query_paths:
+            user_id = next(iter(parse_qs(scope["query_string"].decode("latin-1")).get(USER_PARAM, [])), None)
+        binding = _Binding(user_id)
+        token = self.router._binding.set(binding)
+        started = False
+
+        async def send_wrapper(message):
+            nonlocal started
+            started = started or message["type"] == "http.response.start"
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except ShardError as e:
+            if started:
+                raise
+            body = json.dumps({"detail": str(e)}).encode()
+            await send({"type": "http.response.start", "status": 400,
+                        "headers": [(b"content-type", b"application/json"),
+                                    (b"content-length", str(len(body)).encode())]})
+            await send({"type": "http.response.body", "body": body})
+        finally:
+            self.router._binding.reset(token)
+            if binding.path is not None:
+                await self.router._close_async(self.router.checkin(binding.path))
@@ -0,0 +1,113 @@
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+from common import config
+from common.metrics import InstrumentedConnection
+
+
+def connection_pragmas() -> List[Tuple[str, object]]:
+    """Pragmas applied to every connection opened by the data layers."""
+    return [
+        ("journal_mode", "WAL"),
+        ("synchronous", "NORMAL"),
+        ("busy_timeout", config.SQLITE_BUSY_TIMEOUT_MS),
+        ("cache_size", -config.SQLITE_CACHE_SIZE_KB),
+        ("mmap_size", config.SQLITE_MMAP_SIZE),
+        ("temp_store", "MEMORY"),
+    ]
+
+
+def apply_pragmas(conn: sqlite3.Connection):
+    """Apply the standard pragmas to an open connection."""
+    for name, value in connection_pragmas():
+        conn.execute(f"PRAGMA {name} = {value}")
+
+
+class ConnectionPool:
+    """Hands out one long-lived SQLite connection per thread.
+
+    Connections are opened lazily the first time a thread asks for one and
+    are kept open for the life of the pool, so the page cache and the
+    statement cache stay warm across requests.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections: List[sqlite3.Connection] = []
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=config.SQLITE_BUSY_TIMEOUT_MS / 1000,
+            cached_statements=config.SQLITE_STATEMENT_CACHE,
+            check_same_thread=False,
+            factory=InstrumentedConnection,
+        )
+        apply_pragmas(conn)
+        with self._lock:
+            self._connections.append(conn)
+        return conn
+
+    def connection(self) -> sqlite3.Connection:
+        """Get the calling thread's connection, opening it if needed."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._connect()
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        """Run a block in a transaction on the calling thread's connection."""
+        conn = self.connection()
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+    def close_all(self):
+        """Close every connection the pool has opened."""
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            conn.close()
+        self._local = threading.local()
+
+
+_pools: Dict[str, ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(db_path: Optional[str] = None) -> ConnectionPool:
+    """Get the shared pool for a database file (defaults to the configured DB)."""
+    key = os.path.abspath(db_path or config.DB_PATH)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = ConnectionPool(key)
+            _pools[key] = pool
+        return pool
+
+
+def close_all_pools():
+    """Close every pool opened in this process."""
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close_all()
+
+
+def close_pool(db_path: str):
+    """Close and forget the pool for one database file, if one is open."""
+    with _pools_lock:
+        pool = _pools.pop(os.path.abspath(db_path), None)
+    if pool is not None:
+        pool.close_all()
@@ -0,0 +1,536 @@
+"""Local stand-in servers for the upstream APIs.
+
+These let the upstream-facing code paths run fully offline: point the
+relevant ``*_URL`` setting at a stand-in and it answers like the real
+service would, from generated or user-supplied data.
+
+Run one from the command line with::
+
+    python -m common.standin pokemontcg --port 8100
+    python -m common.standin pricing --port 8101
+    python -m common.standin tcgplayer --port 8102
+    python -m common.standin images --port 8103
+"""
+import argparse
+import hashlib
+import json
+import random
+import struct
+import threading
+import time
+import uuid
+import zlib
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, parse_qsl, urlparse
+
+SETS = [
+    ("base1", "Base", "Base", "1999/01/09"),
+    ("base2", "Jungle", "Base", "1999/06/16"),
+    ("base3", "Fossil", "Base", "1999/10/10"),
+    ("sv1", "Scarlet & Violet", "Scarlet & Violet", "2023/03/31"),
+    ("sv3pt5", "151", "Scarlet & Violet", "2023/09/22"),
+]
+NAMES = ["Pikachu", "Charizard", "Bulbasaur", "Squirtle", "Mewtwo", "Eevee",
+         "Gengar", "Snorlax", "Dragonite", "Gyarados", "Lapras", "Jigglypuff"]
+TYPES = ["Fire", "Water", "Grass", "Lightning", "Psychic", "Colorless"]
+RARITIES = ["Common", "Uncommon", "Rare", "Rare Holo"]
+ARTISTS = ["Ken Sugimori", "Mitsuhiro Arita", "Kagemaru Himeno", "Atsuko Nishida"]
+
+
+class Request:
+    """The parts of an incoming request a route handler needs."""
+
+    def __init__(self, method: str, path: str, query: Dict[str, str],
+                 headers: Dict[str, str], body: bytes):
+        self.method = method
+        self.path = path
+        self.query = query
+        self.headers = headers
+        self.body = body
+
+    def json(self) -> Any:
+        return json.loads(self.body or b"null")
+
+
+Response = Tuple[int, Dict[str, str], bytes]
+Handler = Callable[[Request], Response]
+
+
+def json_response(payload: Any, status: int = 200) -> Response:
+    return status, {"Content-Type": "application/json"}, json.dumps(payload).encode()
+
+
+class StandinServer:
+    """A tiny threaded HTTP server dispatching on (method, path prefix)."""
+
+    def __init__(self, routes: Dict[Tuple[str, str], Handler],
+                 host: str = "127.0.0.1", port: int = 0):
+        self.routes = routes
+        self.request_count = 0
+        # TCP connections accepted, to check that clients keep them alive
+        self.connection_count = 0
+        server = self
+
+        class _Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Headers and body go out in separate writes; without this a
+            # kept-alive client waits out a delayed ACK on every response
+            disable_nagle_algorithm = True
+
+            def setup(self):
+                server.connection_count += 1
+                super().setup()
+
+            def _dispatch(self):
+                url = urlparse(self.path)
+                length = int(self.headers.get("Content-Length") or 0)
+                request = Request(
+                    self.command,
+                    url.path,
+                    {k: v[-1] for k, v in parse_qs(url.query).items()},
+                    {k.lower(): v for k, v in self.headers.items()},
+                    self.rfile.read(length) if length else b"",
+                )
+                server.request_count += 1
+                status, headers, body = server.handle(request)
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            do_GET = do_POST = do_PUT = do_DELETE = _dispatch
+
+            def log_message(self, format, *args):
+                pass
+
+        self._httpd = ThreadingHTTPServer((host, port), _Handler)
+        self._httpd.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def handle(self, request: Request) -> Response:
+        # Longest matching prefix wins, so "/v2/cards/" beats "/v2/cards"
+        matches = [
+            (prefix, handler) for (method, prefix), handler in self.routes.items()
+            if method == request.method and request.path.startswith(prefix)
+        ]
+        if not matches:
+            return json_response({"error": "Not found"}, 404)
+        _, handler = max(matches, key=lambda m: len(m[0]))
+        return handler(request)
+
+    def start(self) -> "StandinServer":
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self) -> "StandinServer":
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def sample_cards(count: int, seed: int = 0) -> List[Dict[str, Any]]:
+    """Generate cards in the Pokemon TCG API (v2) format."""
+    rng = random.Random(seed)
+    cards = []
+    for i in range(count):
+        set_id, set_name, series, release_date = SETS[i % len(SETS)]
+        number = str(i // len(SETS) + 1)
+        market = round(rng.uniform(0.1, 300.0), 2)
+        cards.append({
+            "id": f"{set_id}-{number}",
+            "name": f"{NAMES[i % len(NAMES)]}" + ("" if i < len(NAMES) else f" {i // len(NAMES)}"),
+            "supertype": "Pokémon",
+            "types": [rng.choice(TYPES)],
+            "set": {"id": set_id, "name": set_name, "series": series, "releaseDate": release_date},
+            "number": number,
+            "artist": rng.choice(ARTISTS),
+            "rarity": rng.choice(RARITIES),
+            "images": {
+                "small": f"https://images.pokemontcg.io/{set_id}/{number}.png",
+                "large": f"https://images.pokemontcg.io/{set_id}/{number}_hires.png",
+            },
+            "tcgplayer": {
+                "updatedAt": "2024/01/01",
+                "prices": {"holofoil": {"market": market}},
+            },
+        })
+    return cards
+
+
+def _matches_query(card: Dict[str, Any], q: str) -> bool:
+    """Evaluate the subset of the Lucene-like query syntax the app uses."""
+    for term in q.split():
+        field, _, value = term.partition(":")
+        value = value.strip('"').lower()
+        actual = card.get(field, "")
+        if isinstance(actual, dict):
+            actual = actual.get("name", "")
+        actual = str(actual).lower()
+        if value.endswith("*"):
+            if not actual.startswith(value[:-1]):
+                return False
+        elif actual != value:
+            return False
+    return True
+
+
+def pokemontcg_routes(cards: List[Dict[str, Any]]) -> Dict[Tuple[str, str], Handler]:
+    """Routes mimicking ``GET /v2/cards`` and ``GET /v2/cards/{id}``."""
+    by_id = {card["id"]: card for card in cards}
+
+    def list_cards(request: Request) -> Response:
+        q = request.query.get("q", "")
+        matched = [card for card in cards if _matches_query(card, q)] if q else list(cards)
+        order_by = request.query.get("orderBy")
+        if order_by:
+            field = order_by.lstrip("-")
+            matched.sort(key=lambda c: str(c.get(field, "")), reverse=order_by.startswith("-"))
+        page = int(request.query.get("page", 1))
+        page_size = int(request.query.get("pageSize", 250))
+        start = (page - 1) * page_size
+        return json_response({
+            "data": matched[start:start + page_size],
+            "page": page,
+            "pageSize": page_size,
+            "count": len(matched[start:start + page_size]),
+            "totalCount": len(matched),
+        })
+
+    def get_card(request: Request) -> Response:
+        card = by_id.get(request.path.rsplit("/", 1)[-1])
+        if card is None:
+            return json_response({"error": "Not found"}, 404)
+        return json_response({"data": card})
+
+    return {
+        ("GET", "/v2/cards"): list_cards,
+        ("GET", "/v2/cards/"): get_card,
+    }
+
+
+def pokemontcg_server(cards: Optional[List[Dict[str, Any]]] = None, port: int = 0) -> StandinServer:
+    """A stand-in for api.pokemontcg.io; use ``server.url + '/v2'`` as the base URL."""
+    return StandinServer(pokemontcg_routes(cards if cards is not None else sample_cards(500)), port=port)
+
+
+def _synthetic_price(card_id: str) -> float:
+    """A stable made-up market price for a card the stand-in wasn't given."""
+    digest = hashlib.sha1(card_id.encode()).digest()
+    return round(0.1 + int.from_bytes(digest[:4], "big") % 30000 / 100, 2)
+
+
+def pricing_routes(prices: Optional[Dict[str, float]] = None, latency: float = 0.0,
+                   drift: float = 0.05, seed: int = 0) -> Dict[Tuple[str, str], Handler]:
+    """Routes mimicking TCGPlayer's ``GET /pricing/product/{ids}``.
+
+    ``ids`` is a comma-separated list; each known (or, without ``prices``,
+    any) id gets a Normal and a Holofoil result whose market price wanders
+    by up to ``drift`` from its base on every request. ``latency`` seconds
+    are slept per request to imitate a remote service.
+    """
+    rng = random.Random(seed)
+    lock = threading.Lock()
+
+    def product_pricing(request: Request) -> Response:
+        if latency:
+            time.sleep(latency)
+        ids = [i for i in request.path.rsplit("/", 1)[-1].split(",") if i]
+        results, errors = [], []
+        for product_id in ids:
+            base = prices.get(product_id) if prices is not None else _synthetic_price(product_id)
+            if base is None:
+                errors.append(f"No pricing for product {product_id}")
+                continue
+            with lock:
+                market = round(base * (1 + rng.uniform(-drift, drift)), 2)
+            if product_id.isdigit():
+                product_id = int(product_id)
+            results.append({"productId": product_id, "subTypeName": "Normal",
+                            "lowPrice": round(market * 0.4, 2), "midPrice": round(market * 0.5, 2),
+                            "highPrice": round(market * 0.8, 2), "marketPrice": round(market * 0.5, 2)})
+            results.append({"productId": product_id, "subTypeName": "Holofoil",
+                            "lowPrice": round(market * 0.8, 2), "midPrice": market,
+                            "highPrice": round(market * 1.6, 2), "marketPrice": market})
+        return json_response({"success": bool(results), "errors": errors, "results": results})
+
+    return {("GET", "/pricing/product/"): product_pricing}
+
+
+def _card_market_price(card: Dict[str, Any]) -> Optional[float]:
+    if "price" in card:
+        return card["price"]
+    for price in (card.get("tcgplayer") or {}).get("prices", {}).values():
+        if price.get("market") is not None:
+            return price["market"]
+    return None
+
+
+def pricing_server(cards: Optional[List[Dict[str, Any]]] = None, port: int = 0,
+                   latency: float = 0.0) -> StandinServer:
+    """A stand-in for TCGPlayer pricing; use ``server.url`` as the base URL.
+
+    Prices come from the cards' market prices when cards are given, and are
+    made up for any id otherwise.
+    """
+    prices = None
+    if cards is not None:
+        prices = {card["id"]: market for card in cards
+                  for market in [_card_market_price(card)] if market is not None}
+    return StandinServer(pricing_routes(prices, latency), port=port)
+
+
+def tcgplayer_catalog(cards: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """Convert Pokemon TCG API cards into TCGPlayer (products, groups)."""
+    groups: Dict[str, Dict[str, Any]] = {}
+    products = []
+    for i, card in enumerate(cards):
+        card_set = card.get("set") or {}
+        if card_set.get("id") not in groups:
+            groups[card_set.get("id")] = {
+                "groupId": 600 + len(groups),
+                "name": card_set.get("name", ""),
+                "abbreviation": (card_set.get("id") or "").upper(),
+                "isSupplemental": False,
+                "publishedOn": (card_set.get("releaseDate") or "2000/01/01").replace("/", "-") + "T00:00:00",
+                "modifiedOn": "2024-01-01T00:00:00",
+                "categoryId": 3,
+            }
+        group = groups[card_set.get("id")]
+        extended = [
+            ("Number", "Card Number", card.get("number", "")),
+            ("Rarity", "Rarity", card.get("rarity", "")),
+            ("Card Type", "Card Type", ", ".join(card.get("types") or [])),
+            ("Artist", "Artist", card.get("artist", "")),
+        ]
+        products.append({
+            "productId": 100000 + i,
+            "name": card.get("name", ""),
+            "cleanName": card.get("name", ""),
+            "imageUrl": (card.get("images") or {}).get("small", ""),
+            "categoryId": 3,
+            "groupId": group["groupId"],
+            "url": f"https://www.tcgplayer.com/product/{100000 + i}",
+            "modifiedOn": "2024-01-01T00:00:00",
+            "extendedData": [{"name": name, "displayName": display, "value": value}
+                             for name, display, value in extended],
+            "_price": _card_market_price(card),
+            # Copies sold recently, for the best-sellers sort; stable per card
+            "_sales": int.from_bytes(hashlib.sha1(str(card.get("id")).encode()).digest()[:2], "big"),
+        })
+    return products, list(groups.values())
+
+
+def tcgplayer_routes(cards: List[Dict[str, Any]], latency: float = 0.0,
+                     token_ttl: int = 14 * 24 * 60 * 60) -> Dict[Tuple[str, str], Handler]:
+    """Routes mimicking the TCGPlayer API: the token endpoint, catalog, category search and pricing.
+
+    Any client id and secret are accepted; tokens expire after ``token_ttl``
+    seconds and every other route answers 401 without a live bearer token.
+    """
+    products, groups = tcgplayer_catalog(cards)
+    by_id = {product["productId"]: product for product in products}
+    groups_by_id = {group["groupId"]: group for group in groups}
+    tokens: Dict[str, float] = {}
+    prices = {str(product["productId"]): product["_price"] for product in products
+              if product["_price"] is not None}
+    pricing = pricing_routes(prices, latency)[("GET", "/pricing/product/")]
+
+    def issue_token(request: Request) -> Response:
+        form = dict(parse_qsl(request.body.decode()))
+        if form.get("grant_type") != "client_credentials" or not form.get("client_id") \
+                or not form.get("client_secret"):
+            return json_response({"error": "invalid_grant"}, 400)
+        token = uuid.uuid4().hex
+        tokens[token] = time.time() + token_ttl
+        issued = datetime.utcnow()
+        return json_response({
+            "access_token": token,
+            "token_type": "bearer",
+            "expires_in": token_ttl,
+            "userName": form["client_id"],
+            ".issued": issued.strftime("%a, %d %b %Y %H:%M:%S GMT"),
+            ".expires": (issued + timedelta(seconds=token_ttl)).strftime("%a, %d %b %Y %H:%M:%S GMT"),
+        })
+
+    def authorized(handler: Handler) -> Handler:
+        def check(request: Request) -> Response:
+            scheme, _, token = request.headers.get("authorization", "").partition(" ")
+            if scheme.lower() != "bearer" or tokens.get(token, 0) < time.time():
+                return json_response({"Message": "Authorization has been denied for this request."}, 401)
+            return handler(request)
+        return check
+
+    def results(items: List[Dict[str, Any]], total: Optional[int] = None) -> Response:
+        if not items:
+            return json_response({"success": False, "errors": ["No products were found."], "results": []}, 404)
+        return json_response({"totalItems": len(items) if total is None else total,
+                              "success": True, "errors": [], "results": items})
+
+    def public(product: Dict[str, Any], extended: bool) -> Dict[str, Any]:
+        fields = {k: v for k, v in product.items() if not k.startswith("_")}
+        if not extended:
+            fields.pop("extendedData")
+        return fields
+
+    def ids_from_path(request: Request) -> List[int]:
+        return [int(i) for i in request.path.rsplit("/", 1)[-1].split(",") if i.isdigit()]
+
+    def list_products(request: Request) -> Response:
+        if latency:
+            time.sleep(latency)
+        name = request.query.get("productName", "").lower()
+        category = request.query.get("categoryId")
+        group = request.query.get("groupId")
+        matched = [p for p in products
+                   if name in p["name"].lower() and (not category or str(p["categoryId"]) == category)
+                   and (not group or str(p["groupId"]) == group)]
+        offset = int(request.query.get("offset", 0))
+        limit = min(int(request.query.get("limit", 10)), 100)
+        extended = request.query.get("getExtendedFields", "").lower() == "true"
+        return results([public(p, extended) for p in matched[offset:offset + limit]], len(matched))
+
+    def get_products(request: Request) -> Response:
+        if latency:
+            time.sleep(latency)
+        extended = request.query.get("getExtendedFields", "").lower() == "true"
+        return results([public(by_id[i], extended) for i in ids_from_path(request) if i in by_id])
+
+    def get_groups(request: Request) -> Response:
+        return results([groups_by_id[i] for i in ids_from_path(request) if i in groups_by_id])
+
+    def list_groups(request: Request) -> Response:
+        category = request.query.get("categoryId")
+        matched = [g for g in groups if not category or str(g["categoryId"]) == category]
+        matched.sort(key=lambda g: str(g.get(request.query.get("sortOrder", "name"), "")),
+                     reverse=request.query.get("sortDesc", "").lower() == "true")
+        offset = int(request.query.get("offset", 0))
+        limit = min(int(request.query.get("limit", 10)), 100)
+        return results(matched[offset:offset + limit], len(matched))
+
+    def search_category(request: Request) -> Response:
+        # POST /catalog/categories/{categoryId}/search; answers product ids only
+        category = request.path.split("/")[3]
+        body = request.json() or {}
+        matched = [p for p in products if str(p["categoryId"]) == category]
+        sort = body.get("sort", "Relevance")
+        if sort.startswith("MinPrice"):
+            matched.sort(key=lambda p: p["_price"] or 0, reverse=sort.endswith("DESC"))
+        elif sort.startswith("Sales"):
+            matched.sort(key=lambda p: p["_sales"], reverse=True)
+        elif sort.startswith("ProductName"):
+            matched.sort(key=lambda p: p["name"], reverse=sort.endswith("DESC"))
+        offset = int(body.get("offset", 0))
+        limit = min(int(body.get("limit", 10)), 100)
+        return results([p["productId"] for p in matched[offset:offset + limit]], len(matched))
+
+    return {
+        ("POST", "/token"): issue_token,
+        ("GET", "/catalog/products"): authorized(list_products),
+        ("GET", "/catalog/products/"): authorized(get_products),
+        ("GET", "/catalog/groups"): authorized(list_groups),
+        ("GET", "/catalog/groups/"): authorized(get_groups),
+        ("POST", "/catalog/categories/"): authorized(search_category),
+        ("GET", "/pricing/product/"): authorized(pricing),
+    }
+
+
+def tcgplayer_server(cards: Optional[List[Dict[str, Any]]] = None, port: int = 0,
+                     latency: float = 0.0, token_ttl: int = 14 * 24 * 60 * 60) -> StandinServer:
+    """A stand-in for api.tcgplayer.com; use ``server.url`` as the base URL.
+
+    Products are numbered from 100000 in the order of ``cards`` (500
+    generated cards by default).
+    """
+    routes = tcgplayer_routes(cards if cards is not None else sample_cards(500), latency, token_ttl)
+    return StandinServer(routes, port=port)
+
+
+# Pixel sizes of the card images on images.pokemontcg.io
+IMAGE_SIZE = (245, 342)
+HIRES_IMAGE_SIZE = (734, 1024)
+
+
+def _png(width: int, height: int, color: Tuple[int, int, int]) -> bytes:
+    """A solid-colour RGB PNG, written without any imaging library."""
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    row = b"\x00" + bytes(color) * width
+    return (b"\x89PNG\r\n\x1a\n"
+            + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(row * height))
+            + chunk(b"IEND", b""))
+
+
+def image_routes(latency: float = 0.0) -> Dict[Tuple[str, str], Handler]:
+    """Card images at any ``/<set>/<number>.png`` (or ``_hires.png``) path.
+
+    Each path gets its own colour, so different cards have different bytes
+    and the same card always has the same ones.
+    """
+    def card_image(request: Request) -> Response:
+        if not request.path.endswith(".png"):
+            return json_response({"error": "Not found"}, 404)
+        if latency:
+            time.sleep(latency)
+        size = HIRES_IMAGE_SIZE if request.path.endswith("_hires.png") else IMAGE_SIZE
+        color = tuple(hashlib.sha256(request.path.encode()).digest()[:3])
+        return 200, {"Content-Type": "image/png"}, _png(size[0], size[1], color)
+
+    return {("GET", "/"): card_image}
+
+
+def image_server(port: int = 0, latency: float = 0.0) -> StandinServer:
+    """A stand-in for images.pokemontcg.io; card image URLs go under ``server.url``."""
+    return StandinServer(image_routes(latency), port=port)
+
+
+SERVERS = {
+    "pokemontcg": pokemontcg_server,
+    "pricing": pricing_server,
+    "tcgplayer": tcgplayer_server,
+    "images": image_server,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a local stand-in for an upstream API")
+    parser.add_argument("service", choices=sorted(SERVERS))
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--cards", help="JSON file of cards to serve instead of generated ones")
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="Seconds to wait before answering each pricing or image request")
+    args = parser.parse_args()
+
+    kwargs = {"port": args.port}
+    if args.service in ("pricing", "tcgplayer", "images"):
+        kwargs["latency"] = args.latency
+    if args.cards and args.service != "images":
+        with open(args.cards, encoding="utf-8") as f:
+            payload = json.load(f)
+        kwargs["cards"] = payload["data"] if isinstance(payload, dict) else payload
+    server = SERVERS[args.service](**kwargs)
+    print(f"{args.service} stand-in listening on {server.url}")
+    try:
+        server._httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
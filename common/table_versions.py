@@ -0,0 +1,23 @@
+"""Per-table change counters maintained by triggers.
+
+Triggers (created by each service's migrations) make every insert,
+update and delete on a tracked table bump that table's row in
+``table_versions``, whichever code path (or process) made the change,
+so reading one small row tells a reader whether anything it rendered
+earlier is out of date. Counters start from the time the table
+was first tracked rather than 0, so a recreated database does not hand
+out versions a client has already seen.
+"""
+import sqlite3
+from typing import Dict, Sequence
+
+
+def versions_query(tables: Sequence[str]) -> str:
+    placeholders = ', '.join('?' for _ in tables)
+    return f'SELECT name, version FROM table_versions WHERE name IN ({placeholders})'
+
+
+def get_versions(conn: sqlite3.Connection, tables: Sequence[str]) -> Dict[str, int]:
+    """The current version of each of ``tables`` (0 for untracked ones)."""
+    found = dict(conn.execute(versions_query(tables), list(tables)).fetchall())
+    return {table: found.get(table, 0) for table in tables}
@@ -4,15 +4,46 @@ let searchResults = [];
 let collection = [];
 let wishlist = [];
 let backendStatus = false;
+let changeStream = null;
 
 // Backend API URL
 const API_URL = 'http://localhost:8000';
 
+// Each browser keeps its own collection when the backend stores one per
+// user (POKETRACK_SHARD_DIR); the id is made up once and kept
+const USER_ID = localStorage.getItem('poketrack-user-id') || createUserId();
+
+function createUserId() {
+    const id = 'user-' + Date.now().toString(36) + Math.random().toString(36).slice(2, 10);
+    localStorage.setItem('poketrack-user-id', id);
+    return id;
+}
+
+// fetch() from the backend as this browser's user
+function apiFetch(path, options = {}) {
+    return fetch(`${API_URL}${path}`, {
+        ...options,
+        headers: { ...options.headers, 'X-User-Id': USER_ID }
+    });
+}
+
+// Card tiles show the backend's thumbnail of this width (one of POKETRACK_IMAGE_THUMBNAIL_WIDTHS)
+const TILE_IMAGE_WIDTH = 320;
+
+// Card images are loaded through the backend's image cache rather than from
+// the image host; without a width the full-size image is returned
+function imageSrc(url, width) {
+    if (!url) return '';
+    const params = new URLSearchParams({ url });
+    if (width) params.set('w', width);
+    return `${API_URL}/images?${params}`;
+}
+
 // Initialize the application
 async function init() {
-    // Check backend status
+    // Check backend status, then follow it (and every change) over the event stream
     checkBackendStatus();
-    setInterval(checkBackendStatus, 30000); // Check every 30 seconds
+    subscribeToChanges();
 
     // Load collection and wishlist
     await Promise.all([
@@ -35,7 +66,7 @@ async function init() {
 // Check backend status
 async function checkBackendStatus() {
     try {
-        const response = await fetch(`${API_URL}/health`);
+        const response = await apiFetch(`/health`);
         backendStatus = response.ok;
         updateBackendStatus();
     } catch (error) {
@@ -44,6 +75,67 @@ async function checkBackendStatus() {
     }
 }
 
+// Subscribe to the backend's change events instead of polling for them
+function subscribeToChanges() {
+    // EventSource cannot send headers, so the user goes in the query string
+    changeStream = new EventSource(`${API_URL}/events?${new URLSearchParams({ user: USER_ID })}`);
+
+    // EventSource reconnects by itself, so the stream doubles as the status check
+    changeStream.onopen = () => {
+        backendStatus = true;
+        updateBackendStatus();
+    };
+    changeStream.onerror = () => {
+        backendStatus = false;
+        updateBackendStatus();
+    };
+
+    changeStream.addEventListener('cards_changed', event => {
+        const change = JSON.parse(event.data);
+        if (change.list === 'collection') {
+            collection = applyCardChanges(collection, change);
+            renderCollection();
+        } else if (change.list === 'wishlist') {
+            wishlist = applyCardChanges(wishlist, change);
+            renderWishlist();
+        }
+    });
+
+    changeStream.addEventListener('prices_updated', event => {
+        const { prices } = JSON.parse(event.data);
+        const reprice = card => card.id in prices ? { ...card, price: prices[card.id] } : card;
+        collection = collection.map(reprice);
+        wishlist = wishlist.map(reprice);
+        renderCollection();
+        renderWishlist();
+    });
+
+    // Sent when events were missed (a long disconnect or a restart): reload once
+    changeStream.addEventListener('resync', () => {
+        loadCollection();
+        loadWishlist();
+    });
+}
+
+// Whether the event stream is keeping collection and wishlist up to date
+function liveUpdates() {
+    return changeStream !== null && changeStream.readyState === EventSource.OPEN;
+}
+
+// Merge a cards_changed event into a list of cards
+function applyCardChanges(cards, change) {
+    if (change.cleared) {
+        return [];
+    }
+    const changed = new Map(change.cards.map(card => [card.id, card]));
+    const removed = new Set(change.removed);
+    const updated = cards
+        .filter(card => !removed.has(card.id))
+        .map(card => changed.get(card.id) || card);
+    const known = new Set(updated.map(card => card.id));
+    return updated.concat(change.cards.filter(card => !known.has(card.id)));
+}
+
 // Update backend status indicator
 function updateBackendStatus() {
     const statusElement = document.getElementById('backend-status');
@@ -59,7 +151,7 @@ function updateBackendStatus() {
 // Initialize filters
 async function initializeFilters() {
     try {
-        const response = await fetch(`${API_URL}/sets`);
+        const response = await apiFetch(`/sets`);
         const sets = await response.json();
         const setFilter = document.getElementById('set-filter');
         
@@ -98,7 +190,7 @@ async function handleSearch(event) {
     const sortBy = document.getElementById('sort-by').value;
     
     try {
-        const response = await fetch(`${API_URL}/search`, {
+        const response = await apiFetch(`/search`, {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json'
@@ -176,7 +268,7 @@ function displayCards(cards, containerId) {
             ${cards.map(card => `
                 <div class="col">
                     <div class="card pokemon-card h-100">
-                        <img src="${card.image}" class="card-img-top" alt="${card.name}">
+                        <img src="${imageSrc(card.image, TILE_IMAGE_WIDTH)}" class="card-img-top" alt="${card.name}" loading="lazy">
                         <button class="wishlist-btn" onclick="toggleWishlist('${card.id}')">
                             <i class="fas fa-gift"></i>
                         </button>
@@ -212,7 +304,7 @@ function displayCards(cards, containerId) {
 // Show card details in modal
 async function showCardDetails(cardId) {
     try {
-        const response = await fetch(`${API_URL}/cards/${cardId}`);
+        const response = await apiFetch(`/cards/${cardId}`);
         const card = await response.json();
         
         const modal = document.getElementById('modal');
@@ -223,7 +315,7 @@ async function showCardDetails(cardId) {
         modalBody.innerHTML = `
             <div class="row">
                 <div class="col-md-6">
-                    <img src="${card.image}" class="img-fluid rounded" alt="${card.name}">
+                    <img src="${imageSrc(card.image)}" class="img-fluid rounded" alt="${card.name}">
                 </div>
                 <div class="col-md-6">
                     <div class="mb-4">
@@ -289,12 +381,14 @@ function closeModal() {
 // Add card to collection
 async function addToCollection(cardId) {
     try {
-        const response = await fetch(`${API_URL}/collection/${cardId}`, {
+        const response = await apiFetch(`/collection/${cardId}`, {
             method: 'POST'
         });
         
         if (response.ok) {
-            await loadCollection();
+            if (!liveUpdates()) {
+                await loadCollection();
+            }
             showSuccess('Card added to collection!');
             closeModal();
         } else {
@@ -311,12 +405,14 @@ async function toggleWishlist(cardId) {
     const isInWishlist = wishlist.find(card => card.id === cardId);
     
     try {
-        const response = await fetch(`${API_URL}/wishlist/${cardId}`, {
+        const response = await apiFetch(`/wishlist/${cardId}`, {
             method: isInWishlist ? 'DELETE' : 'POST'
         });
         
         if (response.ok) {
-            await loadWishlist();
+            if (!liveUpdates()) {
+                await loadWishlist();
+            }
             showSuccess(isInWishlist ? 'Card removed from wishlist!' : 'Card added to wishlist!');
         } else {
             throw new Error('Failed to update wishlist');
@@ -330,12 +426,14 @@ async function toggleWishlist(cardId) {
 // Remove card from wishlist
 async function removeFromWishlist(cardId) {
     try {
-        const response = await fetch(`${API_URL}/wishlist/${cardId}`, {
+        const response = await apiFetch(`/wishlist/${cardId}`, {
             method: 'DELETE'
         });
         
         if (response.ok) {
-            await loadWishlist();
+            if (!liveUpdates()) {
+                await loadWishlist();
+            }
             showSuccess('Card removed from wishlist!');
         } else {
             throw new Error('Failed to remove card from wishlist');
@@ -349,36 +447,44 @@ async function removeFromWishlist(cardId) {
 // Load collection
 async function loadCollection() {
     try {
-        const response = await fetch(`${API_URL}/collection`);
+        const response = await apiFetch(`/collection`);
         collection = await response.json();
-        
-        if (currentView === 'collection') {
-            const sortBy = document.getElementById('collection-sort-by').value;
-            sortAndDisplayCards(collection, 'collection-cards', sortBy);
-            updateStats();
-        }
+        renderCollection();
     } catch (error) {
         console.error('Error loading collection:', error);
         showError('Failed to load collection. Please try again.');
     }
 }
 
+// Show the collection, if it is the current view
+function renderCollection() {
+    if (currentView === 'collection') {
+        const sortBy = document.getElementById('collection-sort-by').value;
+        sortAndDisplayCards(collection, 'collection-cards', sortBy);
+        updateStats();
+    }
+}
+
 // Load wishlist
 async function loadWishlist() {
     try {
-        const response = await fetch(`${API_URL}/wishlist`);
+        const response = await apiFetch(`/wishlist`);
         wishlist = await response.json();
-        
-        if (currentView === 'wishlist') {
-            const sortBy = document.getElementById('wishlist-sort-by').value;
-            sortAndDisplayCards(wishlist, 'wishlist-cards', sortBy);
-        }
+        renderWishlist();
     } catch (error) {
         console.error('Error loading wishlist:', error);
         showError('Failed to load wishlist. Please try again.');
     }
 }
 
+// Show the wishlist, if it is the current view
+function renderWishlist() {
+    if (currentView === 'wishlist') {
+        const sortBy = document.getElementById('wishlist-sort-by').value;
+        sortAndDisplayCards(wishlist, 'wishlist-cards', sortBy);
+    }
+}
+
 // Show view
 function showView(view) {
     // Update navigation
@@ -397,13 +503,13 @@ function showView(view) {
     
     currentView = view;
     
-    // Load view-specific data
+    // Load view-specific data; while the event stream is open the lists are already current
     switch (view) {
         case 'collection':
-            loadCollection();
+            liveUpdates() ? renderCollection() : loadCollection();
             break;
         case 'wishlist':
-            loadWishlist();
+            liveUpdates() ? renderWishlist() : loadWishlist();
             break;
         case 'stats':
             updateStats();
@@ -604,7 +710,7 @@ function updateValuableCards() {
 // Load discover view
 async function loadDiscover() {
     try {
-        const response = await fetch(`${API_URL}/discover`);
+        const response = await apiFetch(`/discover`);
         const data = await response.json();
         
         const discoverView = document.getElementById('discover-view');
@@ -618,7 +724,7 @@ async function loadDiscover() {
                     ${data.featured.map(card => `
                         <div class="col">
                             <div class="card pokemon-card h-100">
-                                <img src="${card.image}" class="card-img-top" alt="${card.name}">
+                                <img src="${imageSrc(card.image, TILE_IMAGE_WIDTH)}" class="card-img-top" alt="${card.name}" loading="lazy">
                                 <button class="wishlist-btn" onclick="toggleWishlist('${card.id}')">
                                     <i class="fas fa-gift"></i>
                                 </button>
@@ -649,7 +755,7 @@ async function loadDiscover() {
                     ${data.newReleases.map(card => `
                         <div class="col">
                             <div class="card pokemon-card h-100">
-                                <img src="${card.image}" class="card-img-top" alt="${card.name}">
+                                <img src="${imageSrc(card.image, TILE_IMAGE_WIDTH)}" class="card-img-top" alt="${card.name}" loading="lazy">
                                 <button class="wishlist-btn" onclick="toggleWishlist('${card.id}')">
                                     <i class="fas fa-gift"></i>
                                 </button>
@@ -680,7 +786,7 @@ async function loadDiscover() {
                     ${data.trending.map(card => `
                         <div class="col">
                             <div class="card pokemon-card h-100">
-                                <img src="${card.image}" class="card-img-top" alt="${card.name}">
+                                <img src="${imageSrc(card.image, TILE_IMAGE_WIDTH)}" class="card-img-top" alt="${card.name}" loading="lazy">
                                 <button class="wishlist-btn" onclick="toggleWishlist('${card.id}')">
                                     <i class="fas fa-gift"></i>
                                 </button>
@@ -0,0 +1,18 @@
+"""Test setup shared by every test module.
+
+The services are flat modules run from their own directories, so each
+test module puts its service's directory on sys.path itself. Settings are
+read from the environment on import, so the databases and caches they
+point at are moved to a scratch directory before anything is imported.
+"""
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+_scratch = tempfile.mkdtemp(prefix="poketrack-tests-")
+os.environ.setdefault("POKETRACK_DB_PATH", os.path.join(_scratch, "pokemon_cards.db"))
+os.environ.setdefault("POKETRACK_CATALOG_DB_PATH", os.path.join(_scratch, "catalog.db"))
+os.environ.setdefault("POKETRACK_IMAGE_CACHE_DIR", os.path.join(_scratch, "image_cache"))
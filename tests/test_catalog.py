@@ -0,0 +1,35 @@
+"""Searches of the local catalog mirror (common/catalog.py)."""
+import sqlite3
+
+import pytest
+
+from common import catalog
+from common.standin import sample_cards
+
+CARDS = sample_cards(300)
+
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(":memory:")
+    catalog.init_catalog(conn)
+    catalog.sync(conn, CARDS)
+    yield conn
+    conn.close()
+
+
+def test_search_matches_name_prefixes(conn):
+    name = CARDS[0]["name"]
+    expected = sorted(card["id"] for card in CARDS if card["name"].lower().startswith(name[:3].lower()))
+
+    found = catalog.search(conn, name[:3], limit=len(CARDS))
+
+    assert sorted(card["id"] for card in found) == expected
+
+
+def test_search_ignores_types_and_artists(conn):
+    card_type = CARDS[0]["types"][0]
+    artist = CARDS[0]["artist"].split()[0]
+
+    assert catalog.search(conn, card_type, limit=len(CARDS)) == []
+    assert catalog.search(conn, artist, limit=len(CARDS)) == []
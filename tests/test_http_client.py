@@ -0,0 +1,102 @@
+"""AsyncHTTPClient against the local Pokemon TCG API stand-in (common.standin)."""
+import asyncio
+import threading
+import time
+
+import pytest
+
+from common.http_client import AsyncHTTPClient, UpstreamError
+from common.standin import StandinServer, json_response, pokemontcg_routes, sample_cards
+
+CARDS = sample_cards(50)
+
+
+@pytest.fixture
+def upstream():
+    in_flight = {"now": 0, "most": 0}
+    lock = threading.Lock()
+
+    def slow(request):
+        with lock:
+            in_flight["now"] += 1
+            in_flight["most"] = max(in_flight["most"], in_flight["now"])
+        time.sleep(float(request.query.get("seconds", "0.2")))
+        with lock:
+            in_flight["now"] -= 1
+        return json_response({"slow": True})
+
+    routes = {
+        **pokemontcg_routes(CARDS),
+        ("GET", "/slow"): slow,
+        ("GET", "/broken"): lambda request: json_response({"error": "Upstream is down"}, 503),
+    }
+    with StandinServer(routes) as server:
+        server.in_flight = in_flight
+        yield server
+
+
+def run(client, *calls):
+    """Run ``calls`` (coroutine functions of the client) concurrently, then close the client."""
+    async def main():
+        try:
+            return await asyncio.gather(*(call(client) for call in calls), return_exceptions=True)
+        finally:
+            await client.aclose()
+    return asyncio.run(main())
+
+
+def test_requests_reuse_one_kept_alive_connection(upstream):
+    client = AsyncHTTPClient(upstream.url + "/v2")
+
+    async def searches(client):
+        return [await client.get_json("/cards", params={"q": f"name:{card['name']}*"}) for card in CARDS[:10]]
+
+    [results] = run(client, searches)
+
+    assert [result["data"][0]["name"] for result in results] == [card["name"] for card in CARDS[:10]]
+    assert upstream.request_count == 10
+    assert upstream.connection_count == 1
+
+
+def test_read_timeout_raises_upstream_error_and_the_retry_succeeds(upstream):
+    client = AsyncHTTPClient(upstream.url, read_timeout=0.1)
+
+    async def timed_out_then_retried(client):
+        with pytest.raises(UpstreamError) as error:
+            await client.get_json("/slow", params={"seconds": "0.5"})
+        assert "Timeout" in str(error.value)
+        assert error.value.status_code is None
+        return await client.get_json("/slow", params={"seconds": "0"})
+
+    [result] = run(client, timed_out_then_retried)
+
+    assert result == {"slow": True}
+
+
+def test_http_errors_carry_the_upstream_status(upstream):
+    client = AsyncHTTPClient(upstream.url)
+
+    [error] = run(client, lambda client: client.get_json("/broken"))
+
+    assert isinstance(error, UpstreamError)
+    assert error.status_code == 503
+
+
+def test_connection_refused_raises_upstream_error():
+    with StandinServer({}) as server:
+        url = server.url
+    client = AsyncHTTPClient(url, connect_timeout=0.5)
+
+    [error] = run(client, lambda client: client.get_json("/anything"))
+
+    assert isinstance(error, UpstreamError)
+    assert error.status_code is None
+
+
+def test_concurrency_is_bounded(upstream):
+    client = AsyncHTTPClient(upstream.url, max_concurrency=2)
+
+    results = run(client, *[lambda client: client.get_json("/slow", params={"seconds": "0.1"})] * 6)
+
+    assert results == [{"slow": True}] * 6
+    assert upstream.in_flight["most"] == 2
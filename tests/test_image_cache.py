@@ -0,0 +1,116 @@
+"""ImageCache against the local image host stand-in (common.standin)."""
+import asyncio
+import io
+import os
+
+import pytest
+import requests
+
+from common.image_cache import ImageCache, ImageError, image_response
+from common.standin import IMAGE_SIZE, image_server
+
+
+@pytest.fixture(scope="module")
+def host():
+    with image_server() as server:
+        yield server
+
+
+def make_cache(root, **kwargs) -> ImageCache:
+    kwargs.setdefault("hosts", ["127.0.0.1"])
+    return ImageCache(root=str(root), **kwargs)
+
+
+def read(image) -> bytes:
+    with image.file:
+        return image.file.read()
+
+
+def send_response(response) -> bytes:
+    """Run an ASGI response and return the body it sends."""
+    body = bytearray()
+
+    async def send(message):
+        body.extend(message.get("body", b""))
+
+    asyncio.run(response({"type": "http", "extensions": {}}, None, send))
+    return bytes(body)
+
+
+def test_miss_then_store_then_hit(host, tmp_path):
+    cache = make_cache(tmp_path)
+    url = f"{host.url}/base1/4.png"
+
+    first = cache.get(url)
+    assert read(first) == requests.get(url).content
+    assert (cache.misses, cache.hits, cache.downloads) == (1, 0, 1)
+
+    second = cache.get(url)
+    assert second.path == first.path
+    assert second.etag == first.etag
+    assert read(second) == requests.get(url).content
+    assert (cache.misses, cache.hits, cache.downloads) == (1, 1, 1)
+
+    # The index and files outlive the process
+    assert read(make_cache(tmp_path).get(url)) == requests.get(url).content
+    cache.close()
+
+
+def test_conditional_request_is_answered_without_the_file(host, tmp_path):
+    cache = make_cache(tmp_path)
+    image = cache.get(f"{host.url}/base1/5.png")
+
+    response = image_response(image, image.etag)
+
+    assert response.status_code == 304
+    assert image.file.closed
+
+
+def test_thumbnails_are_made_once_per_width(host, tmp_path):
+    Image = pytest.importorskip("PIL.Image")
+    cache = make_cache(tmp_path, widths=(160,))
+    url = f"{host.url}/base1/6.png"
+
+    with Image.open(io.BytesIO(read(cache.get(url, 160)))) as thumbnail:
+        assert thumbnail.size == (160, round(IMAGE_SIZE[1] * 160 / IMAGE_SIZE[0]))
+    read(cache.get(url, 160))
+    read(cache.get(url))
+
+    assert cache.thumbnails == 1
+    assert cache.downloads == 1
+    with pytest.raises(ImageError) as error:
+        cache.get(url, 999)
+    assert error.value.status_code == 400
+
+
+def test_least_recently_served_images_are_evicted(host, tmp_path):
+    size = len(requests.get(f"{host.url}/base1/1.png").content)
+    cache = make_cache(tmp_path, max_bytes=int(size * 2.5))
+    urls = [f"{host.url}/base1/{number}.png" for number in range(1, 5)]
+
+    read(cache.get(urls[0]))
+    read(cache.get(urls[1]))
+    read(cache.get(urls[0]))  # Now the most recently served
+    read(cache.get(urls[2]))
+
+    stats = cache.stats()
+    assert stats["bytes"] <= stats["max_bytes"]
+    assert stats["evictions"] == 1
+    assert cache.downloads == 3
+    read(cache.get(urls[0]))
+    assert cache.downloads == 3
+    read(cache.get(urls[1]))
+    assert cache.downloads == 4
+
+
+def test_an_image_evicted_while_it_is_served_is_sent_in_full(host, tmp_path):
+    url = f"{host.url}/base1/7.png"
+    expected = requests.get(url).content
+    cache = make_cache(tmp_path, max_bytes=len(expected) + 1)
+
+    image = cache.get(url)
+    read(cache.get(f"{host.url}/base1/8.png"))
+    assert not os.path.exists(image.path)
+
+    assert send_response(image_response(image, None)) == expected
+    assert image.file.closed
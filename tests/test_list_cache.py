@@ -0,0 +1,59 @@
+"""ListCache orderings against the SQL they stand in for."""
+import sqlite3
+
+from common.list_cache import ListCache, Record
+
+
+class Card(Record):
+    __slots__ = ('id', 'name', 'price')
+
+
+SORT_KEYS = {
+    'name': lambda card: card.name if card.name is not None else '',
+    'price': lambda card: card.price if card.price is not None else 0,
+}
+
+ROWS = [
+    ('a', 'Pikachu', 3.5),
+    ('b', 'Eevee', None),
+    ('c', 'Mew', 'n/a'),
+    ('d', 'Ditto', 12),
+    ('e', 'Snorlax', '0.5'),  # Numeric text; the REAL column stores it as a number
+    ('f', 'Onix', 'call'),
+    ('g', 'Abra', 3.5),
+]
+
+
+def sql_listing():
+    conn = sqlite3.connect(':memory:')
+    conn.execute('CREATE TABLE cards (id TEXT PRIMARY KEY, name TEXT, price REAL)')
+    conn.executemany('INSERT INTO cards VALUES (?, ?, ?)', ROWS)
+    rows = conn.execute('SELECT id, name, price FROM cards ORDER BY rowid').fetchall()
+    order = [row[0] for row in conn.execute('SELECT id FROM cards ORDER BY IFNULL(price, 0), id')]
+    return rows, order
+
+
+def test_mixed_type_prices_sort_like_sql():
+    rows, order = sql_listing()
+    cache = ListCache(Card, SORT_KEYS, {})
+    cache.load(rows, 1)
+
+    ids = [card['id'] for card in cache.cards(sort='price')]
+
+    assert ids == order
+
+
+def test_pages_walk_mixed_type_prices_in_order():
+    rows, order = sql_listing()
+    cache = ListCache(Card, SORT_KEYS, {})
+    cache.load(rows, 1)
+
+    for direction, expected in (('asc', order), ('desc', order[::-1])):
+        seen, cursor = [], None
+        while True:
+            page = cache.page('price', direction, 2, cursor)
+            seen += [card['id'] for card in page['items']]
+            cursor = page['next_cursor']
+            if cursor is None:
+                break
+        assert seen == expected
@@ -0,0 +1,156 @@
+"""The backend's price refresher (backend/price_refresh.py) against the TCGPlayer stand-in."""
+import importlib
+import os
+import sys
+import threading
+
+import pytest
+
+from common.shards import ShardRouter
+from common.standin import StandinServer, json_response, sample_cards, tcgplayer_routes
+
+BACKEND = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend")
+
+# api_server has modules of the same names, imported by other test modules
+BACKEND_MODULES = ("database", "migrations", "price_refresh")
+
+CARDS = sample_cards(30)
+# The stand-in numbers products from 100000 in card order
+PRODUCT_IDS = [str(100000 + i) for i in range(len(CARDS))]
+# Two users sharing the middle third of the cards
+HOLDINGS = {
+    "ash": {"collection": PRODUCT_IDS[:20], "wishlist": []},
+    "misty": {"collection": PRODUCT_IDS[10:25], "wishlist": PRODUCT_IDS[25:]},
+}
+BATCH_SIZE = 10
+
+
+@pytest.fixture
+def price_refresh(monkeypatch):
+    saved = {name: sys.modules.pop(name) for name in BACKEND_MODULES if name in sys.modules}
+    monkeypatch.syspath_prepend(BACKEND)
+    try:
+        yield importlib.import_module("price_refresh")
+    finally:
+        for name in BACKEND_MODULES:
+            sys.modules.pop(name, None)
+        sys.modules.update(saved)
+
+
+@pytest.fixture
+def upstream():
+    """A TCGPlayer stand-in recording the ids of every pricing request.
+
+    A request naming any id in ``server.failing`` is answered 503.
+    """
+    routes = tcgplayer_routes(CARDS)
+    pricing = routes[("GET", "/pricing/product/")]
+    lock = threading.Lock()
+
+    def product_pricing(request):
+        ids = request.path.rsplit("/", 1)[-1].split(",")
+        with lock:
+            server.batches.append(ids)
+        if server.failing.intersection(ids):
+            return json_response({"success": False, "errors": ["Service unavailable"], "results": []}, 503)
+        return pricing(request)
+
+    routes[("GET", "/pricing/product/")] = product_pricing
+    server = StandinServer(routes)
+    server.batches = []
+    server.failing = set()
+    with server:
+        yield server
+
+
+def as_tracked(product_id):
+    card = CARDS[int(product_id) - 100000]
+    return {"id": product_id, "name": card["name"], "set": card["set"]["name"], "number": card["number"],
+            "rarity": card["rarity"], "type": card["types"][0], "price": 1.0,
+            "image": card["images"]["small"], "artist": card["artist"], "releaseDate": card["set"]["releaseDate"]}
+
+
+@pytest.fixture
+def shards(price_refresh, tmp_path):
+    router = ShardRouter(price_refresh.Database, price_refresh.Database.close, root=str(tmp_path / "shards"))
+    for user_id, lists in HOLDINGS.items():
+        with router.use(user_id) as db:
+            db.add_many_to_collection([as_tracked(card_id) for card_id in lists["collection"]])
+            db.add_many_to_wishlist([as_tracked(card_id) for card_id in lists["wishlist"]])
+    yield router
+    router.close_all()
+
+
+@pytest.fixture
+def refresher(price_refresh, upstream, shards):
+    client = price_refresh.TCGPlayerAPI(base_url=upstream.url, public_key="public", private_key="private",
+                                        batch_size=BATCH_SIZE)
+    updates = []
+    lock = threading.Lock()
+
+    def on_update(prices, user_id):
+        with lock:
+            updates.append((user_id, prices))
+
+    refresher = price_refresh.PriceRefresher(shards, fetch_prices=client.get_prices, batch_size=BATCH_SIZE,
+                                             workers=2, interval=0, on_update=on_update)
+    refresher.updates = updates
+    yield refresher
+    refresher.stop()
+    client.close()
+
+
+def tracked_prices(shards, user_id):
+    with shards.use(user_id) as db:
+        return {card["id"]: card["price"] for card in db.get_collection() + db.get_wishlist()}
+
+
+def test_every_card_is_looked_up_once_in_batches(refresher, upstream):
+    cycle = refresher.refresh_once()
+
+    assert cycle["cards"] == len(PRODUCT_IDS)
+    assert cycle["batches"] == len(PRODUCT_IDS) // BATCH_SIZE
+    assert cycle["cards_refreshed"] == len(PRODUCT_IDS)
+    assert cycle["cards_failed"] == cycle["batches_failed"] == 0
+    # One request per batch, and cards both users track are asked for once
+    assert len(upstream.batches) == cycle["batches"]
+    assert all(len(batch) <= BATCH_SIZE for batch in upstream.batches)
+    requested = [card_id for batch in upstream.batches for card_id in batch]
+    assert sorted(requested) == PRODUCT_IDS
+
+
+def test_prices_are_written_back_to_each_user(refresher, shards):
+    refresher.refresh_once()
+
+    reported = {}
+    for user_id, prices in refresher.updates:
+        reported.setdefault(user_id, {}).update(prices)
+    for user_id, lists in HOLDINGS.items():
+        tracked = lists["collection"] + lists["wishlist"]
+        # on_update hears only about the user's own cards, and the database agrees with it
+        assert sorted(reported[user_id]) == sorted(tracked)
+        assert tracked_prices(shards, user_id) == reported[user_id]
+        assert all(price != 1.0 for price in reported[user_id].values())
+        with shards.use(user_id) as db:
+            assert len(db.get_price_history(tracked[0])) == 2
+
+
+def test_failed_batches_are_counted_and_leave_prices_alone(refresher, upstream, shards):
+    upstream.failing.add("100027")
+    cycle = refresher.refresh_once()
+
+    failed = next(batch for batch in upstream.batches if "100027" in batch)
+    assert cycle["batches_failed"] == 1
+    assert cycle["cards_failed"] == len(failed)
+    assert cycle["cards_refreshed"] == len(PRODUCT_IDS) - len(failed)
+    assert all(card_id not in prices for _, prices in refresher.updates for card_id in failed)
+    misty = tracked_prices(shards, "misty")
+    assert all(misty[card_id] == 1.0 for card_id in failed if card_id in misty)
+
+    stats = refresher.stats()
+    assert stats["cycles"] == 1
+    assert stats["batches_failed"] == 1
+    assert stats["cards_failed"] == len(failed)
+    # Counted per user: a card two users track is two tracked cards
+    assert stats["tracked_cards"] == sum(len(lists["collection"] + lists["wishlist"])
+                                         for lists in HOLDINGS.values())
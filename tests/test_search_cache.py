@@ -0,0 +1,17 @@
+"""Cache keys for upstream searches (common/search_cache.py)."""
+from common.search_cache import search_key
+
+
+def test_query_is_case_folded_and_whitespace_collapsed():
+    assert search_key("  Pika   CHU ") == search_key("pika chu")
+
+
+def test_filters_keep_their_case():
+    assert search_key("", set="Base") != search_key("", set="base")
+    assert search_key("", rarity="Rare Holo") != search_key("", rarity="rare holo")
+    # Page cursors are base64, where case matters
+    assert search_key("", cursor="aGVsbG8=") != search_key("", cursor="AGVSBG8=")
+
+
+def test_empty_filters_are_dropped_and_numbers_normalised():
+    assert search_key("x", set="", rarity=None, limit=20) == search_key("x", limit=20.0)
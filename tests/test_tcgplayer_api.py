@@ -0,0 +1,120 @@
+"""TCGPlayerAPI against the local TCGPlayer stand-in (common.standin)."""
+import os
+import sys
+from collections import Counter
+from datetime import datetime
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend"))
+
+from api import DISCOVER_SIZE, TCGPlayerAPI  # noqa: E402
+from common.standin import StandinServer, sample_cards, tcgplayer_routes  # noqa: E402
+
+CARDS = sample_cards(60)
+# The stand-in numbers products from 100000 in card order
+PRODUCT_IDS = [str(100000 + i) for i in range(len(CARDS))]
+
+
+@pytest.fixture
+def upstream():
+    """A TCGPlayer stand-in that counts the requests made to each route."""
+    calls = Counter()
+
+    def counted(prefix, handler):
+        def handle(request):
+            calls[prefix] += 1
+            return handler(request)
+        return handle
+
+    server = StandinServer({route: counted(route[1], handler)
+                            for route, handler in tcgplayer_routes(CARDS).items()})
+    server.calls = calls
+    with server:
+        yield server
+
+
+@pytest.fixture
+def client(upstream):
+    client = TCGPlayerAPI(base_url=upstream.url, public_key="public", private_key="private", batch_size=25)
+    yield client
+    client.close()
+
+
+def test_token_is_reused_until_it_expires(client, upstream):
+    client.get_prices(PRODUCT_IDS[:5])
+    client.get_prices(PRODUCT_IDS[5:10])
+    assert upstream.calls["/token"] == 1
+
+    client._token_expires = datetime.min
+    client.get_prices(PRODUCT_IDS[:5])
+    assert upstream.calls["/token"] == 2
+    assert client.token_requests == 2
+
+
+def test_revoked_token_is_renewed_and_the_request_retried(client, upstream):
+    client.get_prices(PRODUCT_IDS[:1])
+    client._token = "revoked"
+
+    prices = client.get_prices(PRODUCT_IDS[:3])
+
+    assert set(prices) == set(PRODUCT_IDS[:3])
+    assert upstream.calls["/token"] == 2
+    # The first lookup, then the rejected and the retried one
+    assert upstream.calls["/pricing/product/"] == 3
+
+
+def test_prices_cost_one_request_per_batch(client, upstream):
+    prices = client.get_prices(PRODUCT_IDS)
+
+    assert set(prices) == set(PRODUCT_IDS)
+    assert upstream.calls["/pricing/product/"] == 3  # ceil(60 / 25)
+    # The highest printing's market price: the stand-in's Holofoil is within 5% of the card's
+    market = CARDS[0]["tcgplayer"]["prices"]["holofoil"]["market"]
+    assert prices[PRODUCT_IDS[0]] == pytest.approx(market, rel=0.06)
+
+
+def test_cards_are_fetched_in_batches_and_sets_cached(client, upstream):
+    wanted = list(reversed(PRODUCT_IDS))
+    cards = client.get_cards(wanted)
+
+    assert [card["id"] for card in cards] == wanted
+    assert upstream.calls["/catalog/products/"] == 3
+    assert upstream.calls["/pricing/product/"] == 3
+    assert cards[-1]["name"] == CARDS[0]["name"]
+    assert cards[-1]["set"] == CARDS[0]["set"]["name"]
+    assert cards[-1]["releaseDate"] == CARDS[0]["set"]["releaseDate"].replace("/", "-")
+
+    group_requests = upstream.calls["/catalog/groups/"]
+    client.get_cards(PRODUCT_IDS[:5])
+    assert upstream.calls["/catalog/groups/"] == group_requests
+
+
+def test_unknown_cards_are_left_out(client):
+    assert client.get_cards(["999999"]) == []
+    with pytest.raises(ValueError):
+        client.get_card("999999")
+
+
+def test_featured_cards_are_the_most_valuable(client):
+    markets = [card["tcgplayer"]["prices"]["holofoil"]["market"] for card in CARDS]
+    expected = sorted(range(len(CARDS)), key=lambda i: -markets[i])[:DISCOVER_SIZE]
+
+    assert [card["id"] for card in client.get_featured_cards()] == [PRODUCT_IDS[i] for i in expected]
+
+
+def test_new_releases_come_from_the_newest_set(client):
+    newest = max((card["set"] for card in CARDS), key=lambda card_set: card_set["releaseDate"])
+
+    cards = client.get_new_releases()
+
+    assert len(cards) == DISCOVER_SIZE
+    assert {card["set"] for card in cards} == {newest["name"]}
+
+
+def test_trending_cards_are_distinct_products(client):
+    cards = client.get_trending_cards()
+
+    assert len(cards) == DISCOVER_SIZE
+    assert len({card["id"] for card in cards}) == DISCOVER_SIZE
+    assert all(card["id"] in PRODUCT_IDS for card in cards)
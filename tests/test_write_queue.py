@@ -0,0 +1,140 @@
+"""The API server's group-committing writer (api_server/write_queue.py)."""
+import asyncio
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "api_server"))
+
+import async_database  # noqa: E402
+from async_database import AsyncConnectionPool  # noqa: E402
+from write_queue import WriteQueue  # noqa: E402
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / "writes.db")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE items (id INTEGER PRIMARY KEY)")
+    conn.close()
+    return path
+
+
+def stored(db_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        return sorted(row[0] for row in conn.execute("SELECT id FROM items"))
+    finally:
+        conn.close()
+
+
+async def insert(conn, item_id):
+    await conn.execute("INSERT INTO items (id) VALUES (?)", (item_id,))
+    return item_id, None
+
+
+async def insert_then_fail(conn, item_id):
+    await conn.execute("INSERT INTO items (id) VALUES (?)", (item_id,))
+    raise ValueError(f"write {item_id} failed")
+
+
+def test_queued_writes_share_one_commit(db_path):
+    async def main():
+        pool = AsyncConnectionPool(db_path, 2)
+        queue = WriteQueue(pool, window=0)
+        results = await asyncio.gather(*(queue.submit(insert, i) for i in range(20)))
+        await queue.close()
+        await pool.close()
+        return queue, results
+
+    queue, results = asyncio.run(main())
+
+    assert results == list(range(20))
+    assert stored(db_path) == list(range(20))
+    assert queue.groups == 1
+    assert queue.largest_group == 20
+
+
+def test_failed_write_is_rolled_back_without_its_group(db_path):
+    async def main():
+        pool = AsyncConnectionPool(db_path, 2)
+        queue = WriteQueue(pool, window=0)
+        writes = [queue.submit(insert_then_fail if i == 2 else insert, i) for i in range(5)]
+        results = await asyncio.gather(*writes, return_exceptions=True)
+        await queue.close()
+        await pool.close()
+        return queue, results
+
+    queue, results = asyncio.run(main())
+
+    assert [result for i, result in enumerate(results) if i != 2] == [0, 1, 3, 4]
+    assert isinstance(results[2], ValueError)
+    assert stored(db_path) == [0, 1, 3, 4]
+    assert (queue.groups, queue.writes, queue.failed) == (1, 5, 1)
+
+
+def test_close_from_another_loop_fails_the_waiting_writes(db_path):
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    pool = AsyncConnectionPool(db_path, 2)
+    queue = WriteQueue(pool, window=0)
+    started = threading.Event()
+
+    async def stuck(conn):
+        started.set()
+        await asyncio.sleep(3600)
+
+    try:
+        running = asyncio.run_coroutine_threadsafe(queue.submit(stuck), loop)
+        assert started.wait(5)
+        waiting = asyncio.run_coroutine_threadsafe(queue.submit(insert, 1), loop)
+        deadline = time.monotonic() + 5
+        while queue._queue.qsize() == 0 and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+        asyncio.run(queue.close())
+
+        with pytest.raises(RuntimeError):
+            running.result(5)
+        with pytest.raises(RuntimeError):
+            waiting.result(5)
+        assert stored(db_path) == []
+    finally:
+        asyncio.run_coroutine_threadsafe(pool.close(), loop).result(5)
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join(5)
+        loop.close()
+
+
+def test_concurrent_adds_and_deletes_of_one_card(tmp_path, monkeypatch):
+    monkeypatch.setattr(async_database.shards, "default_path", str(tmp_path / "cards.db"))
+    card = {"id": "base1-4", "name": "Charizard", "set_name": "Base", "rarity": "Rare Holo",
+            "image_url": "https://images.pokemontcg.io/base1/4.png", "price": 10.0, "card_number": "4"}
+
+    async def main():
+        try:
+            # Three adds for every delete, all in flight at once
+            writes = [async_database.delete_card(card["id"]) if i % 4 == 3
+                      else async_database.add_card_to_database(dict(card))
+                      for i in range(40)]
+            results = await asyncio.gather(*writes)
+            cards = await async_database.get_all_cards()
+            stats = await async_database.get_collection_stats()
+            return results, cards, stats
+        finally:
+            await async_database.close_pool()
+
+    results, cards, stats = asyncio.run(main())
+
+    assert not [result for result in results if "error" in result]
+    assert [(c["id"], c["quantity"]) for c in cards] == [(card["id"], 20)]
+    assert stats["total_cards"] == 20
+    assert stats["total_value"] == 200.0
+    conn = sqlite3.connect(str(tmp_path / "cards.db"))
+    assert conn.execute("SELECT quantity FROM pokemon_cards").fetchall() == [(20,)]
+    conn.close()